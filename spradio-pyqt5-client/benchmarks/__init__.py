@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks and performance harnesses for Innkeeper.
+
+Everything in here runs against a local stand-in of the Save Point Radio API
+(see ``benchmarks.fakeserver``) and a headless Qt platform, so no real server
+or display is needed. Run the modules from the ``spradio-pyqt5-client``
+directory, e.g. ``python -m benchmarks.bench_api``.
+'''
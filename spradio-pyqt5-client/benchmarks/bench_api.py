@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark suite for the client's data paths.
+
+Measures full refreshes (with and without cached responses), page flipping,
+save and delete round trips, table painting, rotation generation and model
+memory against the fake API server at several catalog sizes. Runs headless
+with the ``offscreen`` Qt platform:
+
+    python -m benchmarks.bench_api --sizes 1000 10000 100000
+'''
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QCoreApplication, QObject, Qt, QThreadPool
+from PyQt5.QtWidgets import QHeaderView, QStyledItemDelegate, QTableView
+
+from ui.cache import response_cache
+from ui.delegates import CachedTextDelegate
+from ui.export import export_catalog
+from ui.models.radio import SongTableModel
+from ui.rotation import load_rotation_catalog, RotationGenerator
+from ui.utils import delete_server_data, patch_server_data, post_server_data
+from ui.widgets import ArtistGroupBox, SongGroupBox
+
+from .environment import setup_application
+from .fakeserver import DEFAULT_TOKEN, run_server_process
+
+
+class ModelHost(QObject):
+    '''Stands in for a group box when a model is benchmarked on its own.'''
+    def __init__(self, plural, columns, paginate, windowed=False):
+        super().__init__()
+        self.plural = plural
+        self.columns = columns
+        self.paginate = paginate
+        self.windowed = windowed
+
+
+def timed(func, repeat):
+    '''Run ``func`` ``repeat`` times and return the wall times in seconds.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(name, size, times, **extra):
+    result = {'benchmark': name,
+              'size': size,
+              'runs': len(times),
+              'min': min(times),
+              'median': statistics.median(times),
+              'max': max(times)}
+    result.update(extra)
+    return result
+
+
+def bench_refresh(songs, artists, size, repeat):
+    def cold_refresh():
+        response_cache().clear()
+        songs.updateTable()
+
+    return [summarize('refresh songs page (cold)', size,
+                      timed(cold_refresh, repeat)),
+            summarize('refresh songs page', size,
+                      timed(songs.updateTable, repeat)),
+            summarize('refresh artists (windowed)', size,
+                      timed(artists.updateTable, repeat))]
+
+
+def bench_page_flip(songs, size, repeat):
+    songs.spinBoxCurrentPage.setValue(1)
+    flips = min(repeat * 4, songs.model.total_pages - 1)
+    if flips < 1:
+        return []
+    times = timed(songs.buttonNextPage.click, flips)
+    songs.spinBoxCurrentPage.setValue(1)
+    return [summarize('page flip', size, times)]
+
+
+def bench_contention(songs, size, repeat):
+    '''
+    Flip pages while a bulk export of the whole catalog runs in the
+    background, to check that the scheduler keeps page clicks fast.
+    '''
+    flips = min(repeat * 4, songs.model.total_pages - 1)
+    if flips < 1:
+        return []
+    songs.spinBoxCurrentPage.setValue(1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'songs.jsonl')
+        export = threading.Thread(target=export_catalog,
+                                  args=('songs', path, 'jsonl', False))
+        export.start()
+        times = timed(songs.buttonNextPage.click, flips)
+        export.join()
+    songs.spinBoxCurrentPage.setValue(1)
+    return [summarize('page flip during export', size, times)]
+
+
+def bench_save_delete(songs, size, repeat):
+    row = songs.model.rowData(songs.model.index(0, 0))
+
+    def save():
+        # Only the title, like an edit in the client: a PUT would empty the
+        # rest of the song.
+        patch_server_data('songs/' + str(row['id']),
+                          {'title': row['title'] + ' (Remix)'})
+        songs.updateTable()
+
+    created = []
+
+    def create():
+        status, results = post_server_data('songs', {'title': 'Benchmark'})
+        created.append(results['id'])
+
+    def delete():
+        delete_server_data('songs/' + str(created.pop()))
+        songs.updateTable()
+
+    results = [summarize('save round trip', size, timed(save, repeat))]
+    delete_times = []
+    for _ in range(repeat):
+        create()
+        delete_times += timed(delete, 1)
+    results.append(summarize('delete round trip', size, delete_times))
+    return results
+
+
+def bench_scroll_paint(songs, size, repeat):
+    '''
+    Scroll through every song a screen at a time, painting the table each
+    time, with the cached text delegate and with Qt's default one.
+    '''
+    host = ModelHost('songs', songs.columns, paginate=False)
+    model = SongTableModel(host)
+    model.updateData()
+    view = QTableView()
+    view.setModel(model)
+    view.resize(900, 600)
+    rows = view.verticalHeader()
+    rows.setSectionResizeMode(QHeaderView.Fixed)
+    rows.setDefaultSectionSize(songs.tableView.verticalHeader()
+                               .defaultSectionSize())
+    scroll_bar = view.verticalScrollBar()
+
+    results = []
+    for name, delegate in (('scroll and paint songs',
+                            CachedTextDelegate(view)),
+                           ('scroll and paint songs (default delegate)',
+                            QStyledItemDelegate(view))):
+        view.setItemDelegate(delegate)
+        times = []
+        for _ in range(repeat):
+            scroll_bar.setValue(0)
+            while True:
+                start = time.perf_counter()
+                view.viewport().grab()
+                times.append(time.perf_counter() - start)
+                if scroll_bar.value() >= scroll_bar.maximum():
+                    break
+                scroll_bar.setValue(scroll_bar.value() +
+                                    scroll_bar.pageStep())
+        results.append(summarize(name, size, times))
+    view.deleteLater()
+    model.store.release(model.name, model._ids)
+    return results
+
+
+def bench_rotation(size, repeat):
+    '''Build the alias table and generate 1,000-song rotations.'''
+    catalog = load_rotation_catalog()
+    generator = RotationGenerator(catalog, seed=0)
+    start = time.perf_counter()
+    generator.rebuild()
+    build = time.perf_counter() - start
+    times = timed(lambda: generator.generate(1000), repeat)
+    return [summarize('rotation table build', size, [build]),
+            summarize('generate 1000-song rotation', size, times)]
+
+
+def scroll_through(model):
+    '''Ask a windowed model for every page in turn, like a view scrolling.'''
+    pool = QThreadPool.globalInstance()
+    app = QCoreApplication.instance()
+    for row in range(0, model.rowCount(), model.page_size):
+        model.data(model.index(row, 0), Qt.DisplayRole)
+        pool.waitForDone()
+        app.processEvents()
+
+
+def bench_model_memory(songs, size, windowed=False):
+    host = ModelHost('songs', songs.columns, paginate=False,
+                     windowed=windowed)
+    model = SongTableModel(host)
+    # Measure the model alone, without response bodies kept by the cache.
+    cache = response_cache()
+    cache.clear()
+    max_size, cache.max_size = cache.max_size, 0
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    model.updateData()
+    if windowed:
+        scroll_through(model)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cache.max_size = max_size
+
+    rows = model.rowCount()
+    retained = current - before
+    cached = [id for (row, id) in model.loadedRows()]
+    # Let go of the rows so the next load starts from an empty store.
+    model.store.release(model.name, cached)
+    name = 'windowed song model load' if windowed else 'full song model load'
+    return [summarize(name, size, [elapsed],
+                      rows=rows,
+                      cached_rows=len(cached),
+                      retained_bytes=retained,
+                      peak_bytes=peak - before,
+                      bytes_per_row=retained // max(rows, 1))]
+
+
+def run(size, args):
+    with run_server_process(songs=size,
+                            latency=args.latency,
+                            page_size=args.page_size,
+                            token=DEFAULT_TOKEN) as base_url:
+        app, settings_dir = setup_application(base_url, DEFAULT_TOKEN)
+
+        songs = SongGroupBox()
+        artists = ArtistGroupBox()
+
+        results = []
+        results += bench_refresh(songs, artists, size, args.repeat)
+        results += bench_page_flip(songs, size, args.repeat)
+        results += bench_contention(songs, size, args.repeat)
+        results += bench_save_delete(songs, size, args.repeat)
+        results += bench_scroll_paint(songs, size, 1)
+        results += bench_rotation(size, args.repeat)
+        if not args.skip_memory:
+            results += bench_model_memory(songs, size)
+            results += bench_model_memory(songs, size, windowed=True)
+
+        songs.deleteLater()
+        artists.deleteLater()
+        app.processEvents()
+        return results
+
+
+def report(results):
+    line = '{:<30} {:>8} {:>5} {:>10} {:>10} {:>10}  {}'
+    print(line.format('benchmark', 'size', 'runs',
+                      'min ms', 'median ms', 'max ms', 'extra'))
+    for result in results:
+        extra = {k: v for k, v in result.items()
+                 if k not in ('benchmark', 'size', 'runs',
+                              'min', 'median', 'max')}
+        print(line.format(result['benchmark'],
+                          result['size'],
+                          result['runs'],
+                          '{:.2f}'.format(result['min'] * 1000),
+                          '{:.2f}'.format(result['median'] * 1000),
+                          '{:.2f}'.format(result['max'] * 1000),
+                          ' '.join('{}={}'.format(k, v)
+                                   for k, v in extra.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Innkeeper benchmarks.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='catalog sizes (number of songs) to test')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of artificial latency per request')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--skip-memory', action='store_true',
+                        help='skip the full song model memory benchmark')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results to a JSON file')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results += run(size, args)
+
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Headless UI performance regression harness.
+
+Scripts real user flows through ``Client``, ``PlaylistTab`` and the group
+boxes against the fake API server, driven from the Qt event loop so that any
+blocking work on the GUI thread shows up as an event-loop stall. Each flow
+reports wall time and stall time, and the run as a whole its peak RSS (the
+flows share one process, so it can't be told apart by flow). Results can be
+checked against a stored baseline, and the exit status is 1 if any regressed:
+
+    python -m benchmarks.bench_ui --update-baseline
+    python -m benchmarks.bench_ui --threshold 0.25
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QEventLoop, QObject, QTimer
+from PyQt5.QtWidgets import QApplication, QDialogButtonBox, QMessageBox
+
+from ui.mainwindow import Client
+from ui.tasks import stop_tasks
+
+from .environment import setup_application
+from .fakeserver import DEFAULT_TOKEN, run_server_process
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__),
+                                'ui_baseline.json')
+
+
+def peak_rss():
+    '''Peak resident set size of this process in bytes, if known.'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StallMonitor(QObject):
+    '''
+    Heartbeat timer that measures how long the event loop was unable to
+    service it. Any gap longer than ``interval`` plus ``tolerance`` counts as
+    a stall.
+    '''
+    def __init__(self, interval=10, tolerance=0.02, parent=None):
+        super().__init__(parent)
+        self.interval = interval / 1000
+        self.tolerance = tolerance
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.beat)
+        self.reset()
+
+    def reset(self):
+        self.last = time.perf_counter()
+        self.stall_time = 0.0
+        self.longest_stall = 0.0
+
+    def start(self):
+        self.reset()
+        self.timer.start()
+
+    def stop(self):
+        self.beat()
+        self.timer.stop()
+
+    def beat(self):
+        now = time.perf_counter()
+        gap = now - self.last
+        self.last = now
+        if gap > self.interval + self.tolerance:
+            stall = gap - self.interval
+            self.stall_time += stall
+            self.longest_stall = max(self.longest_stall, stall)
+
+
+def accept_modal(button):
+    '''
+    Schedule a click on ``button`` of the next modal dialog, for flows that
+    go through ``exec_()``.
+    '''
+    def click():
+        widget = QApplication.activeModalWidget()
+        if widget is None:
+            QTimer.singleShot(10, click)
+        elif isinstance(widget, QMessageBox):
+            widget.button(button).click()
+        else:
+            widget.buttonBox.button(button).click()
+    QTimer.singleShot(0, click)
+
+
+def run_flow(monitor, name, steps):
+    '''
+    Run each step from the event loop, one per iteration, and return the
+    measurements for the whole flow.
+    '''
+    loop = QEventLoop()
+    pending = list(steps)
+
+    def next_step():
+        if not pending:
+            loop.quit()
+            return
+        pending.pop(0)()
+        QTimer.singleShot(0, next_step)
+
+    monitor.start()
+    start = time.perf_counter()
+    QTimer.singleShot(0, next_step)
+    loop.exec_()
+    wall = time.perf_counter() - start
+    monitor.stop()
+    return {'flow': name,
+            'wall': wall,
+            'stall': monitor.stall_time,
+            'longest_stall': monitor.longest_stall}
+
+
+def user_flows(state):
+    '''Yield (name, steps) for each scripted user flow, in order.'''
+    def start_client():
+        state['client'] = Client()
+
+    yield 'start-up', [start_client]
+
+    def songs():
+        return state['client'].tabPlaylist.groupBoxSongs
+
+    def page_forward():
+        box = songs()
+        box.buttonFirstPage.click()
+        steps = []
+        for _ in range(1, box.model.total_pages):
+            steps.append(box.buttonNextPage.click)
+        return steps
+
+    yield 'page 1 to last page', page_forward()
+
+    def select_first_song():
+        songs().tableView.selectRow(0)
+
+    def edit_song():
+        box = songs()
+        dialog_title = box.current_selection['title'] + ' (Remix)'
+
+        # The dialog opens once the item is loaded in the background, so
+        # wait here until it has been saved and closed.
+        closed = QEventLoop()
+
+        def change_title():
+            dialog = QApplication.activeModalWidget()
+            if dialog is None:
+                QTimer.singleShot(10, change_title)
+                return
+            field = dialog.structure['title']['widgets']['field']
+            field.setText(dialog_title)
+            dialog.dataModified()
+            dialog.finished.connect(closed.quit)
+            dialog.buttonBox.button(QDialogButtonBox.Ok).click()
+        QTimer.singleShot(0, change_title)
+        box.buttonEdit.click()
+        closed.exec_()
+
+    yield 'open and save dialog', [select_first_song, edit_song]
+
+    def delete_song():
+        accept_modal(QMessageBox.Yes)
+        songs().buttonDelete.click()
+
+    yield 'delete', [select_first_song, delete_song]
+
+    def refresh_all():
+        tab = state['client'].tabPlaylist
+        return [box.buttonRefresh.click
+                for box in (tab.groupBoxArtists, tab.groupBoxAlbums,
+                            tab.groupBoxGames, tab.groupBoxSongs)]
+
+    yield 'refresh', refresh_all()
+
+
+def run(args):
+    with run_server_process(songs=args.songs,
+                            latency=args.latency,
+                            token=DEFAULT_TOKEN) as base_url:
+        app, settings_dir = setup_application(base_url, DEFAULT_TOKEN)
+        monitor = StallMonitor()
+        state = {}
+        results = []
+        for name, steps in user_flows(state):
+            results.append(run_flow(monitor, name, steps))
+        # Finish with the tasks still loading pages before the window and
+        # the server go away.
+        stop_tasks()
+        state['client'].hide()
+        state['client'].deleteLater()
+        app.processEvents()
+        return {'flows': results, 'peak_rss': peak_rss()}
+
+
+def compare(results, baseline, threshold, slack):
+    '''
+    Return a list of regression messages. A metric regresses when it exceeds
+    the baseline by more than ``threshold`` (a fraction) and by more than
+    ``slack`` absolute units, so near-zero baselines don't flap.
+    '''
+    def check(name, metric, old, new, minimum):
+        if old is None or new is None:
+            return
+        if new > old * (1 + threshold) and new - old > minimum:
+            regressions.append('{}: {} {:.4g} -> {:.4g}'
+                               .format(name, metric, old, new))
+
+    regressions = []
+    flows = {b['flow']: b for b in baseline.get('flows', [])}
+    for result in results['flows']:
+        previous = flows.get(result['flow'])
+        if previous is None:
+            continue
+        for metric in ('wall', 'stall'):
+            check(result['flow'], metric, previous.get(metric),
+                  result.get(metric), slack)
+    check('whole run', 'peak_rss', baseline.get('peak_rss'),
+          results['peak_rss'], 16 * 1024 * 1024)
+    return regressions
+
+
+def report(results):
+    line = '{:<22} {:>10} {:>10} {:>12}'
+    print(line.format('flow', 'wall ms', 'stall ms', 'longest ms'))
+    for result in results['flows']:
+        print(line.format(result['flow'],
+                          '{:.1f}'.format(result['wall'] * 1000),
+                          '{:.1f}'.format(result['stall'] * 1000),
+                          '{:.1f}'.format(result['longest_stall'] * 1000)))
+    rss = results['peak_rss']
+    print('\nPeak RSS of the run: {}'.format(
+        '-' if rss is None else '{:.1f} MiB'.format(rss / (1024 * 1024))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Innkeeper UI harness.')
+    parser.add_argument('--songs', type=int, default=2000,
+                        help='number of songs in the fake catalog')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds of artificial latency per request')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='path of the stored baseline results')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed regression as a fraction of baseline')
+    parser.add_argument('--slack', type=float, default=0.05,
+                        help='allowed absolute regression in seconds')
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as output:
+            json.dump(results, output, indent=2)
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as stored:
+            regressions = compare(results, json.load(stored),
+                                  args.threshold, args.slack)
+        if regressions:
+            print('\nRegressions against ' + args.baseline + ':')
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Headless application setup shared by the benchmarks.
+
+Points the client at a fake server without touching the user's real
+settings, data or keyring: QSettings are written as INI files to a temporary
+directory, QStandardPaths is put in test mode and the API token lives in an
+in-memory keyring backend. The directory is removed when the process exits.
+'''
+
+import atexit
+import os
+import shutil
+import tempfile
+
+import keyring
+import keyring.backend
+
+from PyQt5.QtCore import QCoreApplication, QSettings, QStandardPaths
+from PyQt5.QtWidgets import QApplication
+
+
+ORGANIZATION_NAME = 'Save Point Radio'
+ORGANIZATION_DOMAIN = 'savepointradio.net'
+APPLICATION_NAME = 'Innkeeper Benchmarks'
+
+# Kept for the whole process: when the application is destroyed PyQt
+# deletes the objects made under it, including the shared entity store.
+_app = None
+
+
+class MemoryKeyring(keyring.backend.KeyringBackend):
+    '''Keyring backend that never leaves the process.'''
+    priority = 1
+
+    def __init__(self):
+        super().__init__()
+        self._passwords = {}
+
+    def get_password(self, service, username):
+        return self._passwords.get((service, username))
+
+    def set_password(self, service, username, password):
+        self._passwords[(service, username)] = password
+
+    def delete_password(self, service, username):
+        self._passwords.pop((service, username), None)
+
+
+def setup_application(base_url, token):
+    '''
+    Create an offscreen QApplication configured to talk to ``base_url``.
+    Returns the application and the temporary settings directory.
+    '''
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    QCoreApplication.setOrganizationName(ORGANIZATION_NAME)
+    QCoreApplication.setOrganizationDomain(ORGANIZATION_DOMAIN)
+    QCoreApplication.setApplicationName(APPLICATION_NAME)
+
+    settings_dir = tempfile.mkdtemp(prefix='innkeeper-bench-')
+    atexit.register(shutil.rmtree, settings_dir, ignore_errors=True)
+    QSettings.setDefaultFormat(QSettings.IniFormat)
+    QSettings.setPath(QSettings.IniFormat, QSettings.UserScope, settings_dir)
+    QStandardPaths.setTestModeEnabled(True)
+
+    global _app
+    app = _app = QApplication.instance() or QApplication(['innkeeper-bench'])
+
+    settings = QSettings()
+    settings.setValue('server/api_base_url', base_url)
+    settings.sync()
+
+    keyring.set_keyring(MemoryKeyring())
+    keyring.set_password(APPLICATION_NAME, 'Token', token)
+    return app, settings_dir
@@ -0,0 +1,651 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+A local stand-in for the Save Point Radio REST API.
+
+Serves a synthetic catalog of songs, artists, albums and games in the same
+shape that ``ui/utils.py`` expects from the real server: paginated lists with
+``results``/``total_pages``, token authentication and CRUD on every endpoint.
+Latency can be injected per request to mimic a remote server.
+
+Run it on its own with ``python -m benchmarks.fakeserver --songs 10000`` or
+start it from Python with ``run_server_process()``.
+'''
+
+import argparse
+import contextlib
+import gzip
+import hashlib
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+import unicodedata
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+DEFAULT_TOKEN = 'benchmark-token'
+DEFAULT_PAGE_SIZE = 50
+ENDPOINTS = ('artists', 'albums', 'games', 'songs')
+DECIMAL_FIELDS = {'length'}
+DEFAULTS = {'artists': {'alias': '', 'first_name': '', 'last_name': ''},
+            'albums': {'title': ''},
+            'games': {'title': ''},
+            'songs': {'album': None,
+                      'artists': [],
+                      'game': None,
+                      'song_type': 'S',
+                      'title': '',
+                      'num_played': 0,
+                      'last_played': None,
+                      'length': None,
+                      'path': ''}}
+
+FIRST_NAMES = ['Koji', 'Nobuo', 'Yoko', 'David', 'Grant', 'Manami', 'Hip',
+               'Motoi', 'Yuzo', 'Jeremy', 'Michiru', 'Akira', 'Tim', 'Lena']
+LAST_NAMES = ['Kondo', 'Uematsu', 'Shimomura', 'Wise', 'Kirkhope', 'Tanaka',
+              'Sakuraba', 'Koshiro', 'Soule', 'Yamane', 'Yamaoka', 'Follin']
+ALIASES = ['', '', '', 'Zuntata', 'Virt', 'Big Giant Circles', 'Jake']
+WORDS = ['Crystal', 'Theme', 'Battle', 'Overworld', 'Castle', 'Dream',
+         'Forest', 'Boss', 'Ending', 'Prelude', 'Town', 'Dungeon', 'Star',
+         'Ocean', 'Fire', 'Night', 'Final', 'Legend', 'Quest', 'Hero']
+
+
+class FakeCatalog:
+    '''In-memory catalog of radio items, generated deterministically.'''
+    def __init__(self, songs=1000, seed=0):
+        self.lock = threading.Lock()
+        self.items = {endpoint: {} for endpoint in ENDPOINTS}
+        self.next_id = {endpoint: 1 for endpoint in ENDPOINTS}
+        self.version = 0
+        self.generate(songs, random.Random(seed))
+        self.touch()
+
+    def touch(self):
+        '''Note that the catalog changed, for validating cached pages.'''
+        self.version += 1
+        self.modified = formatdate(usegmt=True)
+
+    def _title(self, rng, words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+    def _add(self, endpoint, item):
+        item['id'] = self.next_id[endpoint]
+        self.next_id[endpoint] += 1
+        self.items[endpoint][item['id']] = item
+        return item
+
+    def generate(self, songs, rng):
+        num_artists = max(1, songs // 10)
+        num_albums = max(1, songs // 20)
+        num_games = max(1, songs // 20)
+
+        for _ in range(num_artists):
+            self._add('artists', {'alias': rng.choice(ALIASES),
+                                  'first_name': rng.choice(FIRST_NAMES),
+                                  'last_name': rng.choice(LAST_NAMES)})
+        for _ in range(num_albums):
+            self._add('albums', {'title': self._title(rng, 3)})
+        for _ in range(num_games):
+            self._add('games', {'title': self._title(rng, 2)})
+
+        epoch = datetime(2018, 1, 1)
+        for number in range(songs):
+            played = rng.randint(0, 200) if rng.random() > 0.1 else 0
+            last = None
+            if played:
+                last = (epoch + timedelta(minutes=rng.randint(0, 525600)))
+                last = last.isoformat() + 'Z'
+            artists = rng.sample(range(1, num_artists + 1),
+                                 min(num_artists, rng.randint(1, 3)))
+            self._add('songs', {
+                'album': rng.randint(1, num_albums),
+                'artists': artists,
+                'game': rng.randint(1, num_games),
+                'song_type': 'J' if rng.random() < 0.05 else 'S',
+                'title': self._title(rng, 4),
+                'num_played': played,
+                'last_played': last,
+                'length': '{:.2f}'.format(rng.uniform(30.0, 480.0)),
+                'path': '/srv/radio/music/{:06d}.ogg'.format(number)})
+
+    def serialize(self, endpoint, item, fields=None):
+        '''
+        Expand an item the way the API does, with nested relations. If given
+        a set of field names, only those are included.
+        '''
+        if fields:
+            item = {k: v for (k, v) in item.items() if k in fields}
+        if endpoint != 'songs':
+            return dict(item)
+        song = dict(item)
+        if 'album' in item:
+            song['album'] = self.items['albums'].get(item.get('album'))
+        if 'game' in item:
+            song['game'] = self.items['games'].get(item.get('game'))
+        if 'artists' in item:
+            song['artists'] = [self.items['artists'][a]
+                               for a in item['artists']
+                               if a in self.items['artists']]
+        return song
+
+    def etag(self, item):
+        '''An entity tag that changes whenever the stored item does.'''
+        digest = hashlib.md5(json.dumps(item, sort_keys=True).encode('utf-8'))
+        return '"{}"'.format(digest.hexdigest()[:16])
+
+    def _resolve(self, endpoint, value):
+        '''Turn a relation from a request body into an id.'''
+        if isinstance(value, dict):
+            return value.get('id')
+        if isinstance(value, int) or value is None:
+            return value
+        value = str(value).strip()
+        if value.isdigit():
+            return int(value)
+        for item in self.items[endpoint].values():
+            if item.get('title') == value:
+                return item['id']
+        return None
+
+    def normalize(self, endpoint, data, original=None):
+        '''Merge a request body into a stored item.'''
+        item = dict(DEFAULTS[endpoint])
+        item.update(original or {})
+        for key, value in data.items():
+            if key == 'id':
+                continue
+            if endpoint == 'songs' and key in ('album', 'game'):
+                value = self._resolve(key + 's', value)
+            elif endpoint == 'songs' and key == 'artists':
+                if isinstance(value, str):
+                    value = [v for v in value.split(',') if v.strip()]
+                value = [self._resolve('artists', v) for v in value or []]
+                value = [v for v in value if v is not None]
+            item[key] = value
+        return item
+
+    def lookup(self, endpoint, item, key):
+        '''
+        The value of an ordering field, following relations the way Django
+        does for names like ``album__title``, as the database sorts it:
+        decimal fields (sent as text) as numbers, and text ignoring case
+        and accents.
+        '''
+        field, _, rest = key.partition('__')
+        value = item.get(field)
+        if rest and value is not None:
+            related = field if field.endswith('s') else field + 's'
+            value = self.items[related].get(value, {}).get(rest)
+        if isinstance(value, str):
+            if key in DECIMAL_FIELDS:
+                return float(value)
+            value = unicodedata.normalize('NFKD', value.casefold())
+            return ''.join(c for c in value if not unicodedata.combining(c))
+        return value
+
+    def page(self, endpoint, page, page_size, fields=None, ordering=None):
+        with self.lock:
+            items = list(self.items[endpoint].values())
+        if ordering:
+            # Sort by the last field first, so earlier ones take precedence.
+            for field in reversed(ordering.split(',')):
+                key = field.lstrip('-')
+                # Like the database, keep empty values at the end either way.
+                values = {i['id']: self.lookup(endpoint, i, key)
+                          for i in items}
+                present = [i for i in items if values[i['id']] is not None]
+                missing = [i for i in items if values[i['id']] is None]
+                items = sorted(present, key=lambda i: values[i['id']],
+                               reverse=field.startswith('-')) + missing
+        total_pages = max(1, math.ceil(len(items) / page_size))
+        if page < 1 or page > total_pages:
+            return None
+        start = (page - 1) * page_size
+        return {'count': len(items),
+                'total_pages': total_pages,
+                'results': [self.serialize(endpoint, i, fields)
+                            for i in items[start:start + page_size]]}
+
+
+class FakePlayback:
+    '''
+    Pretends to play through the catalog in real time, one track every
+    ``track_seconds``, to back the station status endpoints.
+    '''
+    def __init__(self, catalog, track_seconds=30.0, events=True):
+        self.catalog = catalog
+        self.track_seconds = track_seconds
+        self.events = events
+        self.started = time.time()
+        self.order = list(catalog.items['songs'])
+
+    def position(self):
+        return int((time.time() - self.started) // self.track_seconds)
+
+    def enqueue(self, ids):
+        '''Play the given songs next, in order.'''
+        if not self.order:
+            self.order = list(ids)
+            return
+        after = self.position() % len(self.order) + 1
+        self.order[after:after] = ids
+
+    def wait_for_change(self, index):
+        '''Sleep until the track after ``index`` starts.'''
+        start = self.started + (index + 1) * self.track_seconds
+        time.sleep(max(0.0, start - time.time()))
+
+    def _entry(self, index, key):
+        if index < 0 or not self.order:
+            return None
+        song_id = self.order[index % len(self.order)]
+        song = self.catalog.items['songs'].get(song_id)
+        if song is None:
+            return None
+        song = self.catalog.serialize('songs', song)
+        song['length'] = '{:.2f}'.format(self.track_seconds)
+        start = self.started + index * self.track_seconds
+        song[key] = datetime.fromtimestamp(start, timezone.utc).isoformat()
+        return song
+
+    def status(self):
+        '''Return the current track index and the station status.'''
+        index = self.position()
+        with self.catalog.lock:
+            queue = [self._entry(i, 'queued_for')
+                     for i in range(index + 1, index + 6)]
+            history = [self._entry(i, 'played_at')
+                       for i in range(index - 1, index - 11, -1)]
+            status = {'current': self._entry(index, 'started_at'),
+                      'queue': [s for s in queue if s],
+                      'history': [s for s in history if s]}
+        if self.events:
+            status['events'] = 'radio/events'
+        return index, status
+
+
+class FakeRadioRequestHandler(BaseHTTPRequestHandler):
+    '''Request handler emulating the Save Point Radio REST API.'''
+    server_version = 'FakeSavePointRadio/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload=None, headers=None):
+        body = b''
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+        encoding = self.headers.get('Accept-Encoding', '')
+        compress = len(body) > 1024 and 'gzip' in encoding
+        if compress:
+            body = gzip.compress(body, compresslevel=5)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            return None
+
+    def _route(self):
+        '''
+        Authenticate and split the path into (endpoint, item id, query). On
+        failure the error response is sent and None is returned.
+        '''
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if not self.server.admit():
+            self._send_json(429, {'detail': 'Request was throttled.'},
+                            {'Retry-After': '1'})
+            return None
+
+        expected = 'Token ' + self.server.token
+        if self.headers.get('Authorization') != expected:
+            self._send_json(401, {'detail': 'Invalid token.'})
+            return None
+
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if parts and parts[0] == 'api':
+            parts = parts[1:]
+        if len(parts) == 2 and parts[0] == 'radio' and (
+                (self.command == 'GET' and parts[1] in ('status', 'events')) or
+                (self.command == 'POST' and parts[1] == 'queue')):
+            return parts[0], parts[1], parse_qs(url.query)
+        if not parts or parts[0] not in ENDPOINTS or len(parts) > 2:
+            self._send_json(404, {'detail': 'Not found.'})
+            return None
+        item_id = None
+        if len(parts) == 2:
+            if not parts[1].isdigit():
+                self._send_json(404, {'detail': 'Not found.'})
+                return None
+            item_id = int(parts[1])
+        return parts[0], item_id, parse_qs(url.query)
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return
+        endpoint, item_id, query = route
+        if endpoint == 'radio':
+            self._radio(item_id)
+            return
+        catalog = self.server.catalog
+        fields = None
+        if query.get('fields'):
+            fields = set(query['fields'][0].split(','))
+        if item_id is not None:
+            with catalog.lock:
+                item = catalog.items[endpoint].get(item_id)
+                if item is not None:
+                    etag = catalog.etag(item)
+                    item = catalog.serialize(endpoint, item, fields)
+            if item is None:
+                self._send_json(404, {'detail': 'Not found.'})
+            elif self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self._send_json(200, item, {'ETag': etag})
+            return
+
+        try:
+            page = int(query.get('page', ['1'])[0])
+        except ValueError:
+            page = 0
+        ordering = query.get('ordering', [None])[0]
+        # Any change to the catalog may change any page (songs embed their
+        # relations), so pages are validated by the catalog's version.
+        with catalog.lock:
+            etag = '"{}-{}"'.format(catalog.version,
+                                    hashlib.md5(self.path.encode('utf-8'))
+                                    .hexdigest()[:8])
+            modified = catalog.modified
+        if (self.headers.get('If-None-Match') == etag or
+                (not self.headers.get('If-None-Match') and
+                 self.headers.get('If-Modified-Since') == modified)):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        results = catalog.page(endpoint, page, self.server.page_size,
+                               fields, ordering)
+        if results is None:
+            self._send_json(404, {'detail': 'Invalid page.'})
+        else:
+            self._send_json(200, results, {'ETag': etag,
+                                           'Last-Modified': modified})
+
+    def _radio(self, name):
+        '''Serve the station status, or a stream of change events.'''
+        playback = self.server.playback
+        if name == 'status':
+            index, status = playback.status()
+            etag = '"{}"'.format(index)
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self._send_json(200, status, {'ETag': etag})
+            return
+
+        if not playback.events:
+            self._send_json(404, {'detail': 'Not found.'})
+            return
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        index = playback.position()
+        try:
+            while True:
+                playback.wait_for_change(index)
+                index = playback.position()
+                self.wfile.write('data: {{"index": {}}}\n\n'
+                                 .format(index).encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        route = self._route()
+        if route is None:
+            return
+        endpoint, item_id, query = route
+        data = self._read_json()
+        if endpoint == 'radio':
+            self._enqueue(data)
+            return
+        if item_id is not None or data is None:
+            self._send_json(400, {'detail': 'Bad request.'})
+            return
+        catalog = self.server.catalog
+        with catalog.lock:
+            item = catalog._add(endpoint, catalog.normalize(endpoint, data))
+            catalog.touch()
+            item = catalog.serialize(endpoint, item)
+        self._send_json(201, item)
+
+    def _enqueue(self, data):
+        '''Queue songs to play after the current one.'''
+        songs = (data or {}).get('songs')
+        catalog = self.server.catalog
+        with catalog.lock:
+            valid = (isinstance(songs, list) and
+                     all(id in catalog.items['songs'] for id in songs))
+            if valid:
+                self.server.playback.enqueue(songs)
+        if not valid:
+            self._send_json(400, {'songs': ['Unknown or missing songs.']})
+        else:
+            self._send_json(201, {'queued': len(songs)})
+
+    def _update(self, partial):
+        route = self._route()
+        if route is None:
+            return
+        endpoint, item_id, query = route
+        data = self._read_json()
+        if item_id is None or data is None:
+            self._send_json(400, {'detail': 'Bad request.'})
+            return
+        catalog = self.server.catalog
+        expected = self.headers.get('If-Match')
+        conflict = False
+        with catalog.lock:
+            original = catalog.items[endpoint].get(item_id)
+            if original is not None:
+                if expected and expected != catalog.etag(original):
+                    conflict = True
+                else:
+                    if not partial:
+                        original = {'id': item_id}
+                    item = catalog.normalize(endpoint, data, original)
+                    item['id'] = item_id
+                    catalog.items[endpoint][item_id] = item
+                    catalog.touch()
+                    etag = catalog.etag(item)
+                    item = catalog.serialize(endpoint, item)
+        if original is None:
+            self._send_json(404, {'detail': 'Not found.'})
+        elif conflict:
+            self._send_json(412, {'detail': 'Precondition failed.'})
+        else:
+            self._send_json(200, item, {'ETag': etag})
+
+    def do_PUT(self):
+        self._update(partial=False)
+
+    def do_PATCH(self):
+        self._update(partial=True)
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None:
+            return
+        endpoint, item_id, query = route
+        catalog = self.server.catalog
+        with catalog.lock:
+            item = None
+            if item_id is not None:
+                item = catalog.items[endpoint].pop(item_id, None)
+                if item is not None:
+                    catalog.touch()
+        if item is None:
+            self._send_json(404, {'detail': 'Not found.'})
+        else:
+            self._send_json(204)
+
+
+class FakeRadioServer(ThreadingHTTPServer):
+    '''HTTP server holding a ``FakeCatalog`` and its serving options.'''
+    daemon_threads = True
+
+    def __init__(self,
+                 address=('127.0.0.1', 0),
+                 songs=1000,
+                 seed=0,
+                 latency=0.0,
+                 page_size=DEFAULT_PAGE_SIZE,
+                 token=DEFAULT_TOKEN,
+                 track_seconds=30.0,
+                 events=True,
+                 rate_limit=0,
+                 verbose=False):
+        super().__init__(address, FakeRadioRequestHandler)
+        self.catalog = FakeCatalog(songs, seed)
+        self.playback = FakePlayback(self.catalog, track_seconds, events)
+        self.latency = latency
+        self.page_size = page_size
+        self.token = token
+        self.verbose = verbose
+        self.rate_limit = rate_limit
+        self._recent = deque()
+        self._recent_lock = threading.Lock()
+
+    def admit(self):
+        '''
+        Whether another request fits in the rate limit (requests per second
+        over the last second), like a throttled API would decide.
+        '''
+        if not self.rate_limit:
+            return True
+        with self._recent_lock:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                return False
+            self._recent.append(now)
+            return True
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/api/'.format(host, port)
+
+
+@contextlib.contextmanager
+def run_server_process(songs=1000,
+                       seed=0,
+                       latency=0.0,
+                       page_size=DEFAULT_PAGE_SIZE,
+                       token=DEFAULT_TOKEN,
+                       rate_limit=0):
+    '''
+    Start the fake server in a child process and yield its API base URL.
+
+    A separate process keeps the server's catalog and threads out of the
+    client's timings and memory measurements.
+    '''
+    args = [sys.executable, '-m', 'benchmarks.fakeserver',
+            '--songs', str(songs),
+            '--seed', str(seed),
+            '--latency', str(latency),
+            '--page-size', str(page_size),
+            '--token', token,
+            '--rate-limit', str(rate_limit)]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    try:
+        line = process.stdout.readline().strip()
+        if not line.startswith('http'):
+            raise RuntimeError('Fake server failed to start.')
+        yield line
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--songs', type=int, default=1000,
+                        help='number of songs in the synthetic catalog')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of delay added to every request')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument('--token', default=DEFAULT_TOKEN)
+    parser.add_argument('--track-seconds', type=float, default=30.0,
+                        help='how long each track "plays" for')
+    parser.add_argument('--no-events', action='store_true',
+                        help="don't offer a change event stream")
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='answer 429 past this many requests per second')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = FakeRadioServer((args.host, args.port),
+                             songs=args.songs,
+                             seed=args.seed,
+                             latency=args.latency,
+                             page_size=args.page_size,
+                             token=args.token,
+                             track_seconds=args.track_seconds,
+                             events=not args.no_events,
+                             rate_limit=args.rate_limit,
+                             verbose=args.verbose)
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
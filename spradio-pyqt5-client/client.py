@@ -19,13 +19,17 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import argparse
+import locale
 import sys
 import traceback
 
-from PyQt5.QtCore import QCoreApplication, qFatal, QT_VERSION
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QCoreApplication, qFatal, QSettings, QT_VERSION
 
-from ui.mainwindow import Client
+from ui.export import EXPORT_ENDPOINTS, EXPORT_FORMATS
+from ui.headless import COMMANDS, run
+from ui.memory import start_tracing_allocations
+from ui.tracing import start_tracing
 
 
 ORGANIZATION_NAME = 'Save Point Radio'
@@ -46,6 +50,50 @@ if QT_VERSION >= 0x50501:
 sys.excepthook = excepthook
 
 
+def parse_args(argv):
+    '''Parse Innkeeper's own options, leaving the rest for Qt.'''
+    parser = argparse.ArgumentParser(description='Innkeeper')
+    parser.add_argument('--headless', choices=COMMANDS,
+                        help='run a command and exit, without opening a '
+                             'window: sync a local mirror of the catalog, '
+                             'import or export part of it, or print its '
+                             'statistics')
+    parser.add_argument('--export', choices=EXPORT_ENDPOINTS,
+                        metavar='ENDPOINT',
+                        help='same as --headless export --endpoint ENDPOINT')
+    parser.add_argument('--endpoint', choices=EXPORT_ENDPOINTS,
+                        help='part of the catalog to import or export '
+                             '(sync syncs every part unless given one)')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS),
+                        help='file format to import or export (default: '
+                             'csv, or from the file name when importing)')
+    parser.add_argument('--input', help='file to import')
+    parser.add_argument('--output',
+                        help='file to export to, folder of the mirror to '
+                             'sync, or file to save statistics to as JSON')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='start an unfinished export over')
+    parser.add_argument('--analyze', action='store_true',
+                        help='measure the length, loudness and peak of '
+                             'imported songs from their WAV (or, with '
+                             'soundfile, FLAC) files')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace memory allocations from the start; '
+                             'headless commands print a memory report')
+    parser.add_argument('--trace', nargs='?', const='', metavar='FILE',
+                        help='record what the client does as a Chrome '
+                             'trace, in FILE or in the data folder')
+    args, qt_args = parser.parse_known_args(argv[1:])
+    if args.export:
+        args.headless, args.endpoint = 'export', args.export
+    if args.headless in ('import', 'export') and not args.endpoint:
+        parser.error('--headless {} needs an --endpoint'
+                     .format(args.headless))
+    if args.headless == 'import' and not args.input:
+        parser.error('--headless import needs an --input file')
+    return args, qt_args
+
+
 def main():
     ''' Main loop for the Innkeeper application.'''
     global app
@@ -54,7 +102,26 @@ def main():
     QCoreApplication.setOrganizationDomain(ORGANIZATION_DOMAIN)
     QCoreApplication.setApplicationName(APPLICATION_NAME)
 
-    app = QApplication(sys.argv)
+    # Text is sorted by the user's locale, not by code point.
+    try:
+        locale.setlocale(locale.LC_ALL, '')
+    except locale.Error:
+        pass
+
+    args, qt_args = parse_args(sys.argv)
+    if args.memory:
+        start_tracing_allocations()
+    if args.trace is not None or QSettings().value('diagnostics/trace',
+                                                   False, type=bool):
+        start_tracing(args.trace or None)
+    if args.headless:
+        app = QCoreApplication(sys.argv[:1] + qt_args)
+        sys.exit(run(args))
+
+    # Imported here, so running headless never loads the widgets.
+    from PyQt5.QtWidgets import QApplication
+    from ui.mainwindow import Client
+    app = QApplication(sys.argv[:1] + qt_args)
     client = Client()
     sys.exit(app.exec_())
 
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Measures songs from their audio files while they are imported: their true
+duration, integrated loudness (ITU-R BS.1770, in LUFS) and sample peak (in
+dBFS), so lengths don't depend on tags and the loudness of songs can be
+compared.
+
+WAV files are decoded with the standard library, and FLAC, Ogg and the rest
+with ``soundfile``, if it is installed. Files are decoded and measured a
+block at a time with NumPy, in a pool of processes, one per core.
+'''
+
+import hashlib
+import json
+import multiprocessing
+import os
+import wave
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PyQt5.QtCore import QStandardPaths
+
+
+BLOCK_FRAMES = 1 << 16
+# Loudness is measured over 400 ms blocks that overlap by 75%, so in steps
+# of 100 ms.
+STEP_SECONDS = 0.1
+STEPS_PER_BLOCK = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def analysis_path():
+    '''Where what was measured of each file is kept.'''
+    return os.path.join(QStandardPaths.writableLocation(
+        QStandardPaths.AppDataLocation), 'analysis.json')
+
+
+def load_analysis(path):
+    '''File path to what was measured of it, from an earlier import.'''
+    try:
+        with open(path, encoding='utf-8') as saved:
+            records = json.load(saved)
+    except (OSError, ValueError):
+        return {}
+    return records if isinstance(records, dict) else {}
+
+
+def save_analysis(path, records):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as saved:
+        json.dump(records, saved)
+    os.replace(temporary, path)
+
+
+def pcm_samples(data, width, channels):
+    '''
+    Little-endian PCM frames as an array of shape (frames, channels) of
+    floats from -1 to 1.
+    '''
+    if width == 1:
+        samples = (np.frombuffer(data, np.uint8).astype(np.float32) -
+                   128) / 128
+    elif width == 3:
+        # Put each sample in the top three bytes of an int32.
+        padded = np.zeros((len(data) // 3, 4), np.uint8)
+        padded[:, 1:] = np.frombuffer(data, np.uint8).reshape(-1, 3)
+        samples = padded.view('<i4').ravel() / float(1 << 31)
+    elif width in (2, 4):
+        samples = (np.frombuffer(data, '<i{}'.format(width)) /
+                   float(1 << (8 * width - 1)))
+    else:
+        raise ValueError('Unsupported sample width: {}'.format(width))
+    return samples.astype(np.float32, copy=False).reshape(-1, channels)
+
+
+def _wav_blocks(audio, frames):
+    with audio:
+        width = audio.getsampwidth()
+        channels = audio.getnchannels()
+        while True:
+            data = audio.readframes(frames)
+            if not data:
+                break
+            yield pcm_samples(data, width, channels)
+
+
+def decode_blocks(path, frames=BLOCK_FRAMES):
+    '''
+    Returns the sample rate of an audio file, and a generator of blocks of
+    up to ``frames`` of its samples, as arrays of shape (frames, channels).
+    Raises ValueError if it can't be decoded here.
+    '''
+    try:
+        audio = wave.open(path, 'rb')
+    except (wave.Error, EOFError):
+        audio = None
+    if audio is not None:
+        return audio.getframerate(), _wav_blocks(audio, frames)
+
+    try:
+        import soundfile
+    except ImportError:
+        raise ValueError('Can only decode WAV files without soundfile')
+    try:
+        rate = soundfile.info(path).samplerate
+    except RuntimeError as error:
+        raise ValueError(str(error))
+    return rate, soundfile.blocks(path, blocksize=frames, dtype='float32',
+                                  always_2d=True)
+
+
+def k_weighting(rate):
+    '''
+    The two biquads ``(b, a)`` of the K-weighting filter of BS.1770 at a
+    sample rate: a high shelf, then a high pass (as derived in libebur128).
+    '''
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0,
+              (vh - vb * k / q + k * k) / a0],
+             [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    high_pass = ([1.0, -2.0, 1.0],
+                 [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf, high_pass
+
+
+def k_weighting_response(rate, taps):
+    '''
+    The impulse response of the K-weighting filter, cut to ``taps``
+    samples, which is long enough for it to have died away.
+    '''
+    size = 8 * taps
+    z = np.exp(-1j * np.linspace(0, np.pi, size // 2 + 1))
+    response = np.ones_like(z)
+    for b, a in k_weighting(rate):
+        response *= ((b[0] + b[1] * z + b[2] * z * z) /
+                     (a[0] + a[1] * z + a[2] * z * z))
+    return np.fft.irfft(response, size)[:taps]
+
+
+def channel_weights(channels):
+    '''Weights of channels, in WAV order: surrounds count more, LFE not.'''
+    weights = np.ones(channels)
+    if channels == 6:
+        weights[3] = 0.0
+        weights[4:] = 1.41
+    return weights
+
+
+class LoudnessMeter:
+    '''
+    Measures audio fed to it a block at a time. The K-weighting filter is
+    applied as an FIR by FFT convolution (overlap-add), so each block is
+    filtered at once instead of a sample at a time, and only the mean
+    square of each 100 ms step is kept for gating.
+    '''
+    def __init__(self, rate, channels):
+        self.rate = rate
+        self.channels = channels
+        self.step = max(1, int(round(rate * STEP_SECONDS)))
+        # The high pass rings for longer at higher rates.
+        taps = 1 << int(rate // 6).bit_length()
+        self.fft_size = max(1 << 16, 4 * taps)
+        self.block_frames = self.fft_size - taps + 1
+        self._response = np.fft.rfft(k_weighting_response(rate, taps),
+                                     self.fft_size)[:, None]
+        self._tail = np.zeros((taps - 1, channels))
+        self._rest = np.zeros((0, channels))
+        self._steps = []
+        self.frames = 0
+        self.peak = 0.0
+
+    def _filter(self, samples):
+        filtered = np.fft.irfft(np.fft.rfft(samples, self.fft_size, axis=0) *
+                                self._response, self.fft_size, axis=0)
+        count, overlap = len(samples), len(self._tail)
+        filtered[:overlap] += self._tail
+        self._tail = filtered[count:count + overlap].copy()
+        return filtered[:count]
+
+    def feed(self, samples):
+        '''Measure the next samples, an array of shape (frames, channels).'''
+        for start in range(0, len(samples), self.block_frames):
+            block = samples[start:start + self.block_frames]
+            self.frames += len(block)
+            self.peak = max(self.peak, float(np.abs(block).max()))
+            squares = np.concatenate([self._rest, self._filter(block) ** 2])
+            steps = len(squares) // self.step
+            self._steps.append(squares[:steps * self.step].reshape(
+                steps, self.step, self.channels).mean(axis=1))
+            self._rest = squares[steps * self.step:]
+
+    def loudness(self):
+        '''Integrated loudness in LUFS, or None if it is all silence.'''
+        steps = np.concatenate(self._steps) if self._steps else []
+        if len(steps) < STEPS_PER_BLOCK:
+            return None
+        # The mean square of each block, from the steps it covers.
+        total = np.cumsum(np.vstack([np.zeros((1, self.channels)), steps]),
+                          axis=0)
+        blocks = (total[STEPS_PER_BLOCK:] -
+                  total[:-STEPS_PER_BLOCK]) / STEPS_PER_BLOCK
+        power = blocks @ channel_weights(self.channels)
+        with np.errstate(divide='ignore'):
+            levels = -0.691 + 10 * np.log10(power)
+        gated = levels > ABSOLUTE_GATE
+        if not gated.any():
+            return None
+        relative = (-0.691 + 10 * np.log10(power[gated].mean()) +
+                    RELATIVE_GATE)
+        gated &= levels > relative
+        return float(-0.691 + 10 * np.log10(power[gated].mean()))
+
+    def result(self):
+        '''The duration in seconds, loudness and peak (None if silent).'''
+        return {'duration': self.frames / self.rate,
+                'loudness': self.loudness(),
+                'peak': (float(20 * np.log10(self.peak)) if self.peak > 0
+                         else None)}
+
+
+def measure(path):
+    '''Decode an audio file and return what LoudnessMeter.result() does.'''
+    rate, blocks = decode_blocks(path)
+    meter = None
+    for samples in blocks:
+        if meter is None:
+            meter = LoudnessMeter(rate, samples.shape[1])
+        meter.feed(samples)
+    if meter is None:
+        raise ValueError('No audio in {}'.format(path))
+    return meter.result()
+
+
+def content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as audio:
+        for chunk in iter(lambda: audio.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def analyze_file(path, known=None):
+    '''
+    Measure an audio file, in a worker process, unless ``known`` (what was
+    measured of it before) still holds: if its size and modification time
+    are the same, the file is taken not to have changed, and otherwise it
+    is measured again only if its content hash changed. Returns the file's
+    size, mtime, hash and measurements.
+    '''
+    stat = os.stat(path)
+    record = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if known and all(known.get(k) == v for (k, v) in record.items()):
+        return known
+    record['hash'] = content_hash(path)
+    if known and known.get('hash') == record['hash']:
+        return dict(known, **record)
+    record.update(measure(path))
+    return record
+
+
+def song_fields(record):
+    '''The song fields measurements are stored in, from a file's record.'''
+    def rounded(value):
+        return None if value is None else round(value, 2)
+
+    return {'length': '{:.2f}'.format(record['duration']),
+            'loudness': rounded(record['loudness']),
+            'peak': rounded(record['peak'])}
+
+
+def analyze_songs(items, records, folder='', workers=None, lookahead=None):
+    '''
+    Generate ``(number, item, fields)`` for each ``(number, item)`` of
+    song data, where ``fields`` are the song fields measured from the
+    item's file (relative paths are in ``folder``), an error message if it
+    couldn't be, or None if the item has no path.
+
+    ``records`` (file path to what was measured of it, like from
+    load_analysis()) is used and updated. Files are measured in a pool of
+    ``workers`` processes (by default one per core), at most ``lookahead``
+    of them ahead of the item generated, so items come out in order and
+    memory use doesn't depend on how many there are.
+    '''
+    workers = workers or os.cpu_count() or 1
+    lookahead = lookahead or 4 * workers
+    queue = deque()
+
+    def collect():
+        number, item, path, future = queue.popleft()
+        if future is None:
+            return number, item, None
+        try:
+            record = future.result()
+        except Exception as error:
+            return number, item, 'Could not analyze {}: {}'.format(path,
+                                                                  error)
+        records[path] = record
+        return number, item, song_fields(record)
+
+    # Worker processes are started rather than forked, so they don't
+    # inherit the threads of the client.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        for number, item in items:
+            path, future = item.get('path'), None
+            if path:
+                path = os.path.abspath(os.path.join(folder, path))
+                future = pool.submit(analyze_file, path, records.get(path))
+            queue.append((number, item, path, future))
+            if len(queue) >= lookahead:
+                yield collect()
+        while queue:
+            yield collect()
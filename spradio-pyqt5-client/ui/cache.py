@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Caches server responses, so data that hasn't changed is only downloaded
+once.
+'''
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from PyQt5.QtCore import QSettings, QStandardPaths
+
+from .memory import deep_size, track
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def response_cache():
+    '''Return the application-wide response cache, creating it if needed.'''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = QSettings()
+            folder = None
+            if settings.value('network/disk_cache', False, type=bool):
+                folder = os.path.join(QStandardPaths.writableLocation(
+                    QStandardPaths.CacheLocation), 'http')
+            _cache = ResponseCache(
+                settings.value('network/cache_size', 32, type=int) << 20,
+                folder,
+                settings.value('network/disk_cache_size', 256,
+                               type=int) << 20)
+        return _cache
+
+
+def cache_key(url, headers):
+    '''
+    Key of a cached response: the URL and a digest of the credentials it was
+    requested with, so one user's responses are never served to another.
+    '''
+    identity = headers.get('authorization') or ''
+    digest = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+    return digest + ' ' + url
+
+
+def collection(url):
+    '''The collection part of an API URL, e.g. ".../songs/" for a song.'''
+    path = urlsplit(url).path.rstrip('/')
+    if path.rsplit('/', 1)[-1].isdigit():
+        path = path.rsplit('/', 1)[0]
+    return path + '/'
+
+
+class CachedResponse:
+    '''
+    A cached body, standing in for a ``requests`` response wherever one is
+    read with ``json()`` or ``iter_content()``.
+    '''
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def iter_content(self, chunk_size=65536):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class RecordingResponse:
+    '''
+    Wraps a streamed response and keeps its body as it is read, to be cached
+    once the whole body has arrived.
+    '''
+    def __init__(self, response, store):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._store = store
+
+    def iter_content(self, chunk_size=65536):
+        chunks = []
+        for chunk in self.response.iter_content(chunk_size):
+            chunks.append(chunk)
+            yield chunk
+        self._store(b''.join(chunks))
+
+    def close(self):
+        self.response.close()
+
+
+class ResponseCache:
+    '''
+    Least recently used cache of GET responses that carry an ETag or a
+    Last-Modified date, limited to ``max_size`` bytes of bodies in memory and,
+    if given a folder, ``max_disk_size`` bytes on disk.
+
+    A cached response isn't used as is: its validators are sent with the
+    next request for it (``If-None-Match``/``If-Modified-Since``), and when
+    the server answers 304 Not Modified the cached body is used instead of
+    downloading it again. Writing to an endpoint drops every cached response
+    of its collection.
+    '''
+    def __init__(self, max_size=32 << 20, folder=None,
+                 max_disk_size=256 << 20):
+        self.max_size = max_size
+        self.folder = folder
+        self.max_disk_size = max_disk_size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk_size = None
+
+        if self.folder:
+            os.makedirs(self.folder, exist_ok=True)
+        track(self)
+
+    def memoryUsage(self):
+        '''Bytes of the bodies in memory, plus their keys and validators.'''
+        with self._lock:
+            overhead = deep_size([(key, entry[1])
+                                  for (key, entry) in self._entries.items()])
+            return [('Caches', 'Response cache', self._size + overhead)]
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, name)
+
+    def _load(self, key):
+        '''Read a response cached on disk, or None.'''
+        try:
+            with open(self._path(key), 'rb') as cached:
+                header = json.loads(cached.readline().decode('utf-8'))
+                content = cached.read()
+        except (OSError, ValueError):
+            return None
+        if header.get('key') != key:
+            return None
+        os.utime(self._path(key))
+        return header['status'], header['validators'], content
+
+    def _save(self, key, entry):
+        status, validators, content = entry
+        path = self._path(key)
+        header = json.dumps({'key': key, 'status': status,
+                             'validators': validators}).encode('utf-8')
+        temporary = path + '.tmp'
+        try:
+            with open(temporary, 'wb') as cached:
+                cached.write(header + b'\n')
+                cached.write(content)
+            os.replace(temporary, path)
+        except OSError:
+            return
+        self._trimDisk(len(header) + 1 + len(content))
+
+    def _trimDisk(self, added):
+        '''Delete the least recently used files over ``max_disk_size``.'''
+        if self._disk_size is None:
+            self._disk_size = sum(e.stat().st_size
+                                  for e in os.scandir(self.folder))
+        else:
+            self._disk_size += added
+        if self._disk_size <= self.max_disk_size:
+            return
+        files = sorted(os.scandir(self.folder),
+                       key=lambda e: e.stat().st_mtime)
+        for entry in files:
+            if self._disk_size <= self.max_disk_size * 3 // 4:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._disk_size -= size
+
+    def get(self, key):
+        '''
+        Returns the cached ``(status, validators, content)`` of a response,
+        or None.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            if self.folder:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, entry)
+            return entry
+
+    def _remember(self, key, entry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous[2])
+        self._entries[key] = entry
+        self._size += len(entry[2])
+        while self._size > self.max_size and self._entries:
+            old_key, old = self._entries.popitem(last=False)
+            self._size -= len(old[2])
+
+    def put(self, key, status, headers, content):
+        '''Cache a response if the server gave it validators.'''
+        validators = {}
+        if headers.get('etag'):
+            validators['if-none-match'] = headers['etag']
+        if headers.get('last-modified'):
+            validators['if-modified-since'] = headers['last-modified']
+        if not validators or len(content) > self.max_size:
+            return
+        entry = (status, validators, content)
+        with self._lock:
+            self._remember(key, entry)
+            if self.folder:
+                self._save(key, entry)
+
+    def invalidate(self, url):
+        '''Drop every cached response of the collection ``url`` is in.'''
+        prefix = collection(url)
+        with self._lock:
+            for key in list(self._entries):
+                if collection(key.split(' ', 1)[1]) == prefix:
+                    self._size -= len(self._entries.pop(key)[2])
+            if self.folder:
+                # Files don't say which URL they hold without opening them.
+                for entry in os.scandir(self.folder):
+                    try:
+                        with open(entry.path, 'rb') as cached:
+                            header = json.loads(cached.readline())
+                        if collection(header['key'].split(' ', 1)[1]) == \
+                                prefix:
+                            os.remove(entry.path)
+                    except (OSError, ValueError, KeyError, IndexError):
+                        continue
+                self._disk_size = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            if self.folder:
+                for entry in os.scandir(self.folder):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                self._disk_size = None
+
+    def fetch(self, scheduler, url, priority, headers, stream=False):
+        '''
+        GET ``url`` through ``scheduler``, revalidating a cached copy if
+        there is one. Returns a response, or a ``CachedResponse`` in place
+        of a 304 Not Modified.
+        '''
+        key = cache_key(url, headers)
+        cached = self.get(key)
+        if cached is not None:
+            headers = dict(headers)
+            headers.update(cached[1])
+        response = scheduler.request('GET', url, priority, headers=headers,
+                                     stream=stream)
+        if response.status_code == 304 and cached is not None:
+            response.close()
+            return CachedResponse(cached[0], response.headers, cached[2])
+        if response.status_code != 200 or not (
+                response.headers.get('etag') or
+                response.headers.get('last-modified')):
+            return response
+
+        def store(content):
+            self.put(key, response.status_code, response.headers, content)
+
+        if stream:
+            return RecordingResponse(response, store)
+        store(response.content)
+        return response
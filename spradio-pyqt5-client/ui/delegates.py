@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Item delegates for drawing the radio tables.
+'''
+
+from collections import OrderedDict
+
+from PyQt5.QtCore import QPointF, QSize, Qt
+from PyQt5.QtGui import (QFont, QFontMetrics, QPalette, QStaticText,
+                         QTransform)
+from PyQt5.QtWidgets import (QApplication, QStyle, QStyledItemDelegate,
+                             QStyleOptionFocusRect)
+
+from .memory import deep_size, track
+
+
+class CachedTextDelegate(QStyledItemDelegate):
+    '''
+    Draws single lines of plain text from a cache of laid out, elided
+    ``QStaticText``, keyed by text and column width, so repainting a cell
+    that was drawn before doesn't lay its text out again. Titles and artist
+    lists repeat a lot, so cells with the same text share one entry.
+
+    Only the display role is asked for, and the decoration role in the first
+    column of a model with thumbnails. Thumbnails get a square as high as
+    the text whether they are loaded or not, so the text doesn't move when
+    one arrives. Cells with an unsaved edit are drawn by the default
+    delegate, which shows them in italic or red.
+
+    Rows all have the height of one line of text, so views can lay them out
+    without asking for any data.
+    '''
+    def __init__(self, parent=None, max_entries=4096, padding=3):
+        super().__init__(parent)
+
+        self.max_entries = max_entries
+        self.padding = padding
+        self._texts = OrderedDict()
+        self._font = None
+        self._metrics = None
+        self._margin = None
+        track(self)
+
+    def memoryUsage(self):
+        '''
+        Estimated bytes of the cached text: its keys, plus a guess at the
+        glyphs and positions Qt keeps for each character it lays out.
+        '''
+        texts = list(self._texts)
+        glyphs = sum(len(text) for (text, width) in texts) * 32
+        return [('Caches', 'Text layout cache',
+                 deep_size(texts) + glyphs + 200 * len(texts))]
+
+    def rowHeight(self, metrics):
+        '''Height of every row, for text drawn with the given font metrics.'''
+        return metrics.height() + 2 * self.padding
+
+    def margin(self, option):
+        '''Space left of and right of the text, as the style has it.'''
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        return style.pixelMetric(QStyle.PM_FocusFrameHMargin, None,
+                                 widget) + 1
+
+    def thumbnailSize(self, metrics):
+        '''Side of the square a thumbnail is drawn in.'''
+        return metrics.height()
+
+    def hasThumbnail(self, index):
+        model = index.model()
+        return (index.column() == 0 and
+                getattr(model, 'thumbnails', None) is not None)
+
+    def usingFont(self, option):
+        '''Start the cache over when the font changes.'''
+        if option.font != self._font:
+            self._texts.clear()
+            # Copies: the option's own are gone once it has been painted.
+            self._font = QFont(option.font)
+            self._metrics = QFontMetrics(option.fontMetrics)
+            self._margin = self.margin(option)
+
+    def staticText(self, text, width):
+        '''The laid out text for a cell, elided to fit ``width`` pixels.'''
+        key = (text, width)
+        static = self._texts.get(key)
+        if static is not None:
+            self._texts.move_to_end(key)
+            return static
+        elided = self._metrics.elidedText(text, Qt.ElideRight, width)
+        static = QStaticText(elided)
+        static.setTextFormat(Qt.PlainText)
+        static.prepare(QTransform(), self._font)
+        self._texts[key] = static
+        if len(self._texts) > self.max_entries:
+            self._texts.popitem(last=False)
+        return static
+
+    def paint(self, painter, option, index):
+        model = index.model()
+        if getattr(model, 'isEdited', None) and model.isEdited(index):
+            super().paint(painter, option, index)
+            return
+
+        value = model.data(index, Qt.DisplayRole)
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        state = option.state
+        # Only the background (selection, hover) comes from the style.
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter,
+                            widget)
+
+        rect = option.rect
+        left = rect.left()
+        if self.hasThumbnail(index):
+            self.usingFont(option)
+            size = self.thumbnailSize(self._metrics)
+            model.thumbnails.setSize(size)
+            pixmap = model.data(index, Qt.DecorationRole)
+            if pixmap is not None:
+                painter.drawPixmap(
+                    left + self._margin + (size - pixmap.width()) // 2,
+                    rect.top() + (rect.height() - pixmap.height()) // 2,
+                    pixmap)
+            left += size + self._margin
+
+        if value is not None and value != '':
+            self.usingFont(option)
+            static = self.staticText(
+                str(value), rect.right() + 1 - left - 2 * self._margin)
+            if not state & QStyle.State_Enabled:
+                group = QPalette.Disabled
+            elif state & QStyle.State_Active:
+                group = QPalette.Normal
+            else:
+                group = QPalette.Inactive
+            role = (QPalette.HighlightedText
+                    if state & QStyle.State_Selected else QPalette.Text)
+            pen = painter.pen()
+            painter.setPen(option.palette.color(group, role))
+            painter.drawStaticText(
+                QPointF(left + self._margin,
+                        rect.top() + (rect.height() -
+                                      self._metrics.height()) / 2),
+                static)
+            painter.setPen(pen)
+
+        if state & QStyle.State_HasFocus:
+            focus = QStyleOptionFocusRect()
+            focus.rect = option.rect
+            focus.state = state | QStyle.State_KeyboardFocusChange
+            focus.backgroundColor = option.palette.color(QPalette.Window)
+            style.drawPrimitive(QStyle.PE_FrameFocusRect, focus, painter,
+                                widget)
+
+    def sizeHint(self, option, index):
+        value = index.data(Qt.DisplayRole)
+        text = '' if value is None else str(value)
+        width = option.fontMetrics.width(text) + 2 * self.margin(option)
+        if self.hasThumbnail(index):
+            width += (self.thumbnailSize(option.fontMetrics) +
+                      self.margin(option))
+        return QSize(width, self.rowHeight(option.fontMetrics))
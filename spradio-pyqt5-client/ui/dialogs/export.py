@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Classes for the Export Dialog.
+'''
+
+import os
+import threading
+
+from PyQt5.QtCore import QCoreApplication, QStandardPaths, Qt
+from PyQt5.QtWidgets import (QComboBox, QDialog, QDialogButtonBox,
+                             QFileDialog, QFormLayout, QHBoxLayout, QLabel,
+                             QLineEdit, QMessageBox, QProgressBar, QPushButton,
+                             QVBoxLayout)
+
+from ..export import (export_catalog, EXPORT_ENDPOINTS, EXPORT_FORMATS,
+                      ExportCancelled, progress_path)
+from ..tasks import run_task
+
+
+class ExportDialog(QDialog):
+    '''
+    Dialog for exporting part of the catalog to a file, in the background,
+    with a progress bar. Cancelling keeps what was exported so far, and the
+    next export to the same file can carry on from there.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.running = False
+        self.cancel = threading.Event()
+
+        self.initUi()
+        self.retranslateUi()
+
+    def initUi(self):
+        self.setObjectName('dialogExport')
+        self.resize(500, 150)
+
+        self.verticalLayout = QVBoxLayout(self)
+        self.verticalLayout.setObjectName('verticalLayoutExport')
+
+        self.formLayout = QFormLayout()
+        self.formLayout.setObjectName('formLayoutExport')
+
+        self.labelEndpoint = QLabel(self)
+        self.comboBoxEndpoint = QComboBox(self)
+        self.comboBoxEndpoint.setObjectName('comboBoxEndpoint')
+        for endpoint in EXPORT_ENDPOINTS:
+            self.comboBoxEndpoint.addItem(endpoint.capitalize(), endpoint)
+        self.formLayout.addRow(self.labelEndpoint, self.comboBoxEndpoint)
+
+        self.labelFormat = QLabel(self)
+        self.comboBoxFormat = QComboBox(self)
+        self.comboBoxFormat.setObjectName('comboBoxFormat')
+        for format, name in EXPORT_FORMATS.items():
+            self.comboBoxFormat.addItem(name, format)
+        self.formLayout.addRow(self.labelFormat, self.comboBoxFormat)
+
+        self.labelPath = QLabel(self)
+        self.horizontalLayoutPath = QHBoxLayout()
+        self.lineEditPath = QLineEdit(self)
+        self.lineEditPath.setObjectName('lineEditPath')
+        self.buttonBrowse = QPushButton(self)
+        self.buttonBrowse.setObjectName('buttonBrowse')
+        self.horizontalLayoutPath.addWidget(self.lineEditPath)
+        self.horizontalLayoutPath.addWidget(self.buttonBrowse)
+        self.formLayout.addRow(self.labelPath, self.horizontalLayoutPath)
+        self.verticalLayout.addLayout(self.formLayout)
+
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setObjectName('progressBarExport')
+        self.progressBar.setValue(0)
+        self.verticalLayout.addWidget(self.progressBar)
+
+        self.buttonBox = QDialogButtonBox(self)
+        self.buttonBox.setObjectName('buttonBoxExport')
+        self.buttonBox.setOrientation(Qt.Horizontal)
+        self.buttonBox.setStandardButtons(QDialogButtonBox.Ok |
+                                          QDialogButtonBox.Close)
+        self.buttonBox.accepted.connect(self.startExport)
+        self.buttonBox.rejected.connect(self.reject)
+        self.verticalLayout.addWidget(self.buttonBox)
+
+        self.buttonBrowse.clicked.connect(self.browse)
+        self.comboBoxEndpoint.currentIndexChanged.connect(self.suggestPath)
+        self.comboBoxFormat.currentIndexChanged.connect(self.suggestPath)
+        self.suggestPath()
+
+    def suggestPath(self, *args):
+        '''Default the file name to the endpoint and format chosen.'''
+        folder = os.path.dirname(self.lineEditPath.text()) or \
+            QStandardPaths.writableLocation(QStandardPaths.DocumentsLocation)
+        name = (self.comboBoxEndpoint.currentData() + '.' +
+                self.comboBoxFormat.currentData())
+        self.lineEditPath.setText(os.path.join(folder, name))
+
+    def browse(self):
+        format = self.comboBoxFormat.currentData()
+        path, selected = QFileDialog.getSaveFileName(
+            self, self.windowTitle(), self.lineEditPath.text(),
+            '{} (*.{})'.format(EXPORT_FORMATS[format], format))
+        if path:
+            self.lineEditPath.setText(path)
+
+    def startExport(self):
+        path = self.lineEditPath.text()
+        if not path:
+            return
+        resume = False
+        if os.path.exists(progress_path(path)):
+            answer = QMessageBox.question(
+                self, self.windowTitle(),
+                'An earlier export to this file did not finish. Carry on '
+                'where it stopped?',
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            resume = answer == QMessageBox.Yes
+
+        self.running = True
+        self.cancel.clear()
+        self.setControlsEnabled(False)
+        self.progressBar.setMaximum(0)
+        run_task(export_catalog, self.comboBoxEndpoint.currentData(), path,
+                 self.comboBoxFormat.currentData(), resume,
+                 cancelled=self.cancel.is_set,
+                 progress=self.exportProgress,
+                 finished=self.exportFinished,
+                 failed=self.exportFailed)
+
+    def setControlsEnabled(self, enabled):
+        for widget in (self.comboBoxEndpoint, self.comboBoxFormat,
+                       self.lineEditPath, self.buttonBrowse,
+                       self.buttonBox.button(QDialogButtonBox.Ok)):
+            widget.setEnabled(enabled)
+        self.buttonBox.button(QDialogButtonBox.Close).setEnabled(True)
+
+    def exportProgress(self, progress):
+        page, total_pages = progress
+        self.progressBar.setMaximum(total_pages)
+        self.progressBar.setValue(page)
+
+    def exportFinished(self, count):
+        self.running = False
+        self.setControlsEnabled(True)
+        QMessageBox.information(self, self.windowTitle(),
+                                'Exported {} items.'.format(count))
+
+    def exportFailed(self, error):
+        self.running = False
+        self.setControlsEnabled(True)
+        self.progressBar.setMaximum(100)
+        if isinstance(error, ExportCancelled):
+            self.done(QDialog.Rejected)
+            return
+        QMessageBox.warning(self, self.windowTitle(),
+                            'The export stopped: {}\nRun it again to carry '
+                            'on where it stopped.'.format(error))
+
+    def reject(self):
+        if self.running:
+            # Stop after the page being written; the dialog closes then.
+            self.cancel.set()
+            self.buttonBox.button(QDialogButtonBox.Close).setEnabled(False)
+            return
+        super().reject()
+
+    def retranslateUi(self):
+        '''Translate labels into native language and assign them to widgets.'''
+        _ = QCoreApplication.translate
+
+        self.setWindowTitle(_('Client', 'Export Catalog'))
+        self.labelEndpoint.setText(_('Client', 'Export:'))
+        self.labelFormat.setText(_('Client', 'Format:'))
+        self.labelPath.setText(_('Client', 'File:'))
+        self.buttonBrowse.setText(_('Client', 'Browse...'))
+        self.buttonBox.button(QDialogButtonBox.Ok).setText(
+            _('Client', 'Export'))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Classes for the Memory Usage Dialog.
+'''
+
+import tracemalloc
+
+from PyQt5.QtCore import QCoreApplication, Qt
+from PyQt5.QtWidgets import (QApplication, QCheckBox, QDialog,
+                             QDialogButtonBox, QHeaderView, QLabel,
+                             QPushButton, QTreeWidget, QTreeWidgetItem,
+                             QVBoxLayout)
+
+from ..memory import (format_report, format_size, memory_monitor,
+                      start_tracing_allocations)
+
+
+class MemoryDialog(QDialog):
+    '''
+    Dialog showing how much memory each model, cache, index and store holds,
+    by category, with the change since the previous snapshot. Snapshots are
+    only taken when asked for, since estimating every structure takes a
+    moment with a large catalog.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.rows = []
+        self.traced = None
+
+        self.initUi()
+        self.retranslateUi()
+        self.takeSnapshot()
+
+    def initUi(self):
+        self.setObjectName('dialogMemory')
+        self.resize(600, 500)
+
+        self.verticalLayout = QVBoxLayout(self)
+        self.verticalLayout.setObjectName('verticalLayoutMemory')
+
+        self.treeWidgetMemory = QTreeWidget(self)
+        self.treeWidgetMemory.setObjectName('treeWidgetMemory')
+        self.treeWidgetMemory.setColumnCount(3)
+        self.treeWidgetMemory.header().setSectionResizeMode(
+            0, QHeaderView.Stretch)
+        self.treeWidgetMemory.header().setStretchLastSection(False)
+        self.verticalLayout.addWidget(self.treeWidgetMemory)
+
+        self.labelTraced = QLabel(self)
+        self.labelTraced.setObjectName('labelTraced')
+        self.verticalLayout.addWidget(self.labelTraced)
+
+        self.checkBoxChanges = QCheckBox(self)
+        self.checkBoxChanges.setObjectName('checkBoxChanges')
+        self.checkBoxChanges.toggled.connect(self.showRows)
+        self.verticalLayout.addWidget(self.checkBoxChanges)
+        self.checkBoxTrace = QCheckBox(self)
+        self.checkBoxTrace.setObjectName('checkBoxTrace')
+        self.checkBoxTrace.setChecked(tracemalloc.is_tracing())
+        self.checkBoxTrace.toggled.connect(self.traceAllocations)
+        self.verticalLayout.addWidget(self.checkBoxTrace)
+
+        self.buttonBox = QDialogButtonBox(self)
+        self.buttonBox.setObjectName('buttonBoxMemory')
+        self.buttonBox.setOrientation(Qt.Horizontal)
+        self.buttonSnapshot = QPushButton(self)
+        self.buttonSnapshot.setObjectName('buttonSnapshot')
+        self.buttonBox.addButton(self.buttonSnapshot,
+                                 QDialogButtonBox.ActionRole)
+        self.buttonCopy = QPushButton(self)
+        self.buttonCopy.setObjectName('buttonCopy')
+        self.buttonBox.addButton(self.buttonCopy, QDialogButtonBox.ActionRole)
+        self.buttonBox.addButton(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+        self.verticalLayout.addWidget(self.buttonBox)
+
+        self.buttonSnapshot.clicked.connect(self.takeSnapshot)
+        self.buttonCopy.clicked.connect(self.copyReport)
+
+    def takeSnapshot(self):
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            monitor = memory_monitor()
+            self.rows = monitor.report()
+            self.traced = monitor.traced()
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.showRows()
+
+    def showRows(self):
+        changes_only = self.checkBoxChanges.isChecked()
+        rows = [row for row in self.rows if row.change or not changes_only]
+
+        self.treeWidgetMemory.clear()
+        categories = {}
+        for row in rows:
+            parent = categories.get(row.category)
+            if parent is None:
+                parent = categories[row.category] = QTreeWidgetItem(
+                    self.treeWidgetMemory, [row.category])
+                parent.setData(1, Qt.UserRole, 0)
+                parent.setData(2, Qt.UserRole, 0)
+            QTreeWidgetItem(parent, [row.name, format_size(row.size),
+                                     '' if row.change is None
+                                     else format_size(row.change, True)])
+            parent.setData(1, Qt.UserRole, parent.data(1, Qt.UserRole) +
+                           row.size)
+            parent.setData(2, Qt.UserRole, parent.data(2, Qt.UserRole) +
+                           (row.change or 0))
+        for parent in categories.values():
+            parent.setText(1, format_size(parent.data(1, Qt.UserRole)))
+            if any(row.change is not None for row in rows):
+                parent.setText(2, format_size(parent.data(2, Qt.UserRole),
+                                              True))
+            parent.setExpanded(True)
+        for column in (1, 2):
+            self.treeWidgetMemory.resizeColumnToContents(column)
+
+        _ = QCoreApplication.translate
+        if self.traced is None:
+            self.labelTraced.setText(_('Client', 'Allocations are not being '
+                                                 'traced.'))
+        else:
+            self.labelTraced.setText(
+                _('Client', 'Traced by tracemalloc: {} (peak {})').format(
+                    format_size(self.traced[0]), format_size(self.traced[1])))
+
+    def traceAllocations(self, trace):
+        if trace:
+            start_tracing_allocations()
+        else:
+            tracemalloc.stop()
+
+    def copyReport(self):
+        QApplication.clipboard().setText(format_report(
+            self.rows, self.traced, self.checkBoxChanges.isChecked()))
+
+    def retranslateUi(self):
+        '''Translate labels into native language and assign them to widgets.'''
+        _ = QCoreApplication.translate
+
+        self.setWindowTitle(_('Client', 'Memory Usage'))
+        self.treeWidgetMemory.setHeaderLabels([
+            _('Client', 'Component'), _('Client', 'Size'),
+            _('Client', 'Change')])
+        self.checkBoxChanges.setText(
+            _('Client', 'Only show changes since the last snapshot'))
+        self.checkBoxTrace.setText(
+            _('Client', 'Trace allocations by file (slows the client down)'))
+        self.buttonSnapshot.setText(_('Client', 'Take Snapshot'))
+        self.buttonCopy.setText(_('Client', 'Copy Report'))
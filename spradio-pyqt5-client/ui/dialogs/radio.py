@@ -5,43 +5,181 @@
 Classes for the Settings Dialog.
 '''
 
-from PyQt5.QtCore import QCoreApplication, Qt
+from PyQt5.QtCore import QCoreApplication, QModelIndex, QStringListModel, Qt
 from PyQt5.QtGui import QFont
-from PyQt5.QtWidgets import (QDialog, QDialogButtonBox, QFormLayout, QLabel,
-                             QLineEdit, QSizePolicy, QSpacerItem, QVBoxLayout)
+from PyQt5.QtWidgets import (QCompleter, QDialog, QDialogButtonBox,
+                             QFormLayout, QLabel, QLineEdit, QMessageBox,
+                             QSizePolicy, QSpacerItem, QVBoxLayout)
 
-from ..utils import post_server_data, put_server_data
+from ..models.index import entity_index, normalize
+from ..models.store import entity_store, MANY_RELATIONS, RELATIONS
+from ..utils import (describe_error, full_name, patch_server_data,
+                     poll_server_data, post_server_data)
+
+
+def display_text(value):
+    '''Text shown for a field's value, including nested relations.'''
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        if 'title' in value:
+            # Albums, games and songs, whose title may be empty.
+            return value['title'] or ''
+        names = ('alias', 'first_name', 'last_name')
+        if any(k in value for k in names):
+            # Artists, which may have come without some of their names.
+            return full_name({k: value.get(k) or '' for k in names}).strip()
+        return ''
+    if isinstance(value, list):
+        return ', '.join([display_text(v) for v in value])
+    return str(value)
+
+
+class RelationEdit(QLineEdit):
+    '''
+    Line edit for a field that refers to other entities (e.g. a song's game),
+    completing names from the local index of that kind of entity as they are
+    typed. Choosing a completion binds the entity's id, which is what gets
+    saved; names typed out in full are bound if exactly one entity has them.
+
+    The index only has the entities that were shown until the names of the
+    rest have been downloaded, in the background, which starts when the
+    field is made. Until then, names that aren't found may just not be
+    loaded yet (see waiting()).
+    '''
+    def __init__(self, kind, multiple=False, parent=None):
+        super().__init__(parent)
+
+        self.kind = kind
+        self.multiple = multiple
+        self.index = entity_index(kind)
+        self.index.loadNames()
+        self.matches = []
+        self.bound = {}
+        self.limit = 20
+
+        self.completionModel = QStringListModel(self)
+        self.completer = QCompleter(self.completionModel, self)
+        self.completer.setWidget(self)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.activated[QModelIndex].connect(self.choose)
+        self.textEdited.connect(self.complete)
+
+    def segments(self):
+        if not self.multiple:
+            return [self.text()]
+        return self.text().split(',')
+
+    def complete(self, text):
+        '''Offer the entities whose names start with what is being typed.'''
+        typed = self.segments()[-1].strip()
+        self.matches = self.index.search(typed, self.limit) if typed else []
+        self.completionModel.setStringList([n for (i, n) in self.matches])
+        if self.matches:
+            self.completer.complete()
+        else:
+            self.completer.popup().hide()
+
+    def choose(self, index):
+        id, name = self.matches[index.row()]
+        self.bind(id, name)
+        segments = [s.strip() for s in self.segments()[:-1]] + [name]
+        self.setText(', '.join([s for s in segments if s]))
+
+    def bind(self, id, name):
+        self.bound[normalize(name)] = id
+
+    def waiting(self):
+        '''
+        Whether a name in the field can't be told apart from one that doesn't
+        exist until the index has finished loading every name.
+        '''
+        if not self.index.loading:
+            return False
+        return any(segment.strip() and
+                   normalize(segment) not in self.bound and
+                   not self.index.exact(segment)
+                   for segment in self.segments())
+
+    def value(self):
+        '''
+        The id (or list of ids) of the entities named in the field. Raises
+        ValueError for a name that isn't bound to exactly one entity.
+        '''
+        ids = []
+        for segment in self.segments():
+            if not segment.strip():
+                continue
+            id = self.bound.get(normalize(segment))
+            if id is None:
+                found = self.index.exact(segment)
+                if len(found) != 1:
+                    problem = 'No' if not found else 'More than one'
+                    if not found and not self.index.complete:
+                        problem += ' loaded'
+                    raise ValueError('{} {} named "{}"'.format(
+                        problem, self.kind[:-1], segment.strip()))
+                id = found[0]
+            ids.append(id)
+        if self.multiple:
+            return ids
+        return ids[0] if ids else None
 
 
 class BaseItemDialog(QDialog):
     '''
     Abstract Dialog for all radio items.
+
+    Only the fields that were changed are sent when saving. If the item was
+    loaded with an ETag (or has a ``version`` field), the save only goes
+    through if nobody else changed the item in the meantime; otherwise the
+    user is shown both versions and decides what to keep.
     '''
-    def __init__(self, parent, **kwargs):
+    def __init__(self, parent, etag=None, **kwargs):
         super().__init__(parent)
         self.setAttribute(Qt.WA_DeleteOnClose)
 
         self.modified = False
         self.structure = {}
+        self.etag = etag
+        self.version = kwargs.get('version')
 
         self.initStructure(kwargs)
         self.initUi()
         self.resetValues()
 
     def initStructure(self, kwargs):
+        plural = self.parent().plural
+        relations = RELATIONS.get(plural, {})
         for attr, item in self.parent().columns.items():
             original = kwargs.get(attr, '')
             self.structure[attr] = {}
             self.structure[attr]['original'] = original
+            self.structure[attr]['editable'] = item['editable']
             self.structure[attr]['widgets'] = {}
             self.structure[attr]['widgets']['label'] = QLabel(self)
             self.structure[attr]['widgets']['label'].setText(item['header'])
-            if item['editable']:
-                widgets = self.structure[attr]['widgets']
+            widgets = self.structure[attr]['widgets']
+            if item['editable'] and attr in relations:
+                multiple = attr in MANY_RELATIONS.get(plural, ())
+                widgets['field'] = RelationEdit(relations[attr], multiple,
+                                                self)
+                widgets['field'].textChanged.connect(self.dataModified)
+                widgets['field'].index.namesFinished.connect(
+                    self.dataModified)
+                self.bindRelation(attr, original)
+            elif item['editable']:
                 widgets['field'] = QLineEdit(self)
                 widgets['field'].textEdited.connect(self.dataModified)
             else:
-                self.structure[attr]['widgets']['field'] = QLabel(self)
+                widgets['field'] = QLabel(self)
+
+    def bindRelation(self, attr, value):
+        '''Bind the names of the entities a relation field starts out with.'''
+        field = self.structure[attr]['widgets']['field']
+        for entity in value if isinstance(value, list) else [value]:
+            if isinstance(entity, dict):
+                field.bind(entity['id'], display_text(entity))
 
     def initUi(self):
         name = self.parent().name.capitalize()
@@ -83,8 +221,24 @@ class BaseItemDialog(QDialog):
         self.retranslateUi()
 
     def dataModified(self, *args, **kwargs):
-        self.modified = True
-        self.buttonBox.button(QDialogButtonBox.Apply).setEnabled(True)
+        dirty = self.dirtyFields()
+        self.modified = bool(dirty)
+        # Saving waits for the names of entities that weren't shown, rather
+        # than the dialog downloading them all while the user waits.
+        fields = [self.structure[attr]['widgets']['field'] for attr in dirty]
+        waiting = any(isinstance(field, RelationEdit) and field.waiting()
+                      for field in fields)
+        self.buttonBox.button(QDialogButtonBox.Apply).setEnabled(
+            self.modified and not waiting)
+        self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(not waiting)
+
+    def dirtyFields(self):
+        '''The editable fields whose text differs from the loaded item.'''
+        return {attr: item['widgets']['field'].text()
+                for (attr, item) in self.structure.items()
+                if item['editable'] and
+                item['widgets']['field'].text() !=
+                display_text(item['original'])}
 
     def resetValues(self):
         for attr, item in self.structure.items():
@@ -96,37 +250,128 @@ class BaseItemDialog(QDialog):
                 item['widgets']['field'].setFont(font)
                 item['widgets']['field'].setText('[NEW ITEM]')
             else:
-                item['widgets']['field'].setText(str(item['original']))
+                item['widgets']['field'].setText(
+                    display_text(item['original']))
 
         self.modified = False
         self.buttonBox.button(QDialogButtonBox.Apply).setEnabled(False)
 
+    def loadItem(self, data, etag, keep_edits=False):
+        '''
+        Take ``data`` as the item's saved state. Unless keeping the user's
+        edits, every field is reset to it.
+        '''
+        edits = self.dirtyFields() if keep_edits else {}
+        for attr, item in self.structure.items():
+            if attr in data:
+                item['original'] = data[attr]
+                if isinstance(item['widgets']['field'], RelationEdit):
+                    self.bindRelation(attr, data[attr])
+        self.etag = etag
+        self.version = data.get('version')
+        self.resetValues()
+        for attr, text in edits.items():
+            self.structure[attr]['widgets']['field'].setText(text)
+        self.dataModified()
+
     def saveItem(self):
+        '''
+        Send the changed fields to the server. Returns True if the item is
+        now saved.
+        '''
         endpoint = self.parent().plural
-        current_data = {}
-        for attr, item in self.structure.items():
-            if attr is not 'id':
-                current_data[attr] = item['widgets']['field'].text()
+        changes = self.dirtyFields()
+        try:
+            for attr in changes:
+                field = self.structure[attr]['widgets']['field']
+                if isinstance(field, RelationEdit):
+                    changes[attr] = field.value()
+        except ValueError as error:
+            QMessageBox.warning(self,
+                                'Save ' + self.parent().name,
+                                ('Could not save this ' + self.parent().name +
+                                 ':\n' + str(error)))
+            return False
 
         if self.structure['id']['original'] == '':
-            status, results = post_server_data(endpoint, current_data)
-            current_data['id'] = results['id']
+            status, results = post_server_data(endpoint, changes)
+            if status == 201:
+                self.loadItem(results, None)
+                return True
+        elif not changes:
+            return True
         else:
-            current_data['id'] = self.structure['id']['original']
-            status, results = put_server_data(endpoint + '/' +
-                                              str(current_data['id']),
-                                              current_data)
-
-        if status in [200, 201]:
-            for attr, item in self.structure.items():
-                item['original'] = current_data[attr]
-            self.resetValues()
-            self.modified = False
-            self.buttonBox.button(QDialogButtonBox.Apply).setEnabled(False)
+            if not self.etag and self.version is not None:
+                changes['version'] = self.version
+            item_endpoint = endpoint + '/' + str(
+                self.structure['id']['original'])
+            status, etag, results = patch_server_data(item_endpoint, changes,
+                                                      self.etag)
+            if status == 200:
+                # Every model showing this item picks up the change from the
+                # store, so nothing needs to be fetched again.
+                entity_store().merge(endpoint, [results])
+                self.loadItem(results, etag)
+                return True
+            elif status in (409, 412):
+                return self.resolveConflict(item_endpoint)
+
+        QMessageBox.warning(self,
+                            'Save ' + self.parent().name,
+                            ('Could not save this ' + self.parent().name +
+                             ':\n' + describe_error(status, results)))
+        return False
+
+    def resolveConflict(self, item_endpoint):
+        '''
+        Someone else saved the item first. Show what they changed next to
+        the user's edits, and let the user overwrite, take their version or
+        keep editing. Returns True if the item ends up saved.
+        '''
+        status, etag, theirs = poll_server_data(item_endpoint)
+        if status != 200:
+            QMessageBox.warning(self,
+                                'Save ' + self.parent().name,
+                                ('This ' + self.parent().name + ' was changed'
+                                 ' or deleted by someone else, and could not'
+                                 ' be loaded again.'))
+            return False
+        entity_store().merge(self.parent().plural, [theirs])
+
+        mine = self.dirtyFields()
+        lines = []
+        for attr, item in self.structure.items():
+            if attr not in theirs:
+                continue
+            their_text = display_text(theirs[attr])
+            if their_text != display_text(item['original']) or attr in mine:
+                header = self.parent().columns[attr]['header']
+                lines.append('{}: theirs "{}", yours "{}"'.format(
+                    header, their_text,
+                    mine.get(attr, display_text(item['original']))))
+
+        box = QMessageBox(QMessageBox.Warning,
+                          'Save ' + self.parent().name,
+                          ('Someone else changed this ' + self.parent().name +
+                           ' while you were editing it.'),
+                          QMessageBox.NoButton, self)
+        box.setInformativeText('Overwrite their changes with yours?')
+        box.setDetailedText('\n'.join(lines))
+        overwrite = box.addButton('Overwrite', QMessageBox.AcceptRole)
+        discard = box.addButton('Use Theirs', QMessageBox.DestructiveRole)
+        box.addButton('Keep Editing', QMessageBox.RejectRole)
+        box.exec_()
+
+        if box.clickedButton() is overwrite:
+            self.loadItem(theirs, etag, keep_edits=True)
+            return self.saveItem()
+        elif box.clickedButton() is discard:
+            self.loadItem(theirs, etag)
+        return False
 
     def accept(self):
-        self.saveItem()
-        self.done(QDialog.Accepted)
+        if self.saveItem():
+            self.done(QDialog.Accepted)
 
     def reject(self):
         self.done(QDialog.Rejected)
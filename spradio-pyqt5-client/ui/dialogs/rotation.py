@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Classes for the Rotation Dialog.
+'''
+
+from PyQt5.QtCore import QCoreApplication, QSettings, Qt
+from PyQt5.QtWidgets import (QDialog, QDialogButtonBox, QFormLayout, QLabel,
+                             QListWidget, QMessageBox, QPushButton, QSpinBox,
+                             QVBoxLayout)
+
+from ..rotation import generate_rotation, queue_rotation, rotation_length
+from ..stats import format_duration
+from ..tasks import run_task
+from ..utils import describe_error
+
+
+class RotationDialog(QDialog):
+    '''
+    Dialog for generating a rotation of songs picked at random by their play
+    statistics, and adding it to the station's queue.
+
+    The catalog is loaded in the background the first time, and the
+    generator is kept by the parent tab (as ``rotation_generator``) so it
+    only needs to be loaded once per session.
+    '''
+    def __init__(self, parent=None, exclude=()):
+        super().__init__(parent)
+
+        self.exclude = list(exclude)
+        self.rotation = []
+        self.running = False
+
+        self.initUi()
+        self.retranslateUi()
+
+    def initUi(self):
+        self.setObjectName('dialogRotation')
+        self.resize(450, 450)
+
+        self.verticalLayout = QVBoxLayout(self)
+        self.verticalLayout.setObjectName('verticalLayoutRotation')
+
+        settings = QSettings()
+        self.formLayout = QFormLayout()
+        self.formLayout.setObjectName('formLayoutRotation')
+        self.labelCount = QLabel(self)
+        self.spinBoxCount = QSpinBox(self)
+        self.spinBoxCount.setObjectName('spinBoxCount')
+        self.spinBoxCount.setRange(1, 1000)
+        self.spinBoxCount.setValue(settings.value('rotation/count', 50,
+                                                  type=int))
+        self.formLayout.addRow(self.labelCount, self.spinBoxCount)
+        self.labelArtistGap = QLabel(self)
+        self.spinBoxArtistGap = QSpinBox(self)
+        self.spinBoxArtistGap.setObjectName('spinBoxArtistGap')
+        self.spinBoxArtistGap.setRange(0, 100)
+        self.spinBoxArtistGap.setValue(
+            settings.value('rotation/artist_gap', 10, type=int))
+        self.formLayout.addRow(self.labelArtistGap, self.spinBoxArtistGap)
+        self.labelGameGap = QLabel(self)
+        self.spinBoxGameGap = QSpinBox(self)
+        self.spinBoxGameGap.setObjectName('spinBoxGameGap')
+        self.spinBoxGameGap.setRange(0, 100)
+        self.spinBoxGameGap.setValue(
+            settings.value('rotation/game_gap', 5, type=int))
+        self.formLayout.addRow(self.labelGameGap, self.spinBoxGameGap)
+        self.verticalLayout.addLayout(self.formLayout)
+
+        self.listWidgetRotation = QListWidget(self)
+        self.listWidgetRotation.setObjectName('listWidgetRotation')
+        self.verticalLayout.addWidget(self.listWidgetRotation)
+        self.labelStatus = QLabel(self)
+        self.labelStatus.setObjectName('labelStatusRotation')
+        self.verticalLayout.addWidget(self.labelStatus)
+
+        self.buttonBox = QDialogButtonBox(self)
+        self.buttonBox.setObjectName('buttonBoxRotation')
+        self.buttonBox.setOrientation(Qt.Horizontal)
+        self.buttonGenerate = QPushButton(self)
+        self.buttonGenerate.setObjectName('buttonGenerate')
+        self.buttonBox.addButton(self.buttonGenerate,
+                                 QDialogButtonBox.ActionRole)
+        self.buttonQueue = QPushButton(self)
+        self.buttonQueue.setObjectName('buttonQueue')
+        self.buttonQueue.setEnabled(False)
+        self.buttonBox.addButton(self.buttonQueue,
+                                 QDialogButtonBox.ActionRole)
+        self.buttonBox.addButton(QDialogButtonBox.Close)
+        self.buttonBox.rejected.connect(self.reject)
+        self.verticalLayout.addWidget(self.buttonBox)
+
+        self.buttonGenerate.clicked.connect(self.generate)
+        self.buttonQueue.clicked.connect(self.addToQueue)
+
+    def generator(self):
+        return getattr(self.parent(), 'rotation_generator', None)
+
+    def setRunning(self, running, status=''):
+        self.running = running
+        self.buttonGenerate.setEnabled(not running)
+        self.buttonQueue.setEnabled(not running and bool(self.rotation))
+        self.labelStatus.setText(status)
+
+    def generate(self):
+        settings = QSettings()
+        settings.setValue('rotation/count', self.spinBoxCount.value())
+        settings.setValue('rotation/artist_gap',
+                          self.spinBoxArtistGap.value())
+        settings.setValue('rotation/game_gap', self.spinBoxGameGap.value())
+
+        generator = self.generator()
+        self.setRunning(True, 'Loading songs...' if generator is None
+                        else 'Generating...')
+        run_task(generate_rotation, self.spinBoxCount.value(),
+                 self.spinBoxArtistGap.value(), self.spinBoxGameGap.value(),
+                 self.exclude, generator,
+                 finished=self.generated, failed=self.generateFailed)
+
+    def generated(self, result):
+        self.rotation, generator = result
+        if self.parent() is not None:
+            self.parent().rotation_generator = generator
+        catalog = generator.catalog
+
+        self.listWidgetRotation.clear()
+        for id in self.rotation:
+            row = catalog.row(id)
+            title = catalog.titles[row]
+            game = catalog.game_titles.get(int(catalog.game[row]))
+            self.listWidgetRotation.addItem(
+                '{} ({})'.format(title, game) if game else title)
+        self.setRunning(False, '{} songs, {}'.format(
+            len(self.rotation),
+            format_duration(rotation_length(catalog, self.rotation))))
+
+    def generateFailed(self, error):
+        self.setRunning(False)
+        QMessageBox.warning(self, self.windowTitle(),
+                            'Could not generate a rotation: {}'.format(error))
+
+    def addToQueue(self):
+        self.setRunning(True, 'Adding to the queue...')
+        run_task(queue_rotation, self.rotation,
+                 finished=self.queued, failed=self.queueFailed)
+
+    def queued(self, result):
+        status, data = result
+        if status not in (200, 201, 204):
+            self.setRunning(False)
+            QMessageBox.warning(self, self.windowTitle(),
+                                'The queue was not changed: {}'
+                                .format(describe_error(status, data)))
+            return
+        # Don't offer the same songs again until they are regenerated.
+        self.exclude += self.rotation
+        self.rotation = []
+        self.setRunning(False, 'Added to the queue.')
+
+    def queueFailed(self, error):
+        self.setRunning(False)
+        QMessageBox.warning(self, self.windowTitle(),
+                            'The queue was not changed: {}'.format(error))
+
+    def reject(self):
+        if self.running:
+            return
+        super().reject()
+
+    def retranslateUi(self):
+        '''Translate labels into native language and assign them to widgets.'''
+        _ = QCoreApplication.translate
+
+        self.setWindowTitle(_('Client', 'Generate Rotation'))
+        self.labelCount.setText(_('Client', 'Songs:'))
+        self.labelArtistGap.setText(_('Client', 'Songs between artists:'))
+        self.labelGameGap.setText(_('Client', 'Songs between games:'))
+        self.buttonGenerate.setText(_('Client', 'Generate'))
+        self.buttonQueue.setText(_('Client', 'Add to Queue'))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Exports the radio catalog to CSV or JSON Lines files.
+'''
+
+import csv
+import json
+import os
+
+from .models.store import RELATIONS
+from .scheduler import BULK
+from .utils import full_name, stream_server_data
+
+
+EXPORT_ENDPOINTS = ['songs', 'artists', 'albums', 'games']
+EXPORT_FORMATS = {'csv': 'CSV', 'jsonl': 'JSON Lines'}
+# The fields of each endpoint, in the order CSV exports write them.
+EXPORT_FIELDS = {'artists': ['id', 'alias', 'first_name', 'last_name'],
+                 'albums': ['id', 'title'],
+                 'games': ['id', 'title'],
+                 'songs': ['id', 'album', 'artists', 'game', 'song_type',
+                           'title', 'num_played', 'last_played', 'length',
+                           'path']}
+
+
+class ExportCancelled(Exception):
+    '''Raised when an export is stopped before it finished.'''
+    pass
+
+
+def progress_path(path):
+    '''Where the progress of an export to ``path`` is kept until it ends.'''
+    return path + '.progress'
+
+
+def iter_pages(endpoint, start_page=1):
+    '''
+    Generate a ``(page, stream)`` pair for each page of an endpoint from
+    ``start_page`` on, in order of id. Each stream decodes its items while
+    they download, so only one item needs to be held at a time, and its
+    ``meta`` is complete once it has been iterated over.
+    '''
+    page, total_pages = start_page, start_page
+    while page <= total_pages:
+        status, stream = stream_server_data(endpoint, page, ordering='id',
+                                            priority=BULK)
+        if status != 200:
+            for item in stream:
+                pass
+            raise IOError('Could not load page {} of {} (status {}): {}'
+                          .format(page, endpoint, status,
+                                  stream.meta.get('detail', '')))
+        yield page, stream
+        total_pages = stream.meta.get('total_pages', total_pages)
+        page += 1
+
+
+def flatten(item):
+    '''
+    Turn an item into a flat row for CSV: nested relations become their id
+    (or ids, separated by ";") with the names in a ``<field>_name`` column.
+    '''
+    row = {}
+    for key, value in item.items():
+        if isinstance(value, dict):
+            row[key] = value.get('id')
+            row[key + '_name'] = value.get('title') or full_name(value)
+        elif isinstance(value, list):
+            row[key] = ';'.join([str(v.get('id')) for v in value])
+            row[key + '_name'] = '; '.join([v.get('title') or full_name(v)
+                                            for v in value])
+        else:
+            row[key] = value
+    return row
+
+
+def csv_columns(endpoint, row):
+    '''
+    The header of a CSV export: the endpoint's fields, with a name column
+    after each relation, then any other field of its first row. Relations
+    that are empty in the first row still get their name column.
+    '''
+    relations = RELATIONS.get(endpoint, {})
+    columns = []
+    for field in EXPORT_FIELDS.get(endpoint, []):
+        columns.append(field)
+        if field in relations:
+            columns.append(field + '_name')
+    return columns + [key for key in row if key not in columns]
+
+
+class CatalogWriter:
+    '''Writes items to an open text file, as CSV or JSON Lines.'''
+    def __init__(self, output, format, columns=None, endpoint=None):
+        self.output = output
+        self.format = format
+        self.columns = columns
+        self.endpoint = endpoint
+        self._csv = None
+        if format == 'csv' and columns is not None:
+            self._csv = csv.DictWriter(output, columns, restval='',
+                                       extrasaction='ignore')
+
+    def write(self, item):
+        if self.format == 'jsonl':
+            self.output.write(json.dumps(item, ensure_ascii=False) + '\n')
+            return
+        row = flatten(item)
+        if self._csv is None:
+            self.columns = csv_columns(self.endpoint, row)
+            self._csv = csv.DictWriter(self.output, self.columns, restval='',
+                                       extrasaction='ignore')
+            self._csv.writeheader()
+        self._csv.writerow(row)
+
+
+def load_progress(path, endpoint, format):
+    '''The saved progress of an unfinished export to ``path``, if any.'''
+    try:
+        with open(progress_path(path)) as saved:
+            state = json.load(saved)
+    except (OSError, ValueError):
+        return None
+    if (state.get('endpoint') != endpoint or state.get('format') != format or
+            not os.path.exists(path)):
+        return None
+    return state
+
+
+def save_progress(path, state):
+    temporary = progress_path(path) + '.tmp'
+    with open(temporary, 'w') as saved:
+        json.dump(state, saved)
+    os.replace(temporary, progress_path(path))
+
+
+def checkpoint(output, path, state, writer, page):
+    '''Make sure everything up to the end of ``page`` is on disk.'''
+    output.flush()
+    os.fsync(output.fileno())
+    state['page'] = page
+    state['size'] = output.tell()
+    state['columns'] = writer.columns
+    save_progress(path, state)
+
+
+def export_catalog(endpoint, path, format='csv', resume=True, progress=None,
+                   cancelled=None):
+    '''
+    Export every item of an endpoint to ``path``, writing each page as it
+    arrives so memory use doesn't depend on the size of the catalog.
+
+    After each page the file is flushed and the position saved next to it,
+    so an interrupted export carries on where it stopped when ``resume`` is
+    true. The last finished page is fetched again and items up to the last
+    one written are skipped, which keeps items from being missed or written
+    twice if some were deleted in between.
+
+    ``progress`` is called with ``(page, total_pages)`` after each page, and
+    the export stops (keeping its progress) once ``cancelled()`` is true.
+    Returns the number of items in the file.
+    '''
+    if format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: {}'.format(format))
+
+    state = load_progress(path, endpoint, format) if resume else None
+    if state is None:
+        state = {'endpoint': endpoint, 'format': format, 'page': 1,
+                 'last_id': None, 'count': 0, 'size': 0, 'columns': None}
+
+    output = open(path, 'a+' if state['size'] else 'w', newline='',
+                  encoding='utf-8')
+    with output:
+        # Drop anything written after the last saved position.
+        output.seek(state['size'])
+        output.truncate()
+        writer = CatalogWriter(output, format, state['columns'], endpoint)
+
+        for page, stream in iter_pages(endpoint, state['page']):
+            for item in stream:
+                if (state['last_id'] is not None and
+                        item['id'] <= state['last_id']):
+                    continue
+                writer.write(item)
+                state['last_id'] = item['id']
+                state['count'] += 1
+
+            checkpoint(output, path, state, writer, page)
+            total_pages = stream.meta.get('total_pages', page)
+            if progress is not None:
+                progress((page, total_pages))
+            if cancelled is not None and cancelled() and page < total_pages:
+                raise ExportCancelled()
+
+    os.remove(progress_path(path))
+    return state['count']
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Commands for running Innkeeper without a window, e.g. from cron.
+
+Only the data layer is used here, never the widgets, so nothing in this
+module (or what it imports) may import ``PyQt5.QtWidgets``. Commands run
+with a ``QCoreApplication`` and use the same settings and stored token as
+the client.
+'''
+
+import json
+import sys
+
+from .export import EXPORT_ENDPOINTS, export_catalog
+from .importer import guess_format, import_catalog
+from .memory import format_report, memory_monitor
+from .stats import format_duration, load_catalog_statistics
+from .sync import sync_catalog
+
+
+COMMANDS = ['sync', 'import', 'export', 'stats']
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def export(args):
+    '''Export one endpoint to a file, resuming an unfinished export.'''
+    format = args.format or 'csv'
+    path = args.output or args.endpoint + '.' + format
+
+    def progress(position):
+        log('Exported page {} of {}'.format(*position))
+
+    count = export_catalog(args.endpoint, path, format, not args.no_resume,
+                           progress)
+    print('Exported {} {} to {}'.format(count, args.endpoint, path))
+    return 0
+
+
+def import_(args):
+    '''Create or update items of one endpoint from a file.'''
+    format = args.format or guess_format(args.input)
+
+    def progress(done):
+        log('Imported {} {}'.format(done, args.endpoint))
+
+    def warn(line, reason):
+        log('Line {}: {}'.format(line, reason))
+
+    created, updated, failed = import_catalog(args.endpoint, args.input,
+                                              format, progress=progress,
+                                              analyze=args.analyze, warn=warn)
+    for line, reason in failed:
+        warn(line, reason)
+    print('Created {} and updated {} {}, {} failed'.format(
+        created, updated, args.endpoint, len(failed)))
+    return 1 if failed else 0
+
+
+def sync(args):
+    '''Update the local mirror of the catalog.'''
+    folder = args.output or 'catalog'
+    endpoints = [args.endpoint] if args.endpoint else EXPORT_ENDPOINTS
+
+    def progress(position):
+        log('Synced page {1} of {2} of {0}'.format(*position))
+
+    results = sync_catalog(folder, endpoints, progress)
+    for endpoint, (count, added, changed, removed) in results.items():
+        print('{}: {} items, {} added, {} changed, {} removed'.format(
+            endpoint, count, added, changed, removed))
+    return 0
+
+
+def stats(args):
+    '''Print the play statistics of the catalog.'''
+    summary = load_catalog_statistics().summary()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(summary, output, indent=2, ensure_ascii=False)
+
+    print('Songs: {}'.format(summary['songs']))
+    print('Total length: {}'.format(
+        format_duration(summary['total_length'])))
+    print('Total plays: {} ({:.2f} per song, {} never played)'.format(
+        summary['total_plays'], summary['average_plays'],
+        summary['never_played']))
+    for title, rows in (('Most played', summary['most_played']),
+                        ('Least played', summary['least_played']),
+                        ('Plays per game', summary['per_game']),
+                        ('Plays per album', summary['per_album'])):
+        print('\n{}:'.format(title))
+        for name, plays in rows:
+            print('  {:6d}  {}'.format(plays, name))
+    print('\nPlay counts:')
+    for label, songs in summary['distribution']:
+        print('  {:>8}  {}'.format(label, songs))
+    return 0
+
+
+def memory_report(args):
+    '''Print what the command left in memory, and what it allocated.'''
+    monitor = memory_monitor()
+    log('\nMemory after {}:'.format(args.headless))
+    log(format_report(monitor.report(), monitor.traced()))
+
+
+def run(args):
+    '''
+    Run the command in ``args.headless``. Returns the exit status. With
+    ``args.memory``, a memory report is printed after it, with the changes
+    since the command started.
+    '''
+    commands = {'sync': sync, 'import': import_, 'export': export,
+                'stats': stats}
+    if args.memory:
+        memory_monitor().report()
+    try:
+        return commands[args.headless](args)
+    except (IOError, ValueError) as error:
+        log('{} failed: {}'.format(args.headless.capitalize(), error))
+        return 1
+    finally:
+        if args.memory:
+            memory_report(args)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Imports items into the radio catalog from CSV or JSON Lines files, like the
+ones written by an export.
+'''
+
+import csv
+import json
+import os
+
+from .analysis import (analysis_path, analyze_songs, load_analysis,
+                       save_analysis)
+from .export import EXPORT_FORMATS
+from .models.edits import save_edits
+from .models.store import (FIELD_TYPES, MANY_RELATIONS, READ_ONLY_FIELDS,
+                           RELATIONS)
+from .scheduler import BULK
+from .utils import describe_error, get_server_data, post_server_data
+
+
+def guess_format(path):
+    '''The format of a file to import, from its extension.'''
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension in ('json', 'jsonl', 'ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_items(path, format):
+    '''Generate each item in a file, with its line number.'''
+    with open(path, newline='', encoding='utf-8') as source:
+        if format == 'jsonl':
+            for number, line in enumerate(source, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+        else:
+            # The header is line 1. Exports write None as an empty cell.
+            for number, row in enumerate(csv.DictReader(source), 2):
+                yield number, {k: None if v == '' else v
+                               for (k, v) in row.items()}
+
+
+def _relation_id(value):
+    if isinstance(value, dict):
+        return value.get('id')
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value) if value.isdigit() else (value or None)
+    return value
+
+
+def item_fields(endpoint, item):
+    '''
+    The fields to send for an item read from a file: relations become ids
+    (exports have them nested, or as ids separated by ";" in CSV), CSV cells
+    of fields that aren't text are converted back, and fields the server
+    sets (like play statistics) and the ``<field>_name`` columns of a CSV
+    export are left out.
+    '''
+    relations = RELATIONS.get(endpoint, {})
+    many = MANY_RELATIONS.get(endpoint, set())
+    types = FIELD_TYPES.get(endpoint, {})
+    fields = {}
+    for key, value in item.items():
+        if key in READ_ONLY_FIELDS or (key.endswith('_name') and
+                                       key[:-5] in item):
+            continue
+        if key in many:
+            if isinstance(value, str):
+                value = [v for v in value.split(';') if v.strip()]
+            value = [_relation_id(v) for v in value or []]
+        elif key in relations:
+            value = _relation_id(value)
+        elif key in types and isinstance(value, str):
+            try:
+                value = types[key](value)
+            except ValueError:
+                pass
+        fields[key] = value
+    return fields
+
+
+def changed_fields(endpoint, id, fields):
+    '''
+    The fields that differ from the item on the server, or None if there is
+    no item with that id anymore.
+    '''
+    status, data = get_server_data('{}/{}'.format(endpoint, id), 0,
+                                   list(fields), priority=BULK)
+    if status == 404:
+        return None
+    if status != 200:
+        raise IOError(describe_error(status, data))
+    current = item_fields(endpoint, data)
+    return {k: v for (k, v) in fields.items()
+            if k not in current or current[k] != v}
+
+
+def server_fields(endpoint):
+    '''
+    The fields the server has for an endpoint's items, going by the first
+    one, or None if there are no items to tell.
+    '''
+    status, data = get_server_data(endpoint, 1, priority=BULK)
+    if status != 200:
+        raise IOError(describe_error(status, data))
+    results = data.get('results') or []
+    return set(results[0]) if results else None
+
+
+def stored_measurements(items, stored, warn=None):
+    '''
+    Leave the measurements of items from analyze_songs() the server has no
+    field for (like ``loudness`` and ``peak``) out, as it would silently drop
+    them. ``warn`` is called the first time one is.
+    '''
+    warned = False
+    for number, item, measured in items:
+        if isinstance(measured, dict):
+            dropped = sorted(set(measured) - stored)
+            if dropped and not warned and warn is not None:
+                warn(number, 'The server has no {} field for songs, so '
+                     "they aren't stored".format(' or '.join(dropped)))
+                warned = True
+            measured = {k: v for (k, v) in measured.items() if k in stored}
+        yield number, item, measured
+
+
+def item_id(item):
+    '''The id of an item read from a file, or None for a new item.'''
+    value = item.get('id')
+    if isinstance(value, str):
+        value = int(value) if value.strip().isdigit() else None
+    return value
+
+
+def import_catalog(endpoint, path, format=None, batch_size=100,
+                   progress=None, analyze=False, warn=None):
+    '''
+    Import every item in a file into an endpoint. Items with the id of an
+    existing item update the fields in the file that differ from it (items
+    that don't differ aren't sent); items without an id (or whose id isn't
+    on the server anymore) are created.
+
+    Items are read and sent a batch at a time, so memory use doesn't depend
+    on the size of the file. ``progress`` is called with the number of items
+    done so far after each batch. Returns the number of items created and
+    updated, and a list of ``(line, reason)`` for the items that failed.
+
+    With ``analyze``, the length, loudness and peak of songs are measured
+    from their files (see ui.analysis), which are only measured again once
+    they change. Only the measurements the server has fields for are
+    stored. Songs whose file can't be measured are imported as they are,
+    and ``warn`` is called with their line and the reason.
+    '''
+    format = format or guess_format(path)
+    if format not in EXPORT_FORMATS:
+        raise ValueError('Unknown import format: {}'.format(format))
+
+    items = ((number, item, None)
+             for (number, item) in read_items(path, format))
+    records = None
+    if analyze and endpoint == 'songs':
+        stored = server_fields(endpoint)
+        records = load_analysis(analysis_path())
+        items = analyze_songs(read_items(path, format), records,
+                              os.path.dirname(os.path.abspath(path)))
+        if stored is not None:
+            items = stored_measurements(items, stored, warn)
+    try:
+        return _import_items(endpoint, items, batch_size, progress, warn)
+    finally:
+        if records is not None:
+            save_analysis(analysis_path(), records)
+
+
+def _import_items(endpoint, items, batch_size, progress, warn):
+    created, updated, failed = 0, 0, []
+
+    def create(number, fields):
+        nonlocal created
+        try:
+            status, data = post_server_data(endpoint, fields, priority=BULK)
+        except Exception as error:
+            failed.append((number, str(error)))
+            return
+        if status in (200, 201):
+            created += 1
+        else:
+            failed.append((number, describe_error(status, data)))
+
+    def flush(batch):
+        nonlocal updated
+        changes = {}
+        for number, id, fields in batch:
+            try:
+                changed = changed_fields(endpoint, id, fields)
+            except Exception as error:
+                failed.append((number, str(error)))
+                continue
+            if changed is None:
+                create(number, fields)
+            elif changed:
+                changes[id] = changed
+        results = save_edits(endpoint, changes, priority=BULK)
+        for number, id, fields in batch:
+            if id not in results:
+                continue
+            status, data = results[id]
+            if status == 200:
+                updated += 1
+            elif status == 404:
+                create(number, fields)
+            else:
+                failed.append((number, data if status is None
+                               else describe_error(status, data)))
+
+    batch, ids = [], set()
+    done = 0
+    for number, item, measured in items:
+        fields = item_fields(endpoint, item)
+        if isinstance(measured, dict):
+            fields.update(measured)
+        elif measured is not None and warn is not None:
+            warn(number, measured)
+        id = item_id(item)
+        if id is None:
+            create(number, fields)
+        else:
+            if id in ids:
+                # The same item twice: send what came before first.
+                flush(batch)
+                batch, ids = [], set()
+            batch.append((number, id, fields))
+            ids.add(id)
+        done += 1
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch, ids = [], set()
+        if progress is not None and done % batch_size == 0:
+            progress(done)
+    flush(batch)
+    if progress is not None and done % batch_size:
+        progress(done)
+    return created, updated, failed
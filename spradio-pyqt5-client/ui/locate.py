@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Finds the page of a paginated table an item is on, to go to it.
+
+The API can't say where an item is in a listing, but a listing is in a known
+order: by its sort field, then by id. Once the item's sort value is known,
+the page it is on is found by binary search, downloading only the ids and
+sort values of O(log n) pages instead of going through them one by one.
+
+Values are compared the way the server's database roughly does: numbers
+and decimal fields (sent as text) as numbers, and other text ignoring case
+and accents, even where it looks like a number. Where that still differs
+from the server's collation the search can end up a page off, so the pages
+next to where it ended are looked at too.
+'''
+
+import math
+import unicodedata
+
+from .models.index import normalize
+from .utils import get_server_data
+
+# Fields the API sends as text, but the database sorts as numbers.
+DECIMAL_FIELDS = {'length'}
+
+
+def sort_field(ordering):
+    '''
+    The field a listing is sorted by, and whether it is descending. Listings
+    that aren't sorted are in order of id.
+    '''
+    if not ordering:
+        return 'id', False
+    field = ordering.split(',')[0]
+    return field.lstrip('-'), field.startswith('-')
+
+
+def sort_value(item, field):
+    '''
+    The value of an ordering field in an item, following relations (like
+    ``album__title``) through the objects the API nests in it.
+    '''
+    value = item
+    for name in field.split('__'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def fold(text):
+    '''Text without case or accents, as collations compare it first.'''
+    text = unicodedata.normalize('NFKD', normalize(text))
+    return ''.join([c for c in text if not unicodedata.combining(c)])
+
+
+def collation_key(value, field=None):
+    '''
+    Key a sort value of ``field`` is compared by: (0, number) for numbers
+    and the values of decimal fields, (1, folded text) for other text, and
+    None for empty values (and numbers that aren't finite, which the
+    database doesn't store).
+    '''
+    if value is None:
+        return None
+    decimal = (field or '').split('__')[-1] in DECIMAL_FIELDS
+    if not is_number(value) and not decimal:
+        return (1, fold(str(value)))
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(number):
+        return None
+    return (0, value if is_number(value) else number)
+
+
+def comes_before(first, second, descending=False):
+    '''
+    Whether the row with (key, id) ``first`` is listed before ``second``.
+    Rows may carry more after those. Empty values are last either way,
+    like on the server.
+    '''
+    (key, id), (other, other_id) = first[:2], second[:2]
+    if (key is None) != (other is None):
+        return other is None
+    if key is not None and key != other:
+        return key > other if descending else key < other
+    return id > other_id if descending else id < other_id
+
+
+def page_rows(endpoint, page, ordering):
+    '''The (key, id, sort value) of each item on a page of a listing.'''
+    field, descending = sort_field(ordering)
+    fields = sorted({'id', field.split('__')[0]})
+    status, data = get_server_data(endpoint, page, fields, ordering)
+    if status == 404:
+        # Past the last page: the listing got shorter.
+        return []
+    if status != 200:
+        raise IOError('Could not load page {} of {} (status {})'
+                      .format(page, endpoint, status))
+    rows = []
+    for row in data.get('results', []):
+        value = sort_value(row, field)
+        rows.append((collation_key(value, field), row['id'], value))
+    return rows
+
+
+def interpolate(page, rows, target, page_size):
+    '''
+    The page ``target`` should be on, going by how far its key is from
+    those on a page, if they are numbers (like ids) that change at a steady
+    rate. None if they don't.
+    '''
+    first, last = rows[0][0], rows[-1][0]
+    if (len(rows) < 2 or
+            any(key is None or key[0] != 0 for key in (first, last,
+                                                       target[0]))):
+        return None
+    step = (last[1] - first[1]) / (len(rows) - 1)
+    if step == 0:
+        return None
+    return page + int((target[0][1] - first[1]) / step // page_size)
+
+
+def first_page(endpoint, ordering, target, total_pages, seen, start=None):
+    '''
+    Search for the first page whose last item isn't listed before
+    ``target``, a (key, id), so the page it is (or would be) on, starting
+    from page ``start``. Returns the page and its rows, or (None, []) if it
+    would be past the end. The ids of every page downloaded are added to
+    ``seen``, by page.
+
+    Pages are bisected, but when keys are numbers, every other page is
+    guessed from the keys on the last one instead, which finds the page of
+    an id in a request or two.
+    '''
+    descending = sort_field(ordering)[1]
+    low, high = 1, total_pages
+    page = start or (low + high) // 2
+    page_size = None
+    found, found_rows = None, []
+    guess = True
+    while low <= high:
+        rows = page_rows(endpoint, page, ordering)
+        seen[page] = [row[1] for row in rows]
+        if rows and comes_before(rows[-1], target, descending):
+            low = page + 1
+        else:
+            found, found_rows = page, rows
+            high = page - 1
+            if rows and not comes_before(target, rows[0], descending):
+                break
+
+        page_size = max(page_size or 0, len(rows))
+        probed, page = page, (low + high) // 2
+        if guess and rows:
+            estimate = interpolate(probed, rows, target, page_size)
+            if estimate is not None:
+                page = min(max(estimate, low), high)
+        guess = not guess
+    return found, found_rows
+
+
+def neighbours(page, total_pages):
+    '''The pages next to one, nearest the end of the search first.'''
+    return [p for p in (page - 1, page + 1) if 1 <= p <= total_pages]
+
+
+def find_item(endpoint, id, ordering, total_pages, hint=None):
+    '''
+    Find the page an item is on, in a listing sorted by ``ordering``.
+    ``hint`` is the page it was last seen on, if any, which is looked at
+    first. Returns the page (None if the item isn't there), the id, and the
+    ids of every page downloaded, by page, to remember where they are.
+    '''
+    seen = {}
+    if hint is not None:
+        seen[hint] = [row[1] for row in page_rows(endpoint, hint, ordering)]
+        if id in seen[hint]:
+            return hint, id, seen
+
+    field, descending = sort_field(ordering)
+    if field == 'id':
+        target = (collation_key(id, field), id)
+    else:
+        status, item = get_server_data('{}/{}'.format(endpoint, id), 0)
+        if status == 404:
+            return None, id, seen
+        if status != 200:
+            raise IOError('Could not load {} {} (status {})'
+                          .format(endpoint, id, status))
+        target = (collation_key(sort_value(item, field), field), id)
+
+    page = first_page(endpoint, ordering, target, total_pages, seen)[0]
+    if page is None:
+        page = total_pages + 1
+    elif id in seen[page]:
+        return page, id, seen
+    for other in neighbours(page, total_pages):
+        if other not in seen:
+            seen[other] = [row[1]
+                           for row in page_rows(endpoint, other, ordering)]
+        if id in seen[other]:
+            return other, id, seen
+    return None, id, seen
+
+
+def find_title(endpoint, title, ordering, total_pages):
+    '''
+    Find the first item whose title starts with ``title`` (ignoring case
+    and accents), and the page it is on, like find_item. When the listing
+    isn't sorted by title, the item is looked for in a listing that is,
+    then found in this one by its id.
+    '''
+    field, descending = sort_field(ordering)
+    listing = ordering if field == 'title' else 'title,id'
+    if listing != ordering:
+        descending = False
+    # Before any item with that title, whatever its id.
+    target = (collation_key(title, 'title'),
+              float('inf') if descending else float('-inf'))
+    seen = {}
+    page, rows = first_page(endpoint, listing, target, total_pages, seen)
+
+    def match(rows, following=True):
+        for row in rows:
+            if following and comes_before(row, target, descending):
+                continue
+            if fold(str(row[2] or '')).startswith(fold(title)):
+                return row[1]
+        return None
+
+    id = match(rows)
+    if page is None:
+        page = total_pages + 1
+    for other in [] if id is not None else neighbours(page, total_pages):
+        rows = page_rows(endpoint, other, listing)
+        seen[other] = [row[1] for row in rows]
+        id = match(rows, following=False)
+        if id is not None:
+            page = other
+            break
+    if id is None:
+        return None, None, seen if listing == ordering else {}
+
+    if listing == ordering:
+        return page, id, seen
+    return find_item(endpoint, id, ordering, total_pages)
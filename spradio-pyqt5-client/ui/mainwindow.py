@@ -9,8 +9,10 @@ from PyQt5.QtCore import QCoreApplication
 from PyQt5.QtWidgets import (QAction, qApp, QGridLayout, QMainWindow,
                              QMessageBox, QTabWidget, QWidget)
 
+from .dialogs.export import ExportDialog
+from .dialogs.memory import MemoryDialog
 from .dialogs.settings import SettingsDialog
-from .widgets import ControlsTab, PlaylistTab
+from .widgets import ControlsTab, PlaylistTab, StatisticsTab
 
 
 class Client(QMainWindow):
@@ -25,11 +27,20 @@ class Client(QMainWindow):
         self.actionSettings.setStatusTip('Change application settings')
         self.actionSettings.triggered.connect(self.showSettings)
 
+        self.actionExport = QAction('&Export Catalog...', self)
+        self.actionExport.setStatusTip('Export the catalog to a file')
+        self.actionExport.triggered.connect(self.showExport)
+
         self.actionExit = QAction('&Exit', self)
         self.actionExit.setShortcut('Ctrl+Q')
         self.actionExit.setStatusTip('Exit application')
         self.actionExit.triggered.connect(self.close)
 
+        self.actionMemory = QAction('&Memory Usage...', self)
+        self.actionMemory.setStatusTip('Show how much memory the client '
+                                       'holds, and where')
+        self.actionMemory.triggered.connect(self.showMemory)
+
         self.actionAbout = QAction('About', self)
         self.actionAbout.setStatusTip('About application')
         self.actionAbout.triggered.connect(self.about)
@@ -42,9 +53,12 @@ class Client(QMainWindow):
         self.menu = self.menuBar()
         self.menuFile = self.menu.addMenu('&File')
         self.menuFile.addAction(self.actionSettings)
+        self.menuFile.addAction(self.actionExport)
         self.menuFile.addSeparator()
         self.menuFile.addAction(self.actionExit)
         self.menuHelp = self.menu.addMenu('&Help')
+        self.menuHelp.addAction(self.actionMemory)
+        self.menuHelp.addSeparator()
         self.menuHelp.addAction(self.actionAbout)
         self.menuHelp.addAction(self.actionAboutQt)
 
@@ -71,8 +85,10 @@ class Client(QMainWindow):
         # Add tabs to the main tab widget
         self.tabPlaylist = PlaylistTab()
         self.tabControls = ControlsTab()
+        self.tabStatistics = StatisticsTab()
         self.tabWidgetMain.addTab(self.tabPlaylist, '')
         self.tabWidgetMain.addTab(self.tabControls, '')
+        self.tabWidgetMain.addTab(self.tabStatistics, '')
 
         self.statusBar()
         self.initMenu()
@@ -86,6 +102,14 @@ class Client(QMainWindow):
         dialogSettings = SettingsDialog()
         dialogSettings.exec_()
 
+    def showExport(self):
+        dialogExport = ExportDialog(self)
+        dialogExport.exec_()
+
+    def showMemory(self):
+        dialogMemory = MemoryDialog(self)
+        dialogMemory.exec_()
+
     def about(self):
         QMessageBox.about(self,
                           'About ' + qApp.applicationName(),
@@ -119,3 +143,6 @@ class Client(QMainWindow):
         self.tabWidgetMain \
             .setTabText(self.tabWidgetMain.indexOf(self.tabControls),
                         _('Client', 'Radio Controls'))
+        self.tabWidgetMain \
+            .setTabText(self.tabWidgetMain.indexOf(self.tabStatistics),
+                        _('Client', 'Statistics'))
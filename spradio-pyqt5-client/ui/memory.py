@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Accounts for the memory held by the client's models, caches and indexes, to
+find out what grows over a long session.
+'''
+
+import itertools
+import os
+import sys
+import threading
+import tracemalloc
+import weakref
+from collections import deque, namedtuple
+
+import numpy as np
+
+
+# One line of a memory report. ``change`` is None in the first report.
+MemoryRow = namedtuple('MemoryRow', ['category', 'name', 'size', 'change'])
+
+ALLOCATIONS = 'Allocations by file'
+
+_sources = []
+_sources_lock = threading.Lock()
+_monitor = None
+
+_ATOMS = (str, bytes, int, float, bool, complex, type(None))
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+
+
+def track(obj):
+    '''
+    Include an object in memory reports for as long as it lives. Its
+    ``memoryUsage()`` returns a list of ``(category, name, bytes)``, which
+    are added up with those of other objects of the same category and name.
+    '''
+    with _sources_lock:
+        _sources.append(weakref.ref(obj, _forget))
+
+
+def _forget(ref):
+    with _sources_lock:
+        try:
+            _sources.remove(ref)
+        except ValueError:
+            pass
+
+
+def deep_size(obj, seen=None, sample=256):
+    '''
+    Approximate bytes held by ``obj`` and the built-in containers, strings,
+    numbers and NumPy arrays it holds, counting objects it holds more than
+    once only once. Containers of over ``sample`` items are estimated from
+    an evenly spaced sample of them. Anything else counts only as itself.
+    '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, _ATOMS):
+        return size
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, _CONTAINERS):
+        items = obj
+    elif isinstance(obj, np.ndarray) and obj.dtype == object:
+        # Only the pointers are in the array.
+        items = obj.ravel()
+    else:
+        return size
+
+    count = len(obj)
+    step = max(1, count // sample)
+    picked = 0
+    contents = 0
+    for item in itertools.islice(items, 0, None, step):
+        picked += 1
+        if isinstance(obj, dict):
+            contents += (deep_size(item[0], seen, sample) +
+                         deep_size(item[1], seen, sample))
+        else:
+            contents += deep_size(item, seen, sample)
+    if picked:
+        contents = contents * count // picked
+    return size + contents
+
+
+def format_size(size, signed=False):
+    '''Format a number of bytes as e.g. "1.5 MiB" (or "+1.5 MiB").'''
+    sign = ''
+    if signed:
+        sign = '+' if size > 0 else '-' if size < 0 else ''
+        size = abs(size)
+    for unit in ('bytes', 'KiB', 'MiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'GiB'
+    if unit == 'bytes':
+        return '{}{} bytes'.format(sign, int(size))
+    return '{}{:.1f} {}'.format(sign, size, unit)
+
+
+def component_sizes():
+    '''Bytes per (category, name), from every tracked object.'''
+    with _sources_lock:
+        objects = [ref() for ref in _sources]
+    sizes = {}
+    for obj in objects:
+        if obj is None:
+            continue
+        try:
+            usage = obj.memoryUsage()
+        except RuntimeError:
+            # The wrapped Qt object was deleted.
+            continue
+        for category, name, size in usage:
+            key = (category, name)
+            sizes[key] = sizes.get(key, 0) + size
+    return sizes
+
+
+def start_tracing_allocations(frames=1):
+    '''
+    Start tracing Python allocations with ``tracemalloc``, so reports show
+    them by file. Only memory allocated from then on is seen.
+    '''
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def memory_monitor():
+    '''Return the application-wide memory monitor, creating it if needed.'''
+    global _monitor
+    if _monitor is None:
+        _monitor = MemoryMonitor()
+    return _monitor
+
+
+class MemoryMonitor:
+    '''
+    Takes memory reports, each with the change since the one before.
+
+    Reports list the estimated size of every tracked model, cache, index and
+    store, and while ``tracemalloc`` is tracing, the memory allocated from
+    each source file, which also covers whatever isn't tracked.
+    '''
+    def __init__(self, top=15):
+        self.top = top
+        self._previous = None
+        self._snapshot = None
+
+    def _shortName(self, filename):
+        '''A file's path within the client, or within the library path.'''
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for folder in [root] + sorted(filter(None, sys.path), key=len,
+                                      reverse=True):
+            if filename.startswith(folder + os.sep):
+                return os.path.relpath(filename, folder)
+        return filename
+
+    def _allocations(self):
+        # Leaving files out of the statistics is much quicker than
+        # filtering the traces of the snapshot.
+        snapshot = tracemalloc.take_snapshot()
+        if self._snapshot is not None:
+            stats = snapshot.compare_to(self._snapshot, 'filename')
+        else:
+            stats = snapshot.statistics('filename')
+        self._snapshot = snapshot
+
+        rows = []
+        for stat in stats:
+            filename = stat.traceback[0].filename
+            if filename in (tracemalloc.__file__, '<unknown>') or \
+                    filename.startswith('<frozen importlib._bootstrap'):
+                continue
+            if len(rows) == self.top:
+                break
+            filename = self._shortName(filename)
+            change = getattr(stat, 'size_diff', None)
+            rows.append(MemoryRow(ALLOCATIONS, filename, stat.size, change))
+        return rows
+
+    def report(self):
+        '''Take a new report. Returns a list of MemoryRows.'''
+        sizes = component_sizes()
+        previous = self._previous
+        rows = [MemoryRow(category, name, size,
+                          None if previous is None
+                          else size - previous.get((category, name), 0))
+                for ((category, name), size) in sorted(sizes.items())]
+        if previous is not None:
+            rows += [MemoryRow(category, name, 0, -size)
+                     for ((category, name), size) in previous.items()
+                     if (category, name) not in sizes]
+        self._previous = sizes
+
+        if tracemalloc.is_tracing():
+            rows += self._allocations()
+        else:
+            self._snapshot = None
+        return rows
+
+    def traced(self):
+        '''Current and peak bytes traced by tracemalloc, or None.'''
+        if not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()
+
+
+def format_report(rows, traced=None, changes_only=False):
+    '''
+    A memory report as text, by category with their totals. With
+    ``changes_only``, only what changed since the report before is listed.
+    '''
+    if changes_only:
+        rows = [row for row in rows if row.change]
+    lines = []
+    categories = []
+    for row in rows:
+        if row.category not in categories:
+            categories.append(row.category)
+    for category in categories:
+        members = [row for row in rows if row.category == category]
+        total = sum(row.size for row in members)
+        lines.append('{:<40} {:>12}'.format(category, format_size(total)))
+        for row in sorted(members, key=lambda r: -r.size):
+            change = ('' if row.change is None
+                      else format_size(row.change, signed=True))
+            lines.append('  {:<38} {:>12} {:>12}'.format(
+                row.name, format_size(row.size), change))
+    if traced is not None:
+        lines.append('Traced by tracemalloc: {} (peak {})'.format(
+            format_size(traced[0]), format_size(traced[1])))
+    return '\n'.join(lines)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Write-behind queue for edits made directly in the tables.
+'''
+
+from PyQt5.QtCore import pyqtSignal, QObject, QTimer
+
+from ..tasks import run_task
+from ..scheduler import INTERACTIVE
+from ..utils import describe_error, patch_server_data
+from .store import entity_store
+
+
+PENDING = 'pending'
+FAILED = 'failed'
+
+
+def save_edits(endpoint, changes, priority=INTERACTIVE):
+    '''
+    Send a batch of edits, one PATCH per item with all of its changed fields.
+    Returns a dict of item id to a (status, data) tuple; an item whose request
+    raised gets a status of None and the error message as its data.
+    '''
+    results = {}
+    for id, fields in changes.items():
+        try:
+            status, etag, data = patch_server_data(endpoint + '/' + str(id),
+                                                   fields, priority=priority)
+            results[id] = status, data
+        except Exception as error:
+            results[id] = None, str(error)
+    return results
+
+
+class EditQueue(QObject):
+    '''
+    Collects edits to the items of an endpoint and saves them in the
+    background once no new edit has come in for ``delay`` milliseconds.
+
+    Until an edit is saved, its value is shown in place of the stored one and
+    its cell is marked as pending. Saved items are merged into the entity
+    store; edits the server rejected stay marked as failed (with the reason)
+    until they are edited again.
+    '''
+    editsChanged = pyqtSignal(list)
+
+    def __init__(self, endpoint, delay=1000, parent=None):
+        super().__init__(parent)
+
+        self.endpoint = endpoint
+        # Item id to {field: value}, for edits not sent yet, edits being sent
+        # and edits that failed. Failed edits also keep the error message.
+        self.pending = {}
+        self.saving = {}
+        self.failed = {}
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+
+    def edit(self, id, field, value):
+        '''Queue a new value for a field, restarting the idle timer.'''
+        self.pending.setdefault(id, {})[field] = value
+        failed = self.failed.get(id)
+        if failed is not None:
+            failed.pop(field, None)
+            if not failed:
+                del self.failed[id]
+        self.editsChanged.emit([id])
+        self.timer.start()
+
+    def value(self, id, field):
+        '''
+        Returns a (edited, value) tuple with the newest unsaved value of a
+        field, if there is one.
+        '''
+        for edits in (self.pending, self.saving):
+            fields = edits.get(id)
+            if fields is not None and field in fields:
+                return True, fields[field]
+        fields = self.failed.get(id)
+        if fields is not None and field in fields:
+            return True, fields[field][0]
+        return False, None
+
+    def state(self, id, field):
+        '''Returns PENDING, FAILED or None for a field of an item.'''
+        if (field in self.pending.get(id, ()) or
+                field in self.saving.get(id, ())):
+            return PENDING
+        if field in self.failed.get(id, ()):
+            return FAILED
+        return None
+
+    def error(self, id, field):
+        fields = self.failed.get(id)
+        if fields is not None and field in fields:
+            return fields[field][1]
+        return None
+
+    def flush(self):
+        '''Send every pending edit now, as one batch.'''
+        self.timer.stop()
+        if not self.pending:
+            return
+        if self.saving:
+            # One batch at a time; the rest go once this one is back.
+            self.timer.start()
+            return
+        self.saving, self.pending = self.pending, {}
+        batch = {id: dict(fields) for (id, fields) in self.saving.items()}
+        run_task(save_edits, self.endpoint, batch,
+                 finished=self.saved, failed=self.saveFailed)
+
+    def saved(self, results):
+        saving, self.saving = self.saving, {}
+        merged = []
+        for id, fields in saving.items():
+            status, data = results.get(id, (None, 'No response'))
+            if status == 200 and isinstance(data, dict):
+                merged.append(data)
+            else:
+                reason = data if status is None else describe_error(status,
+                                                                    data)
+                failed = self.failed.setdefault(id, {})
+                for field, value in fields.items():
+                    if field not in self.pending.get(id, ()):
+                        failed[field] = (value, reason)
+        if merged:
+            entity_store().merge(self.endpoint, merged)
+        self.editsChanged.emit(list(saving.keys()))
+        if self.pending:
+            self.timer.start()
+
+    def saveFailed(self, error):
+        self.saved({id: (None, str(error)) for id in self.saving})
+
+    def discard(self, id, field):
+        '''Forget a failed edit, going back to the stored value.'''
+        fields = self.failed.get(id)
+        if fields is not None and fields.pop(field, None) is not None:
+            if not fields:
+                del self.failed[id]
+            self.editsChanged.emit([id])
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Data model for the station's play history.
+'''
+
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from ..memory import deep_size, track
+from ..nowplaying import parse_timestamp
+from ..utils import full_name
+
+
+HistoryEntry = namedtuple('HistoryEntry', ['played_at', 'id', 'title',
+                                           'artists', 'game', 'num_played'])
+
+
+def history_entry(song, key):
+    '''
+    Build a HistoryEntry from a song sent by the server, using its ``key``
+    field as the time it was played. Returns None if there is no such time.
+    '''
+    played_at = parse_timestamp(song.get(key))
+    if played_at is None:
+        return None
+    return HistoryEntry(played_at.timestamp(),
+                        song['id'],
+                        song.get('title') or '',
+                        ', '.join([full_name(a)
+                                   for a in song.get('artists') or []]),
+                        (song.get('game') or {}).get('title') or '',
+                        song.get('num_played'))
+
+
+class RingBuffer:
+    '''
+    Fixed-capacity sequence that drops its oldest item when a new one is
+    appended while full. Index 0 is the newest item. It always holds at
+    least one item, whatever capacity it is given.
+    '''
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self._items = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError('ring buffer index out of range')
+        position = self._start + self._count - 1 - index
+        return self._items[position % self.capacity]
+
+    def __iter__(self):
+        '''Iterate from the oldest item to the newest.'''
+        for index in range(self._count):
+            yield self._items[(self._start + index) % self.capacity]
+
+    def full(self):
+        return self._count == self.capacity
+
+    def append(self, item):
+        '''Add an item, dropping the oldest one first if full.'''
+        if self.full():
+            self.drop_oldest()
+        self._items[(self._start + self._count) % self.capacity] = item
+        self._count += 1
+
+    def drop_oldest(self):
+        '''Remove and return the oldest item.'''
+        if not self._count:
+            raise IndexError('drop from empty ring buffer')
+        item = self._items[self._start]
+        self._items[self._start] = None
+        self._start = (self._start + 1) % self.capacity
+        self._count -= 1
+        return item
+
+
+class PlayHistoryModel(QAbstractTableModel):
+    '''
+    Data model of the most recently played songs, newest first, held in a
+    ring buffer so memory stays constant. Recording a play inserts one row
+    at the top (and removes the oldest once full) instead of resetting.
+    '''
+    def __init__(self, capacity=500, parent=None):
+        super().__init__(parent)
+
+        self.columns = {'played_at': 'Played',
+                        'title': 'Title',
+                        'artists': 'Artists',
+                        'game': 'Game',
+                        'num_played': 'Times played'}
+        self._history = RingBuffer(capacity)
+        track(self)
+
+    def record(self, entries):
+        '''
+        Add plays that are newer than anything recorded so far, oldest first.
+        Anything older, including plays already recorded, is ignored.
+        '''
+        entries = sorted([e for e in entries if e is not None],
+                         key=lambda e: e.played_at)
+        for entry in entries:
+            if (len(self._history) and
+                    entry.played_at <= self._history[0].played_at):
+                continue
+
+            if self._history.full():
+                last = len(self._history) - 1
+                self.beginRemoveRows(QModelIndex(), last, last)
+                self._history.drop_oldest()
+                self.endRemoveRows()
+            self.beginInsertRows(QModelIndex(), 0, 0)
+            self._history.append(entry)
+            self.endInsertRows()
+
+    def load(self, path):
+        '''Restore history saved by a previous session, if there is any.'''
+        try:
+            with open(path) as saved:
+                entries = [HistoryEntry(*e) for e in json.load(saved)]
+        except (OSError, ValueError, TypeError):
+            return
+        self.record(entries)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as saved:
+            json.dump([list(e) for e in self._history], saved)
+
+    def memoryUsage(self):
+        return [('Models', type(self).__name__,
+                 deep_size(self._history._items))]
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.columns)
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self._history)
+
+    def data(self, index, role):
+        if index.isValid():
+            if (role == Qt.DisplayRole) or (role == Qt.EditRole):
+                attr_name = list(self.columns.keys())[index.column()]
+                entry = self._history[index.row()]
+                value = getattr(entry, attr_name)
+                if attr_name == 'played_at':
+                    return (datetime.fromtimestamp(value)
+                            .strftime('%Y-%m-%d %H:%M'))
+                return value
+        return None
+
+    def headerData(self, col, orientation, role):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return list(self.columns.values())[col]
+        return None
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+In-memory prefix indexes of entity names, for completing them as they are
+typed.
+'''
+
+from bisect import bisect_left, insort
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from ..memory import deep_size, track
+from ..scheduler import PREFETCH
+from ..tasks import run_task
+from ..utils import full_name, get_server_data
+from .store import entity_store
+
+
+_indexes = {}
+
+# Fields an entity's name is made of.
+NAME_FIELDS = {'artists': ['id', 'alias', 'first_name', 'last_name']}
+
+
+def normalize(text):
+    '''Key used to compare names: case folded, with single spaces.'''
+    return ' '.join(text.casefold().split())
+
+
+def entity_name(kind, entity):
+    '''The name an entity is shown and completed by.'''
+    if kind == 'artists':
+        return full_name(entity)
+    return entity.get('title') or ''
+
+
+def fetch_names(kind):
+    '''
+    Download the (id, name) of every entity of a kind, requesting only the
+    fields its name is made of.
+    '''
+    fields = NAME_FIELDS.get(kind, ['id', 'title'])
+    names, page, total_pages = [], 1, 1
+    while page <= total_pages:
+        status, data = get_server_data(kind, page, fields, priority=PREFETCH)
+        if status != 200:
+            raise IOError('Could not load page {} of {} (status {})'
+                          .format(page, kind, status))
+        names += [(e['id'], entity_name(kind, e)) for e in data['results']]
+        total_pages = data.get('total_pages', 1)
+        page += 1
+    return names
+
+
+def entity_index(kind):
+    '''
+    Return the application-wide index of the names of one kind of entity,
+    building it from the entity store the first time.
+    '''
+    index = _indexes.get(kind)
+    if index is None:
+        index = _indexes[kind] = EntityIndex(kind)
+    return index
+
+
+class PrefixIndex:
+    '''
+    Sorted arrays of (key, id) pairs, searched by binary search. Every name
+    is indexed as a whole and from the start of each of its words, so "fin"
+    finds both "Final Fantasy" and "Chrono Finale". Whole-name matches are
+    returned first.
+
+    Lookups cost O(log n) plus the number of results; adding, renaming or
+    removing one name costs a single insertion or deletion per word.
+    '''
+    def __init__(self):
+        self._names = []
+        self._words = []
+        self._entries = {}
+        track(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, id):
+        return id in self._entries
+
+    def memoryUsage(self):
+        name = getattr(self, 'kind', None) or type(self).__name__
+        return [('Indexes', name,
+                 deep_size([self._names, self._words, self._entries]))]
+
+    def _keys(self, name):
+        key = normalize(name)
+        words = key.split(' ')
+        return key, [' '.join(words[i:]) for i in range(1, len(words))]
+
+    def load(self, entries):
+        '''Replace the index with the given (id, name) pairs, in one sort.'''
+        self._entries = dict(entries)
+        self._names = []
+        self._words = []
+        for id, name in self._entries.items():
+            key, words = self._keys(name)
+            self._names.append((key, id))
+            self._words.extend([(word, id) for word in words])
+        self._names.sort()
+        self._words.sort()
+
+    def _delete(self, entries, pair):
+        position = bisect_left(entries, pair)
+        if position < len(entries) and entries[position] == pair:
+            del entries[position]
+
+    def add(self, id, name):
+        '''Add a name, or rename the entity if it is already indexed.'''
+        previous = self._entries.get(id)
+        if previous == name:
+            return
+        if previous is not None:
+            self.remove(id)
+        self._entries[id] = name
+        key, words = self._keys(name)
+        insort(self._names, (key, id))
+        for word in words:
+            insort(self._words, (word, id))
+
+    def remove(self, id):
+        name = self._entries.pop(id, None)
+        if name is None:
+            return
+        key, words = self._keys(name)
+        self._delete(self._names, (key, id))
+        for word in words:
+            self._delete(self._words, (word, id))
+
+    def name(self, id):
+        return self._entries.get(id)
+
+    def search(self, text, limit=20):
+        '''
+        Returns up to ``limit`` (id, name) pairs whose name, or one of its
+        words, starts with ``text``.
+        '''
+        prefix = normalize(text)
+        results = []
+        seen = set()
+        for entries in (self._names, self._words):
+            position = bisect_left(entries, (prefix,))
+            while position < len(entries) and len(results) < limit:
+                key, id = entries[position]
+                if not key.startswith(prefix):
+                    break
+                if id not in seen:
+                    seen.add(id)
+                    results.append((id, self._entries[id]))
+                position += 1
+        return results
+
+    def exact(self, text):
+        '''Ids of every entity whose whole name is ``text``, ignoring case.'''
+        key = normalize(text)
+        position = bisect_left(self._names, (key,))
+        ids = []
+        while (position < len(self._names) and
+               self._names[position][0] == key):
+            ids.append(self._names[position][1])
+            position += 1
+        return ids
+
+
+class EntityIndex(QObject, PrefixIndex):
+    '''
+    Prefix index of one kind of entity, kept up to date from the entity
+    store as entities are loaded, edited and deleted.
+
+    Entities stay indexed when the store drops them for no longer being
+    shown, since they still exist on the server. Tables only load the pages
+    that are shown, so the names of the rest are downloaded by loadNames(),
+    in the background; ``namesFinished`` is emitted when it is done, whether
+    the names could be loaded or not.
+    '''
+    namesFinished = pyqtSignal()
+
+    def __init__(self, kind):
+        super().__init__()
+
+        self.kind = kind
+        self.complete = False
+        self.loading = False
+        self.store = entity_store()
+        self.load([(e['id'], entity_name(kind, e))
+                   for e in self.store.entities(kind)])
+        self.store.entitiesAdded.connect(self.entitiesChanged)
+        self.store.entitiesChanged.connect(self.entitiesChanged)
+        self.store.entitiesRemoved.connect(self.entitiesRemoved)
+
+    def loadNames(self):
+        '''
+        Download the names of every entity of the kind in the background,
+        once, so entities that were never shown can be completed too.
+        '''
+        if self.complete or self.loading:
+            return
+        self.loading = True
+        run_task(fetch_names, self.kind, finished=self.namesLoaded,
+                 failed=self.namesFailed)
+
+    def namesLoaded(self, names):
+        self.loading = False
+        if not self.complete:
+            # What the store has is at least as recent.
+            for id, name in names:
+                if id not in self:
+                    self.add(id, name)
+            self.complete = True
+        self.namesFinished.emit()
+
+    def namesFailed(self, error):
+        self.loading = False
+        self.namesFinished.emit()
+
+    def entitiesChanged(self, kind, ids):
+        if kind != self.kind:
+            return
+        for id in ids:
+            entity = self.store.get(kind, id)
+            if entity is not None:
+                self.add(id, entity_name(kind, entity))
+
+    def entitiesRemoved(self, kind, ids):
+        if kind != self.kind:
+            return
+        for id in ids:
+            self.remove(id)
@@ -5,13 +5,74 @@
 Data models used within the application for the radio playlist.
 '''
 
-from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+import locale
+from collections import OrderedDict
 
-from ..utils import full_name, get_server_data
+from PyQt5.QtCore import (pyqtSignal, QAbstractTableModel, QModelIndex,
+                          QSettings, Qt)
+from PyQt5.QtGui import QColor, QFont
+
+from .. import tracing
+from ..memory import deep_size, track
+from ..scheduler import VISIBLE
+from ..tasks import run_task
+from ..thumbnails import ART_FIELD, thumbnail_loader
+from ..utils import full_name, stream_server_data
+from .edits import EditQueue, FAILED, PENDING
+from .store import entity_store, RELATIONS
+
+
+def fetch_rows(endpoint, page, fields, ordering=None):
+    '''Download a page of results. Returns its rows and the page's meta.'''
+    status, stream = stream_server_data(endpoint, page, fields, ordering,
+                                        priority=VISIBLE)
+    rows = list(stream)
+    if status != 200:
+        raise IOError('Could not load page {} of {} (status {})'
+                      .format(page, endpoint, status))
+    return rows, stream.meta
+
+
+def fetch_all_rows(endpoint, fields, ordering=None):
+    '''Download every page of results. Returns the rows and the last meta.'''
+    rows, page, total_pages = [], 1, 1
+    while page <= total_pages:
+        page_rows, meta = fetch_rows(endpoint, page, fields, ordering)
+        rows += page_rows
+        total_pages = meta.get('total_pages', 1)
+        page += 1
+    return rows, meta
 
 
 class BaseRadioModel(QAbstractTableModel):
-    '''Base data model to represent radio items.'''
+    '''
+    Base data model to represent radio items.
+
+    A model shows one page of its endpoint when paginated, and otherwise
+    every item. A windowed model also shows every item, but only keeps the
+    pages that were looked at most recently, up to ``max_rows`` rows (the
+    ``models/max_rows`` setting). Other pages are downloaded in the
+    background when a view asks for their rows.
+
+    A model that has every item sorts them itself, by keys worked out once
+    per item and column and kept until the item changes. Paginated and
+    windowed models only have some of the items, so they have the server
+    sort them instead, by the fields in ``sort_fields`` (a column that maps
+    to None can't be sorted). The sort order is kept in the settings.
+
+    ``refresh()`` downloads the rows the model has again in the background
+    and applies only what changed, without a reset, emitting ``refreshed``
+    when done.
+    '''
+    refreshed = pyqtSignal()
+
+    # Column name to the server's field to order by, where they differ.
+    sort_fields = {}
+    # Fields fetched besides the visible columns, for thumbnails.
+    extra_fields = []
+    # Whether the first column shows a thumbnail of each item.
+    show_thumbnails = False
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -19,57 +80,579 @@ class BaseRadioModel(QAbstractTableModel):
         self.columns = {k: v['header'] for (k, v) in parent.columns.items()
                         if v['visible']}
         self.paginate = parent.paginate
+        self.windowed = parent.windowed
+        # Only ask the server for what the table shows. Anything else (e.g.
+        # for the edit dialog) is fetched per item when it is needed.
+        self.fields = [k for (k, v) in parent.columns.items()
+                       if v['visible'] or k == 'id']
+        self.fields += [k for k in self.extra_fields if k not in self.fields]
+
+        # Rows are ids of entities in the shared store.
+        self.store = entity_store()
+        self.store.entitiesChanged.connect(self.entitiesChanged)
+        self.relations = set(RELATIONS.get(self.name, {}).values())
+        self._ids = []
+
+        # Plain fields can be edited in place; relations need the dialog.
+        self.editable = {k for (k, v) in parent.columns.items()
+                         if v['visible'] and v['editable'] and
+                         k not in RELATIONS.get(self.name, {})}
+        self.edits = EditQueue(self.name, parent=self)
+        self.edits.editsChanged.connect(self.editsChanged)
 
-        self._data = []
         self.current_page = 1
         self.total_pages = 1
+        self.batch_size = 100
+
+        # Windowed mode: cached pages of ids, least recently used first.
+        self.max_rows = QSettings().value('models/max_rows', 2000, type=int)
+        self.page_size = 1
+        self.row_count = 0
+        self._pages = OrderedDict()
+        self._loading = set()
+        self._refreshing = set()
+        self._generation = 0
 
+        # The page each item was last seen on, under the current ordering.
+        self._locations = {}
+
+        # Sort column name (None if unsorted) and order, and the sort keys of
+        # each column by item id.
+        settings = QSettings()
+        settings.beginGroup('sorting/' + self.name)
+        self.sort_column = settings.value('column', None, type=str) or None
+        self.sort_order = settings.value('order', Qt.AscendingOrder, type=int)
+        settings.endGroup()
+        self._sort_keys = {}
+
+        self.thumbnails = None
+        if self.show_thumbnails:
+            self.thumbnails = thumbnail_loader()
+            self.thumbnails.thumbnailsReady.connect(self.thumbnailsReady)
+        track(self)
+
+    @tracing.traced()
     def updateData(self):
+        if self.windowed:
+            self.updateWindow()
+            return
+
+        self._generation += 1
+        previous = self._ids
+        self.beginResetModel()
+        self._ids = []
+        self.endResetModel()
+
+        if self.paginate:
+            self.total_pages = self.fetchPage(self.current_page)
+            self.indexPages({self.current_page: self._ids})
+        else:
+            self.total_pages = self.fetchPage(1)
+            for page in range(2, self.total_pages + 1):
+                self.fetchPage(page)
+            self.sortRows()
+
+        # Released after loading, so entities still shown aren't dropped and
+        # merged again.
+        self.store.release(self.name, previous)
+
+    @tracing.traced()
+    def fetchPage(self, page):
+        '''
+        Stream a page of results from the server into the model, a batch of
+        rows at a time. Returns the total number of pages.
+        '''
+        status, stream = stream_server_data(self.name, page, self.fields,
+                                            self.ordering(), priority=VISIBLE)
+        batch = []
+        for row in stream:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.appendRows(batch)
+                batch = []
+        self.appendRows(batch)
+        return stream.meta.get('total_pages', 1)
+
+    @tracing.traced()
+    def appendRows(self, rows):
+        '''
+        Merge rows into the store and add them to the end of the model,
+        notifying any views.
+        '''
+        if rows:
+            ids = self.store.merge(self.name, rows)
+            self.store.hold(self.name, ids)
+            first = len(self._ids)
+            self.beginInsertRows(QModelIndex(), first, first + len(ids) - 1)
+            self._ids.extend(ids)
+            self.endInsertRows()
+
+    @tracing.traced()
+    def updateWindow(self):
+        '''
+        Start over with only the first page, which also tells how many rows
+        there are in all.
+        '''
+        previous = [id for ids in self._pages.values() for id in ids]
+        rows, meta = fetch_rows(self.name, 1, self.fields, self.ordering())
+        ids = self.store.merge(self.name, rows)
+        self.store.hold(self.name, ids)
+
+        self.beginResetModel()
+        self._generation += 1
+        self._loading.clear()
+        self._refreshing.clear()
+        self._pages = OrderedDict([(1, ids)])
+        self.indexPages({1: ids})
+        self.total_pages = meta.get('total_pages', 1)
+        # The first page is full, or holds every row.
+        self.page_size = max(len(ids), 1)
+        self.row_count = meta.get('count', len(ids) * self.total_pages)
+        self.endResetModel()
+
+        self.store.release(self.name, previous)
+
+    def requestPage(self, page):
+        '''Download a page that isn't cached, in the background.'''
+        if page in self._loading:
+            return
+        self._loading.add(page)
+        generation = self._generation
+        run_task(fetch_rows, self.name, page, self.fields, self.ordering(),
+                 finished=lambda result: self.pageLoaded(generation, page,
+                                                         result),
+                 failed=lambda error: self.pageFailed(generation, page))
+
+    def pageFailed(self, generation, page):
+        if generation != self._generation:
+            return
+        self._loading.discard(page)
+        self.pageRefreshed(page)
+
+    def pageRefreshed(self, page):
+        '''Note that a page being refreshed is done, loaded or not.'''
+        if page in self._refreshing:
+            self._refreshing.discard(page)
+            if not self._refreshing:
+                self.refreshed.emit()
+
+    @tracing.traced()
+    def pageLoaded(self, generation, page, result):
+        if generation != self._generation:
+            # Loaded for data that has been refreshed since.
+            return
+        self._loading.discard(page)
+        rows, meta = result
+        ids = self.store.merge(self.name, rows)
+        self.store.hold(self.name, ids)
+        # A refreshed page replaces the ids it had.
+        previous = self._pages.get(page, [])
+        self._pages[page] = ids
+        self.indexPages({page: ids})
+        self.store.release(self.name, previous)
+        self.evictPages()
+
+        if page == 1:
+            self.page_size = max(len(ids), 1)
+        first = (page - 1) * self.page_size
+        count = meta.get('count')
+        if count is None:
+            # Without a count the rows were estimated from full pages, until
+            # the last one tells how many there are.
+            count = self.row_count
+            if page >= meta.get('total_pages', self.total_pages):
+                count = first + len(ids)
+        if count != self.row_count:
+            # Items were added or deleted on the server since the first page.
+            if count > self.row_count:
+                self.beginInsertRows(QModelIndex(), self.row_count, count - 1)
+                self.row_count = count
+                self.endInsertRows()
+            else:
+                self.beginRemoveRows(QModelIndex(), count, self.row_count - 1)
+                self.row_count = count
+                self.endRemoveRows()
+        last = min(first + len(ids), self.row_count) - 1
+        if last >= first:
+            self.dataChanged.emit(self.index(first, 0),
+                                  self.index(last, self.columnCount() - 1))
+        self.pageRefreshed(page)
+
+    def refresh(self):
+        '''
+        Download the rows the model has again, in the background. Items that
+        changed are repainted through the store, and rows are added, removed
+        or moved in place, so the selection stays with its item (or, in a
+        windowed model, its row).
+        '''
+        if self.windowed:
+            self._refreshing = set(self._pages)
+            for page in self._refreshing:
+                self.requestPage(page)
+            return
+        generation = self._generation
+        if self.paginate:
+            run_task(fetch_rows, self.name, self.current_page, self.fields,
+                     self.ordering(), finished=lambda result:
+                     self.rowsRefreshed(generation, result))
+        else:
+            run_task(fetch_all_rows, self.name, self.fields,
+                     self.ordering(), finished=lambda result:
+                     self.rowsRefreshed(generation, result))
+
+    @tracing.traced()
+    def rowsRefreshed(self, generation, result):
+        if generation != self._generation:
+            return
+        rows, meta = result
+        previous = self._ids
+        ids = self.store.merge(self.name, rows)
+        self.store.hold(self.name, ids)
+        self.total_pages = meta.get('total_pages', self.total_pages)
         if self.paginate:
-            status, results = get_server_data(self.name, self.current_page)
-            self._data = results['results']
-            self.total_pages = results['total_pages']
+            self.indexPages({self.current_page: ids})
+        self.replaceRows(ids)
+        self.sortRows()
+        self.store.release(self.name, previous)
+        self.refreshed.emit()
+
+    def replaceRows(self, ids):
+        '''
+        Show ``ids`` instead of the current rows. Rows past the end are
+        inserted first and removed last, so persistent indexes (like the
+        selection) can be moved to the new row of their item in between.
+        '''
+        if ids == self._ids:
+            return
+        if len(ids) > len(self._ids):
+            self.beginInsertRows(QModelIndex(), len(self._ids), len(ids) - 1)
+            self._ids = self._ids + ids[len(self._ids):]
+            self.endInsertRows()
+
+        rows = {}
+        for row, id in enumerate(ids):
+            rows.setdefault(id, row)
+        self.layoutAboutToBeChanged.emit()
+        before = self._ids
+        self._ids = ids + before[len(ids):]
+        previous = self.persistentIndexList()
+        self.changePersistentIndexList(
+            previous, [self.index(rows[before[index.row()]], index.column())
+                       if before[index.row()] in rows else QModelIndex()
+                       for index in previous])
+        self.layoutChanged.emit()
+
+        if len(self._ids) > len(ids):
+            self.beginRemoveRows(QModelIndex(), len(ids), len(self._ids) - 1)
+            self._ids = ids
+            self.endRemoveRows()
+
+    def indexPages(self, pages):
+        '''
+        Remember which page the items of some pages are on, given their ids
+        by page. Pages go on being listed in the current ordering, so these
+        are only hints once items are added or deleted: wherever one is
+        used, the page is checked.
+        '''
+        for page, ids in pages.items():
+            for id in ids:
+                self._locations[id] = page
+
+    def pageOf(self, id):
+        '''The page an item was last seen on, or None.'''
+        return self._locations.get(id)
+
+    def rowOf(self, id):
+        '''The row of an item, if it is in memory, or None.'''
+        for row, row_id in self.loadedRows():
+            if row_id == id:
+                return row
+        return None
+
+    def evictPages(self):
+        '''Drop the least recently used pages that don't fit in max_rows.'''
+        max_pages = max(2, self.max_rows // self.page_size)
+        while len(self._pages) > max_pages:
+            page, ids = self._pages.popitem(last=False)
+            self.store.release(self.name, ids)
+
+    def rowId(self, row):
+        '''
+        The id of the item in a row, or None if the row's page isn't loaded
+        (in which case it is requested).
+        '''
+        if not self.windowed:
+            return self._ids[row]
+        page = row // self.page_size + 1
+        ids = self._pages.get(page)
+        if ids is None:
+            self.requestPage(page)
+            return None
+        self._pages.move_to_end(page)
+        offset = row % self.page_size
+        return ids[offset] if offset < len(ids) else None
+
+    def memoryUsage(self):
+        '''
+        Estimated bytes of the rows, sort keys and unsaved edits, of the
+        page cache of a windowed model and of the pages items are on. The
+        items themselves are in the entity store.
+        '''
+        name = type(self).__name__
+        rows = deep_size([self._ids, self._sort_keys, self.edits.pending,
+                          self.edits.saving, self.edits.failed])
+        usage = [('Models', name, rows)]
+        if self.windowed:
+            usage.append(('Caches', 'Page cache', deep_size(self._pages)))
+        if self._locations:
+            usage.append(('Indexes', 'Page locations',
+                          deep_size(self._locations)))
+        return usage
+
+    def isRowLoaded(self, row):
+        if not self.windowed:
+            return True
+        return (row // self.page_size + 1) in self._pages
+
+    def loadedRows(self):
+        '''Generate (row, id) for every row that is in memory.'''
+        if not self.windowed:
+            yield from enumerate(self._ids)
+            return
+        for page, ids in self._pages.items():
+            first = (page - 1) * self.page_size
+            for offset, id in enumerate(ids):
+                yield first + offset, id
+
+    def sortsOnServer(self):
+        return self.paginate or self.windowed
+
+    def isSortable(self, attr_name):
+        if not self.sortsOnServer():
+            return True
+        return self.sort_fields.get(attr_name, attr_name) is not None
+
+    def ordering(self):
+        '''
+        The ordering parameter for the server: the sort fields, each prefixed
+        by '-' when descending, then the id so pages split ties the same way.
+        '''
+        if not self.sortsOnServer() or self.sort_column is None:
+            return None
+        field = self.sort_fields.get(self.sort_column, self.sort_column)
+        if field is None:
+            return None
+        if self.sort_order == Qt.DescendingOrder:
+            return ','.join(['-' + f for f in field.split(',')] + ['-id'])
+        return field + ',id'
+
+    def setSortColumn(self, column, order=Qt.AscendingOrder):
+        '''
+        Sort by a column from now on, and remember it. Returns False if the
+        column can't be sorted.
+        '''
+        names = list(self.columns.keys())
+        if not 0 <= column < len(names) or not self.isSortable(names[column]):
+            return False
+        if (names[column], order) != (self.sort_column, self.sort_order):
+            self._locations.clear()
+        self.sort_column = names[column]
+        self.sort_order = order
+        settings = QSettings()
+        settings.beginGroup('sorting/' + self.name)
+        settings.setValue('column', self.sort_column)
+        settings.setValue('order', int(order))
+        settings.endGroup()
+        return True
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        '''
+        Sort by a column. A model that sorts on the server reloads its data;
+        one that has every item puts it in order now.
+        '''
+        if not self.setSortColumn(column, order):
+            return
+        if self.sortsOnServer():
+            self.updateData()
         else:
-            all_items = []
-            status, results = get_server_data(self.name, 1)
-            all_items += results['results']
-            for x in range(2, results['total_pages'] + 1):
-                status, results = get_server_data(self.name, x)
-                all_items += results['results']
-            self._data = all_items
-        self.updateLayout()
+            self.sortRows()
+
+    def sortColumn(self):
+        '''The index of the sort column, or -1 if unsorted.'''
+        names = list(self.columns.keys())
+        if self.sort_column in names:
+            return names.index(self.sort_column)
+        return -1
 
-    def updateLayout(self):
+    def sortKey(self, entity, attr_name):
         '''
-        Force the view to refresh itself after the data has been changed.
+        Key a value is sorted by: numbers as they are and text collated by
+        the locale. Empty values get None, and go last either way.
+        '''
+        value = self.value(entity, attr_name)
+        if value is None or value == '':
+            return None
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return (0, value)
+        return (1, locale.strxfrm(str(value).casefold()))
+
+    @tracing.traced()
+    def sortRows(self):
         '''
+        Put every row in order of the sort column, as one permutation of the
+        ids. Keys already worked out for an item are used again.
+        '''
+        if self.sortsOnServer() or self.sort_column not in self.columns:
+            return
+        attr_name = self.sort_column
+        keys = self._sort_keys.setdefault(attr_name, {})
+        if len(keys) > 2 * len(self._ids):
+            # Mostly items that are no longer shown.
+            keys.clear()
+        row_keys = []
+        for id in self._ids:
+            if id not in keys:
+                entity = self.store.get(self.name, id)
+                keys[id] = (None if entity is None
+                            else self.sortKey(entity, attr_name))
+            row_keys.append(keys[id])
+
+        rows = [row for row, key in enumerate(row_keys) if key is not None]
+        rows.sort(key=row_keys.__getitem__,
+                  reverse=self.sort_order == Qt.DescendingOrder)
+        rows += [row for row, key in enumerate(row_keys) if key is None]
+
         self.layoutAboutToBeChanged.emit()
-        self.dataChanged.emit(self.createIndex(0, 0),
-                              self.createIndex(self.rowCount(0),
-                                               self.columnCount(0)))
+        new_rows = [0] * len(rows)
+        for new_row, old_row in enumerate(rows):
+            new_rows[old_row] = new_row
+        self._ids = [self._ids[row] for row in rows]
+        previous = self.persistentIndexList()
+        self.changePersistentIndexList(
+            previous, [self.index(new_rows[index.row()], index.column())
+                       for index in previous])
         self.layoutChanged.emit()
 
+    def entitiesChanged(self, kind, ids):
+        '''Repaint when an entity this model shows was changed elsewhere.'''
+        # Forget the sort keys that may have changed.
+        if kind == self.name:
+            for keys in self._sort_keys.values():
+                for id in ids:
+                    keys.pop(id, None)
+        elif kind in self.relations:
+            for attr_name, related in RELATIONS[self.name].items():
+                if related == kind:
+                    self._sort_keys.pop(attr_name, None)
+
+        if self.rowCount() and (kind == self.name or kind in self.relations):
+            self.dataChanged.emit(self.index(0, 0),
+                                  self.index(self.rowCount() - 1,
+                                             self.columnCount() - 1))
+
+    def editsChanged(self, ids):
+        '''Repaint the rows of items whose edits were queued or saved.'''
+        ids = set(ids)
+        rows = sorted([row for (row, id) in self.loadedRows() if id in ids])
+        if rows:
+            self.dataChanged.emit(self.index(rows[0], 0),
+                                  self.index(rows[-1],
+                                             self.columnCount() - 1))
+
+    def thumbnailsReady(self, kind, ids):
+        '''Repaint the thumbnails that were loaded.'''
+        if kind != self.name:
+            return
+        ids = set(ids)
+        rows = sorted([row for (row, id) in self.loadedRows() if id in ids])
+        if rows:
+            self.dataChanged.emit(self.index(rows[0], 0),
+                                  self.index(rows[-1], 0),
+                                  [Qt.DecorationRole])
+
+    def entity(self, row):
+        id = self.rowId(row)
+        return None if id is None else self.store.get(self.name, id)
+
     def columnCount(self, parent=QModelIndex()):
         return len(self.columns)
 
     def rowCount(self, parent=QModelIndex()):
-        return len(self._data)
+        if self.windowed:
+            return self.row_count
+        return len(self._ids)
 
     def data(self, index, role):
         if index.isValid():
+            attr_name = list(self.columns.keys())[index.column()]
+            id = self.rowId(index.row())
+            if id is None:
+                return None
             if (role == Qt.DisplayRole) or (role == Qt.EditRole):
-                attr_name = list(self.columns.keys())[index.column()]
-                row = self._data[index.row()]
-                return row[attr_name]
+                edited, value = self.edits.value(id, attr_name)
+                if edited:
+                    return value
+                entity = self.store.get(self.name, id)
+                return None if entity is None else self.value(entity,
+                                                              attr_name)
+            elif role == Qt.DecorationRole:
+                if self.thumbnails is not None and index.column() == 0:
+                    return self.thumbnails.thumbnail(self.name, id)
+            elif role == Qt.FontRole:
+                if self.edits.state(id, attr_name) == PENDING:
+                    font = QFont()
+                    font.setItalic(True)
+                    return font
+            elif role == Qt.ForegroundRole:
+                if self.edits.state(id, attr_name) == FAILED:
+                    return QColor(Qt.red)
+            elif role == Qt.ToolTipRole:
+                state = self.edits.state(id, attr_name)
+                if state == PENDING:
+                    return 'Saving...'
+                elif state == FAILED:
+                    return ('Could not save: ' +
+                            self.edits.error(id, attr_name))
         return None
 
+    def isEdited(self, index):
+        '''Whether a cell has an edit that is unsaved or failed to save.'''
+        if not (self.edits.pending or self.edits.saving or self.edits.failed):
+            return False
+        id = self.rowId(index.row())
+        attr_name = list(self.columns.keys())[index.column()]
+        return id is not None and self.edits.state(id, attr_name) is not None
+
+    def value(self, entity, attr_name):
+        '''The value shown for a field of an entity.'''
+        return entity[attr_name]
+
+    def setData(self, index, value, role=Qt.EditRole):
+        '''Queue an edit of a cell, to be saved in the background.'''
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        attr_name = list(self.columns.keys())[index.column()]
+        if attr_name not in self.editable:
+            return False
+        id = self.rowId(index.row())
+        if id is None:
+            return False
+        if (self.edits.state(id, attr_name) is None and
+                value == self.value(self.entity(index.row()), attr_name)):
+            return False
+        self.edits.edit(id, attr_name, value)
+        return True
+
     def rowData(self, index):
         if index.isValid():
-            return self._data[index.row()]
+            return self.entity(index.row())
         return None
 
     def flags(self, index):
-        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if list(self.columns.keys())[index.column()] in self.editable:
+            flags |= Qt.ItemIsEditable
+        return flags
 
     def headerData(self, col, orientation, role):
         if orientation == Qt.Horizontal and role == Qt.DisplayRole:
@@ -79,41 +662,46 @@ class BaseRadioModel(QAbstractTableModel):
 
 class ArtistTableModel(BaseRadioModel):
     '''Data model to represent artists on the radio.'''
+    # The server can't sort by the name shown, so artists known only by an
+    # alias (with no first or last name) come first (last when descending),
+    # in order of alias.
+    sort_fields = {'full_name': 'first_name,last_name,alias'}
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.columns = {'full_name': 'Full Name'}
 
-    def data(self, index, role):
-        if index.isValid():
-            if (role == Qt.DisplayRole) or (role == Qt.EditRole):
-                return full_name(self._data[index.row()])
-        return None
+    def value(self, entity, attr_name):
+        return full_name(entity)
 
 
 class AlbumTableModel(BaseRadioModel):
     '''Data model to represent albums on the radio.'''
-    pass
+    extra_fields = [ART_FIELD]
+    show_thumbnails = True
 
 
 class GameTableModel(BaseRadioModel):
     '''Data model to represent games on the radio.'''
-    pass
+    extra_fields = [ART_FIELD]
+    show_thumbnails = True
 
 
 class SongTableModel(BaseRadioModel):
     '''Data model to represent songs on the radio.'''
-    def data(self, index, role):
-        if index.isValid():
-            if (role == Qt.DisplayRole) or (role == Qt.EditRole):
-                attr_name = list(self.columns.keys())[index.column()]
-                row = self._data[index.row()]
-                if row[attr_name] is not None:
-                    if attr_name == 'game' or attr_name == 'album':
-                        return row[attr_name]['title']
-                    elif attr_name == 'artists':
-                        artists = ', '.join([full_name(a)
-                                             for a in row['artists']])
-                        return artists
-                    return row[attr_name]
-        return None
+    sort_fields = {'album': 'album__title', 'game': 'game__title',
+                   'artists': None}
+    # The files of songs are where their album's and game's art may be.
+    extra_fields = ['path']
+
+    def value(self, entity, attr_name):
+        if entity[attr_name] is not None:
+            if attr_name == 'game' or attr_name == 'album':
+                related = self.store.get(attr_name + 's', entity[attr_name])
+                return related['title'] if related else None
+            elif attr_name == 'artists':
+                artists = [self.store.get('artists', a)
+                           for a in entity['artists']]
+                return ', '.join([full_name(a) for a in artists if a])
+        return entity[attr_name]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+A shared, normalized store for the radio items received from the server.
+'''
+
+from collections import defaultdict
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from ..memory import deep_size, track
+
+
+# Song fields that refer to other entities, and the kind they refer to.
+RELATIONS = {'songs': {'album': 'albums', 'game': 'games',
+                       'artists': 'artists'}}
+# Of those, the ones that hold a list of ids.
+MANY_RELATIONS = {'songs': {'artists'}}
+# Fields the server sets itself, which are never sent back.
+READ_ONLY_FIELDS = {'id', 'num_played', 'last_played'}
+# Fields that aren't text, by what their values are converted with. Decimal
+# fields like a song's length are sent as text by the API.
+FIELD_TYPES = {'songs': {'num_played': int, 'loudness': float,
+                         'peak': float}}
+
+_store = None
+
+
+def entity_store():
+    '''Return the application-wide entity store, creating it if needed.'''
+    global _store
+    if _store is None:
+        _store = EntityStore()
+    return _store
+
+
+class EntityStore(QObject):
+    '''
+    Keeps one copy of every artist, album, game and song, keyed by kind (the
+    endpoint name) and id. Songs refer to their album, game and artists by id
+    instead of embedding copies of them.
+
+    Models ``hold`` the ids they display and ``release`` them when they are
+    done; an entity is dropped once nothing holds it anymore. Whenever merged
+    data changes an existing entity, ``entitiesChanged`` is emitted once per
+    kind so every model showing it can repaint. ``entitiesAdded`` and
+    ``entitiesRemoved`` report entities seen for the first time and entities
+    deleted on the server, for anything that keeps its own index of them.
+    '''
+    entitiesChanged = pyqtSignal(str, list)
+    entitiesAdded = pyqtSignal(str, list)
+    entitiesRemoved = pyqtSignal(str, list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._entities = defaultdict(dict)
+        self._holds = defaultdict(lambda: defaultdict(int))
+        track(self)
+
+    def memoryUsage(self):
+        '''Estimated bytes of the entities of each kind, and their holds.'''
+        return [('Entity store', kind,
+                 deep_size([entities, self._holds.get(kind)]))
+                for (kind, entities) in list(self._entities.items())]
+
+    def get(self, kind, id):
+        return self._entities[kind].get(id)
+
+    def count(self, kind):
+        return len(self._entities[kind])
+
+    def entities(self, kind):
+        '''Every entity of a kind currently in the store.'''
+        return list(self._entities[kind].values())
+
+    def merge(self, kind, items):
+        '''
+        Add or update entities from server data, normalizing any nested
+        relations. Returns the ids of the merged items, in order.
+        '''
+        changed = defaultdict(set)
+        added = defaultdict(set)
+        ids = [self._merge(kind, item, changed, added) for item in items]
+        for added_kind, added_ids in added.items():
+            self.entitiesAdded.emit(added_kind, sorted(added_ids))
+        for changed_kind, changed_ids in changed.items():
+            self.entitiesChanged.emit(changed_kind, sorted(changed_ids))
+        return ids
+
+    def _merge(self, kind, item, changed, added):
+        item = dict(item)
+        relations = RELATIONS.get(kind, {})
+        for attr, related in relations.items():
+            value = item.get(attr)
+            if isinstance(value, list):
+                item[attr] = [self._merge(related, v, changed, added)
+                              if isinstance(v, dict) else v for v in value]
+            elif isinstance(value, dict):
+                item[attr] = self._merge(related, value, changed, added)
+
+        entity = self._entities[kind].get(item['id'])
+        if entity is None:
+            self._entities[kind][item['id']] = item
+            self._holdRelations(kind, item)
+            added[kind].add(item['id'])
+            return item['id']
+
+        diff = {k: v for (k, v) in item.items() if entity.get(k) != v}
+        if diff:
+            # Hold the new relations before releasing the old ones, so a
+            # related entity that stays doesn't get dropped in between.
+            previous = dict(entity)
+            entity.update(diff)
+            self._holdRelations(kind, entity)
+            self._releaseRelations(kind, previous)
+            changed[kind].add(entity['id'])
+        return entity['id']
+
+    def _relatedIds(self, kind, entity):
+        for attr, related in RELATIONS.get(kind, {}).items():
+            value = entity.get(attr)
+            if isinstance(value, list):
+                yield related, value
+            elif value is not None:
+                yield related, [value]
+
+    def _holdRelations(self, kind, entity):
+        for related, ids in self._relatedIds(kind, entity):
+            self.hold(related, ids)
+
+    def _releaseRelations(self, kind, entity):
+        for related, ids in self._relatedIds(kind, entity):
+            self.release(related, ids)
+
+    def hold(self, kind, ids):
+        '''Mark entities as in use so they are kept in the store.'''
+        holds = self._holds[kind]
+        for id in ids:
+            holds[id] += 1
+
+    def release(self, kind, ids):
+        '''Give up a hold on entities, dropping any nothing else holds.'''
+        holds = self._holds[kind]
+        for id in ids:
+            holds[id] -= 1
+            if holds[id] <= 0:
+                del holds[id]
+                entity = self._entities[kind].pop(id, None)
+                if entity is not None:
+                    self._releaseRelations(kind, entity)
+
+    def remove(self, kind, ids):
+        '''Forget entities that were deleted on the server.'''
+        for id in ids:
+            entity = self._entities[kind].pop(id, None)
+            self._holds[kind].pop(id, None)
+            if entity is not None:
+                self._releaseRelations(kind, entity)
+        self.entitiesRemoved.emit(kind, list(ids))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Keeps track of what the radio station is playing.
+'''
+
+import random
+from datetime import datetime, timezone
+
+from PyQt5.QtCore import pyqtSignal, QObject, QTimer, QUrl
+from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
+
+from .scheduler import VISIBLE
+from .tasks import run_task
+from .utils import poll_server_data, server_request
+
+
+NOW_PLAYING_ENDPOINT = 'radio/status'
+
+
+def parse_timestamp(value):
+    '''Parse an ISO 8601 timestamp from the server into an aware datetime.'''
+    if not value:
+        return None
+    try:
+        stamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return stamp
+
+
+def remaining_time(song):
+    '''Seconds left in a song, if it has a start time and a length.'''
+    if not song:
+        return None
+    started = parse_timestamp(song.get('started_at'))
+    try:
+        length = float(song.get('length'))
+    except (TypeError, ValueError):
+        return None
+    if started is None:
+        return None
+    elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+    return length - elapsed
+
+
+class NowPlayingPoller(QObject):
+    '''
+    Polls the station's status (current track, queue and history) and emits
+    ``statusChanged`` whenever it changes.
+
+    Polls are conditional requests, so an unchanged status costs one small
+    ``304`` response. The interval adapts: the next poll is timed for the
+    end of the current track, and backs off while nothing changes. If the
+    status names an ``events`` endpoint, a server-sent event stream is kept
+    open and a poll happens as soon as the server announces a change, with
+    only a slow keepalive poll otherwise.
+    '''
+    statusChanged = pyqtSignal(dict)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.min_interval = 2.0
+        self.base_interval = 15.0
+        self.max_interval = 120.0
+        self.events_interval = 600.0
+
+        self.etag = None
+        self.status = {}
+        self.interval = self.base_interval
+        self.active = False
+        self.polling = False
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.poll)
+
+        self.network = QNetworkAccessManager(self)
+        self.events = None
+        self.events_endpoint = None
+        self._events_buffer = b''
+
+    def start(self):
+        '''Start polling, beginning with an immediate poll.'''
+        self.active = True
+        self.poll()
+
+    def stop(self):
+        self.active = False
+        self.timer.stop()
+        self.closeEvents()
+
+    def poll(self):
+        if self.polling:
+            return
+        self.timer.stop()
+        self.polling = True
+        run_task(poll_server_data, NOW_PLAYING_ENDPOINT, self.etag,
+                 priority=VISIBLE,
+                 finished=self.polled, failed=self.pollFailed)
+
+    def polled(self, result):
+        self.polling = False
+        status, etag, data = result
+        if status == 200 and data is not None:
+            self.etag = etag
+            self.status = data
+            self.interval = self.base_interval
+            self.statusChanged.emit(data)
+            self.updateEvents(data.get('events'))
+        elif status == 304:
+            self.interval = min(self.interval * 2, self.max_interval)
+            self.updateEvents(self.status.get('events'))
+        else:
+            self.interval = self.max_interval
+        self.schedule()
+
+    def pollFailed(self, error):
+        self.polling = False
+        self.interval = self.max_interval
+        self.schedule()
+
+    def schedule(self):
+        '''Work out when to poll next and set the timer.'''
+        if not self.active:
+            return
+        remaining = remaining_time(self.status.get('current'))
+        if self.events is not None:
+            delay = self.events_interval
+        elif remaining is not None and 0 < remaining < self.interval - 1:
+            # Check back just after the current track should have ended.
+            # Once it has overrun (the station is stalled), back off as
+            # usual instead.
+            delay = max(self.min_interval, remaining + 1)
+        else:
+            delay = self.interval
+        # Spread out clients that were started at the same time.
+        delay *= random.uniform(1.0, 1.1)
+        self.timer.start(int(delay * 1000))
+
+    def updateEvents(self, endpoint):
+        '''Open, keep or close the event stream the server advertises.'''
+        if endpoint == self.events_endpoint and self.events is not None:
+            return
+        self.closeEvents()
+        self.events_endpoint = endpoint
+        if not endpoint or not self.active:
+            return
+
+        url, headers = server_request(endpoint)
+        request = QNetworkRequest(QUrl(url))
+        # QtNetwork negotiates and decodes compression by itself.
+        headers.pop('accept-encoding', None)
+        for name, value in headers.items():
+            request.setRawHeader(name.encode('ascii'), value.encode('utf-8'))
+        request.setRawHeader(b'accept', b'text/event-stream')
+        self._events_buffer = b''
+        self.events = self.network.get(request)
+        self.events.readyRead.connect(self.readEvents)
+        self.events.finished.connect(self.eventsClosed)
+
+    def readEvents(self):
+        reply = self.sender()
+        if reply is not self.events:
+            return
+        self._events_buffer += bytes(reply.readAll())
+        # Events are separated by blank lines; any complete one means the
+        # status changed, so a single poll covers all of them.
+        if b'\n\n' in self._events_buffer:
+            self._events_buffer = self._events_buffer.rsplit(b'\n\n', 1)[1]
+            self.poll()
+
+    def eventsClosed(self):
+        '''The stream dropped; fall back to polling until it reconnects.'''
+        reply = self.sender()
+        if reply is self.events:
+            self.events = None
+            self.events_endpoint = None
+            self.schedule()
+        reply.deleteLater()
+
+    def closeEvents(self):
+        if self.events is not None:
+            events, self.events = self.events, None
+            events.abort()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Keeps the tables up to date in the background.
+'''
+
+import hashlib
+import json
+import random
+
+from PyQt5.QtCore import QObject, QSettings, QTimer
+
+from .scheduler import VISIBLE
+from .tasks import run_task
+from .utils import poll_server_data
+
+
+def probe_changes(endpoint, page, fields, ordering, etag=None):
+    '''
+    Ask whether a page of an endpoint changed since it had ``etag``,
+    downloading only the given fields of its items (those shown). Returns
+    None if it didn't (the server answered 304 Not Modified), and otherwise
+    the page's new ETag and a checksum of its items and count, for servers
+    that send no ETag.
+    '''
+    status, etag, data = poll_server_data(endpoint, etag, VISIBLE, page,
+                                          fields, ordering)
+    if status == 304:
+        return None
+    if status != 200:
+        raise IOError('Could not probe {} (status {})'.format(endpoint,
+                                                              status))
+    checksum = hashlib.sha1(json.dumps(data, sort_keys=True)
+                            .encode('utf-8')).hexdigest()
+    return etag, checksum
+
+
+class AutoRefresher(QObject):
+    '''
+    Refreshes a table's model when its data changes on the server.
+
+    Every so often a probe asks for the page the table is on (the first,
+    unless it is paginated), with only the fields the table shows, as a
+    conditional request. While nothing changes that costs one small ``304``
+    response, and the interval backs off up to ten times the
+    ``refresh/interval`` setting. When the page's ETag changed (or, from a
+    server that sends none, its items or the count), the model refreshes
+    the rows it has, applying only what changed.
+
+    Since the probe has the fields shown, an ETag worked out from the body
+    (like Django's ConditionalGetMiddleware makes) changes when one of them
+    is edited, and so does the checksum. Edits on pages other than the one
+    probed are only caught by servers whose ETags cover the whole
+    collection.
+
+    The first probe after the model was reset, by a refresh or a new page
+    or sort order, only notes what the page is like.
+    '''
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+
+        self.model = model
+        self.base_interval = QSettings().value('refresh/interval', 30.0,
+                                               type=float)
+        self.max_interval = 10 * self.base_interval
+
+        self.etag = None
+        self.checksum = None
+        self.known = False
+        self.interval = self.base_interval
+        self.active = False
+        self.probing = False
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.probe)
+
+        self.model.modelReset.connect(self.reset)
+
+    def start(self):
+        '''Start probing, after an interval: the data was just loaded.'''
+        self.active = True
+        self.schedule()
+
+    def stop(self):
+        self.active = False
+        self.timer.stop()
+
+    def reset(self):
+        self.etag = None
+        self.checksum = None
+        self.known = False
+        self.interval = self.base_interval
+
+    def probe(self):
+        if self.probing or not self.active:
+            return
+        self.probing = True
+        page = self.model.current_page if self.model.paginate else 1
+        run_task(probe_changes, self.model.name, page, self.model.fields,
+                 self.model.ordering(), self.etag, finished=self.probed,
+                 failed=self.probeFailed)
+
+    def probed(self, result):
+        self.probing = False
+        changed = False
+        if result is not None:
+            etag, checksum = result
+            if etag or self.etag:
+                changed = self.known and etag != self.etag
+            else:
+                changed = self.known and checksum != self.checksum
+            self.etag, self.checksum, self.known = etag, checksum, True
+
+        if changed:
+            self.interval = self.base_interval
+            self.model.refresh()
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.schedule()
+
+    def probeFailed(self, error):
+        self.probing = False
+        self.interval = self.max_interval
+        self.schedule()
+
+    def schedule(self):
+        if not self.active:
+            return
+        # Spread out the tables, and clients started at the same time.
+        delay = self.interval * random.uniform(1.0, 1.1)
+        self.timer.start(int(delay * 1000))
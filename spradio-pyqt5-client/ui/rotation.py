@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Builds rotations (playlists for the station's queue) by weighted random
+sampling of the song catalog.
+'''
+
+import math
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from PyQt5.QtCore import QSettings
+
+from .memory import deep_size, track
+from .scheduler import BULK
+from .stats import CatalogStatistics
+from .utils import post_server_data, stream_server_data
+
+
+QUEUE_ENDPOINT = 'radio/queue'
+
+# How likely each type of song is to be picked, relative to a normal song.
+SONG_TYPE_WEIGHTS = {'S': 1.0, 'J': 0.1}
+
+
+class RotationCatalog(CatalogStatistics):
+    '''
+    Play statistics of every song, plus what a rotation needs to pick from
+    them: each song's type and artists.
+    '''
+    FIELDS = CatalogStatistics.FIELDS + ['song_type', 'artists']
+
+    def __init__(self, capacity=1024):
+        super().__init__(capacity)
+        self.type_weight = np.ones(capacity)
+        self.artists = np.full(capacity, None, dtype=object)
+
+    def _columns(self):
+        return super()._columns() + [('type_weight', 1.0), ('artists', None)]
+
+    def update(self, songs):
+        songs = list(songs)
+        super().update(songs)
+        for song in songs:
+            row = self._rows[song['id']]
+            if 'song_type' in song:
+                self.type_weight[row] = SONG_TYPE_WEIGHTS.get(
+                    song['song_type'], 1.0)
+            if 'artists' in song:
+                self.artists[row] = tuple(
+                    a['id'] if isinstance(a, dict) else a
+                    for a in song['artists'] or [])
+
+    def row(self, id):
+        return self._rows.get(id)
+
+
+def load_rotation_catalog():
+    '''Page through every song on the server into a new RotationCatalog.'''
+    catalog = RotationCatalog()
+    page, total_pages = 1, 1
+    while page <= total_pages:
+        status, stream = stream_server_data('songs', page,
+                                            RotationCatalog.FIELDS,
+                                            priority=BULK)
+        catalog.update(stream)
+        if status != 200:
+            raise IOError('Could not load page {} of songs (status {})'
+                          .format(page, status))
+        total_pages = stream.meta.get('total_pages', 1)
+        page += 1
+    return catalog
+
+
+def queue_rotation(ids):
+    '''Add songs to the end of the station's queue.'''
+    return post_server_data(QUEUE_ENDPOINT, {'songs': list(ids)})
+
+
+class AliasTable:
+    '''
+    Walker's alias method: after O(n) setup, draws an index with probability
+    proportional to its weight in O(1), with one uniform index and one coin
+    flip.
+    '''
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        n = len(weights)
+        self.size = n
+        self.probability = np.ones(n)
+        self.alias = np.arange(n)
+        total = weights.sum()
+        if not n or total <= 0:
+            return
+
+        scaled = weights * (n / total)
+        small = np.flatnonzero(scaled < 1.0).tolist()
+        large = np.flatnonzero(scaled >= 1.0).tolist()
+        scaled = scaled.tolist()
+        probability = self.probability.tolist()
+        alias = self.alias.tolist()
+        while small and large:
+            less, more = small.pop(), large[-1]
+            probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(large.pop())
+        # Whatever is left is 1 but for rounding errors.
+        self.probability = np.array(probability)
+        self.alias = np.array(alias)
+
+    def draw(self, count, rng):
+        '''Draw ``count`` indexes at once.'''
+        if not self.size:
+            return np.array([], dtype=np.int64)
+        picked = rng.randint(0, self.size, count)
+        keep = rng.random_sample(count) < self.probability[picked]
+        return np.where(keep, picked, self.alias[picked])
+
+
+class RotationGenerator:
+    '''
+    Picks songs for a rotation at random, weighted by:
+
+    - how often they were played: ``(1 + num_played) ** play_exponent``, so
+      with the default exponent of -0.5 songs played less come up more,
+    - how recently they were played: ``1 - exp(-age / recency)``, so a song
+      that was just played is unlikely to come up again soon, and
+    - their type (``SONG_TYPE_WEIGHTS``).
+
+    Draws come from an alias table of the weights, in O(1) each. When
+    statistics change (``update()``) the table isn't rebuilt every time:
+    while a song's weight only went down (as it does when the song is
+    played), a draw of it is kept with probability new weight / table
+    weight, which samples the new weights exactly. The table is rebuilt
+    when a weight grew, songs were added or removed, too many draws would be
+    rejected, or it is over ``max_age`` seconds old.
+
+    Songs sharing an artist with one of the last ``artist_gap`` songs, or a
+    game with one of the last ``game_gap`` songs, are skipped; if no song
+    fits after ``max_tries`` draws the rules are relaxed for that slot.
+    Every draw counts, including those of songs already picked, and once
+    songs holding half the weight have been picked the rest are taken in a
+    weighted random order instead, so long rotations don't keep drawing
+    the same songs again.
+
+    Updates and generating can happen in different threads.
+    '''
+    def __init__(self, catalog=None, play_exponent=None, recency=None,
+                 max_age=3600, seed=None):
+        settings = QSettings()
+        if play_exponent is None:
+            play_exponent = settings.value('rotation/play_exponent', -0.5,
+                                           type=float)
+        if recency is None:
+            recency = settings.value('rotation/recency_days', 7.0,
+                                     type=float) * 86400
+        self.play_exponent = play_exponent
+        self.recency = max(recency, 1.0)
+        self.max_age = max_age
+        self.rng = np.random.RandomState(seed)
+        self.lock = threading.Lock()
+
+        self.catalog = catalog or RotationCatalog()
+        self.table = None
+        self.built = 0.0
+        self.stale = True
+        # Current weights, and the weights the table was built from.
+        self.weights = np.zeros(0)
+        self.table_weights = np.zeros(0)
+        track(self)
+
+    def memoryUsage(self):
+        '''Bytes of the weights and alias table; the catalog counts itself.'''
+        arrays = [self.weights, self.table_weights]
+        if self.table is not None:
+            arrays += [self.table.probability, self.table.alias]
+        return [('Statistics', 'Rotation weights', deep_size(arrays))]
+
+    def computeWeights(self, rows, now):
+        '''The weights of some rows of the catalog, as of ``now``.'''
+        catalog = self.catalog
+        plays = catalog.num_played[rows]
+        age = now - catalog.last_played[rows]
+        # Never played counts as played long ago.
+        age = np.where(np.isnan(age), np.inf, np.maximum(age, 0.0))
+        recency = -np.expm1(-age / self.recency)
+        weights = ((1.0 + plays) ** self.play_exponent * recency *
+                   catalog.type_weight[rows])
+        return np.maximum(weights, 0.0)
+
+    def rebuild(self):
+        '''Build the alias table from scratch.'''
+        self.built = time.time()
+        self.weights = self.computeWeights(slice(0, self.catalog.size),
+                                           self.built)
+        self.table_weights = self.weights.copy()
+        self.table = AliasTable(self.table_weights)
+        self.stale = False
+
+    def prepare(self):
+        '''Rebuild the table if it can't be used as it is anymore.'''
+        if (self.stale or time.time() - self.built > self.max_age or
+                self.acceptance() < 0.5):
+            self.rebuild()
+
+    def update(self, songs):
+        '''Update the statistics of some songs (e.g. after they played).'''
+        with self.lock:
+            self._update(list(songs))
+
+    def _update(self, songs):
+        size = self.catalog.size
+        self.catalog.update(songs)
+        if self.stale or self.catalog.size != size:
+            self.stale = True
+            return
+        # Weights as of when the table was built, so only the changed
+        # statistics count; songs getting older is caught up on by
+        # rebuilding once the table is max_age seconds old.
+        rows = np.array([self.catalog.row(song['id']) for song in songs],
+                        dtype=np.int64)
+        self.weights[rows] = self.computeWeights(rows, self.built)
+        if np.any(self.weights[rows] > self.table_weights[rows]):
+            self.stale = True
+
+    def remove(self, ids):
+        with self.lock:
+            self.catalog.remove(ids)
+            self.stale = True
+
+    def acceptance(self):
+        '''Share of draws from the table that are kept, on average.'''
+        total = self.table_weights.sum()
+        return self.weights.sum() / total if total else 0.0
+
+    def candidates(self, batch=1024):
+        '''Generate catalog rows drawn by weight, endlessly.'''
+        while True:
+            rows = self.table.draw(batch, self.rng)
+            keep = (self.rng.random_sample(batch) * self.table_weights[rows] <
+                    self.weights[rows])
+            yield from rows[keep].tolist()
+
+    def generate(self, count, artist_gap=10, game_gap=5, exclude=(),
+                 max_tries=200):
+        '''
+        Pick up to ``count`` different songs. Returns their ids in order.
+        Songs whose id is in ``exclude`` (e.g. already queued) aren't picked.
+        '''
+        with self.lock:
+            return self._generate(count, artist_gap, game_gap, exclude,
+                                  max_tries)
+
+    def weightedOrder(self, rows):
+        '''
+        Rows in a random order where each comes next with probability
+        proportional to its weight among those left: weighted sampling
+        without replacement, by sorting on ``log(u) / weight``.
+        '''
+        rows = np.array(sorted(rows), dtype=np.int64)
+        keys = np.log(1.0 - self.rng.random_sample(len(rows)))
+        keys /= self.weights[rows]
+        return rows[np.argsort(-keys, kind='stable')].tolist()
+
+    def _generate(self, count, artist_gap, game_gap, exclude, max_tries):
+        self.prepare()
+        catalog = self.catalog
+        excluded = {catalog.row(id) for id in exclude} - {None}
+        eligible = set(np.flatnonzero(self.weights).tolist()) - excluded
+        count = min(count, len(eligible))
+        candidates = self.candidates()
+
+        picked = []
+        used = set(excluded)
+        recent_artists = deque()
+        artist_counts = Counter()
+        recent_games = deque(maxlen=max(game_gap, 1))
+
+        def fits(row):
+            game = catalog.game[row]
+            if game_gap and game >= 0 and game in recent_games:
+                return False
+            artists = catalog.artists[row] or ()
+            return not any(artist_counts[a] for a in artists)
+
+        def draw():
+            # The first song drawn that wasn't picked yet, if none of them
+            # fits; None if they all were.
+            fallback = None
+            for tries, row in enumerate(candidates, 1):
+                if tries > max_tries:
+                    return fallback
+                if row in used:
+                    continue
+                if fits(row):
+                    return row
+                if fallback is None:
+                    fallback = row
+
+        def take():
+            nonlocal start
+            while order[start] in used:
+                start += 1
+            fallback = None
+            tries = 0
+            for position in range(start, len(order)):
+                row = order[position]
+                if row in used:
+                    continue
+                tries += 1
+                if fits(row):
+                    return row
+                if fallback is None:
+                    fallback = row
+                if tries >= max_tries:
+                    break
+            return fallback
+
+        # Once most of the weight has been picked, most draws from the table
+        # would be of songs already picked, so the songs left are put in a
+        # weighted random order instead, and taken from that.
+        total = self.weights.sum()
+        remaining = total - self.weights[sorted(excluded)].sum()
+        order, start = None, 0
+        while len(picked) < count:
+            row = None
+            if order is None and remaining > total / 2:
+                row = draw()
+            if row is None:
+                if order is None:
+                    order = self.weightedOrder(eligible - used)
+                row = take()
+            used.add(row)
+            picked.append(row)
+            remaining -= self.weights[row]
+            artists = catalog.artists[row] or ()
+            if game_gap:
+                recent_games.append(catalog.game[row])
+            if artist_gap:
+                recent_artists.append(artists)
+                artist_counts.update(artists)
+                if len(recent_artists) > artist_gap:
+                    artist_counts.subtract(recent_artists.popleft())
+        return [int(catalog.ids[row]) for row in picked]
+
+
+def generate_rotation(count, artist_gap=10, game_gap=5, exclude=(),
+                      generator=None):
+    '''
+    Load the catalog (unless given a generator that has one) and generate a
+    rotation of ``count`` songs. Returns the song ids and the generator, to
+    be used again.
+    '''
+    if generator is None:
+        generator = RotationGenerator(load_rotation_catalog())
+    ids = generator.generate(count, artist_gap, game_gap, exclude)
+    return ids, generator
+
+
+def rotation_length(catalog, ids):
+    '''Total length in seconds of the songs with the given ids.'''
+    total = 0.0
+    for id in ids:
+        row = catalog.row(id)
+        if row is not None and not math.isnan(catalog.length[row]):
+            total += catalog.length[row]
+    return total
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Schedules every request the client makes to the server.
+'''
+
+import itertools
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from PyQt5.QtCore import QSettings
+
+import requests
+
+from . import tracing
+
+
+# Priority classes, most urgent first.
+INTERACTIVE = 0  # Something the user is waiting on: a click, a save.
+VISIBLE = 1      # Refreshing data that is on screen.
+PREFETCH = 2     # Data that might be shown soon.
+BULK = 3         # Long jobs like exports, imports and statistics.
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def request_scheduler():
+    '''Return the application-wide request scheduler, creating it if needed.'''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            settings = QSettings()
+            _scheduler = RequestScheduler(
+                settings.value('network/max_connections', 6, type=int),
+                settings.value('network/max_per_host', 4, type=int),
+                settings.value('network/requests_per_second', 50.0,
+                               type=float),
+                settings.value('network/burst', 100, type=int))
+        return _scheduler
+
+
+def retry_after(response, default):
+    '''Seconds to wait before retrying, from a Retry-After header.'''
+    value = response.headers.get('retry-after')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RequestScheduler:
+    '''
+    Lets requests through in order of priority, within a global and a
+    per-host limit on concurrent requests and a token bucket rate limit.
+
+    Requests block in ``request()`` until they may start. Waiting requests
+    to a host go strictly by priority, then by arrival. Prefetch and bulk
+    requests can never take the last connections or the last quarter of the
+    bucket's tokens, so there is always room for interactive requests and
+    visible refreshes however much background work is queued.
+
+    A ``429 Too Many Requests`` response (or a ``503`` with Retry-After)
+    holds back every request to that host for as long as the server asks,
+    and the request is retried.
+    '''
+    def __init__(self, max_connections=6, max_per_host=4, rate=50.0,
+                 burst=100, max_retries=3):
+        self.max_connections = max(1, max_connections)
+        self.max_per_host = max(1, max_per_host)
+        self.rate = max(rate, 0.1)
+        self.burst = max(1, burst)
+        self.reserved_tokens = self.burst // 4
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=self.max_per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._condition = threading.Condition()
+        self._order = itertools.count()
+        self._waiting = []
+        self._in_flight = 0
+        self._host_in_flight = Counter()
+        self._blocked_until = {}
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+
+    def _limit(self, priority):
+        '''How many requests may be running when one of ``priority`` starts.'''
+        if priority >= BULK:
+            return max(1, self.max_connections - 2)
+        if priority >= PREFETCH:
+            return max(1, self.max_connections - 1)
+        return self.max_connections
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens +
+                           (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _delay(self, ticket, now):
+        '''
+        Seconds until the request may start: 0 if it may start now, or None
+        if it has to wait for another request to finish first.
+        '''
+        priority, order, host = ticket
+        if any(w < ticket for w in self._waiting if w[2] == host):
+            return None
+        blocked = self._blocked_until.get(host, 0) - now
+        if blocked > 0:
+            return blocked
+        limit = self._limit(priority)
+        if (self._in_flight >= limit or
+                self._host_in_flight[host] >= min(self.max_per_host, limit)):
+            return None
+        needed = 1 + (self.reserved_tokens if priority >= PREFETCH else 0)
+        if self._tokens < needed:
+            return (needed - self._tokens) / self.rate
+        return 0
+
+    def acquire(self, host, priority):
+        '''Wait for a turn to send a request to ``host``.'''
+        ticket = (priority, next(self._order), host)
+        with self._condition:
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(ticket, now)
+                    if delay == 0:
+                        break
+                    self._condition.wait(delay)
+            finally:
+                self._waiting.remove(ticket)
+            self._tokens -= 1
+            self._in_flight += 1
+            self._host_in_flight[host] += 1
+            # The next in line may be able to go too.
+            self._condition.notify_all()
+
+    def release(self, host):
+        with self._condition:
+            self._in_flight -= 1
+            self._host_in_flight[host] -= 1
+            self._condition.notify_all()
+
+    def backOff(self, host, seconds):
+        '''Hold back every request to ``host`` for a while.'''
+        with self._condition:
+            until = time.monotonic() + seconds
+            self._blocked_until[host] = max(until,
+                                            self._blocked_until.get(host, 0))
+            self._condition.notify_all()
+
+    def request(self, method, url, priority=INTERACTIVE, **kwargs):
+        '''
+        Send a request when its turn comes and return the response. For a
+        streamed response the request keeps its place until the response is
+        closed.
+        '''
+        host = urlsplit(url).netloc
+        for attempt in itertools.count():
+            with tracing.span('wait for connection', priority=priority):
+                self.acquire(host, priority)
+            try:
+                with tracing.span('request', method=method, url=url) as span:
+                    response = self.session.request(method, url, **kwargs)
+                    span.set(status=response.status_code)
+            except Exception:
+                self.release(host)
+                raise
+
+            throttled = (response.status_code == 429 or
+                         (response.status_code == 503 and
+                          'retry-after' in response.headers))
+            if throttled and attempt < self.max_retries:
+                self.backOff(host, retry_after(response, 2.0 ** attempt))
+                response.close()
+                self.release(host)
+                continue
+
+            if kwargs.get('stream'):
+                self._releaseOnClose(response, host)
+            else:
+                self.release(host)
+            return response
+
+    def _releaseOnClose(self, response, host):
+        close = response.close
+        released = []
+
+        def release_and_close():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self.release(host)
+
+        response.close = release_and_close
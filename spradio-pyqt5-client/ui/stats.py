@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Statistics over the song catalog, computed with NumPy.
+'''
+
+import math
+
+import numpy as np
+
+from .memory import deep_size, track
+from .nowplaying import parse_timestamp
+from .scheduler import BULK
+from .utils import stream_server_data
+
+
+# Edges of the play count distribution buckets (the last one is open).
+PLAY_COUNT_BINS = [0, 1, 2, 5, 10, 25, 50, 100, 250]
+
+
+def format_duration(seconds):
+    '''Format a number of seconds as e.g. "3 days 04:05:06".'''
+    if seconds is None or math.isnan(seconds):
+        return ''
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    clock = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+    if days:
+        return '{} day{} {}'.format(days, '' if days == 1 else 's', clock)
+    return clock
+
+
+def bin_labels(bins):
+    labels = []
+    for low, high in zip(bins, bins[1:] + [None]):
+        if high is None:
+            labels.append('{}+'.format(low))
+        elif high - low == 1:
+            labels.append(str(low))
+        else:
+            labels.append('{}-{}'.format(low, high - 1))
+    return labels
+
+
+class CatalogStatistics:
+    '''
+    Column arrays of the songs' play statistics, one row per song, with
+    summaries computed over whole columns at once.
+
+    Rows are updated in place as songs change, so keeping the statistics
+    current never needs the catalog to be loaded again.
+    '''
+    FIELDS = ['id', 'title', 'album', 'game', 'num_played', 'last_played',
+              'length']
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.num_played = np.zeros(capacity, dtype=np.int64)
+        self.last_played = np.full(capacity, np.nan)
+        self.length = np.full(capacity, np.nan)
+        self.album = np.full(capacity, -1, dtype=np.int64)
+        self.game = np.full(capacity, -1, dtype=np.int64)
+        self.titles = []
+        self.album_titles = {}
+        self.game_titles = {}
+        self._rows = {}
+        track(self)
+
+    def memoryUsage(self):
+        '''Bytes of the column arrays, titles and the row of each id.'''
+        arrays = [getattr(self, name) for (name, fill) in self._columns()]
+        return [('Statistics', type(self).__name__,
+                 deep_size([arrays, self.titles, self.album_titles,
+                            self.game_titles, self._rows]))]
+
+    def _columns(self):
+        '''Names of the column arrays, and what empty rows are filled with.'''
+        return [('ids', 0), ('num_played', 0), ('last_played', np.nan),
+                ('length', np.nan), ('album', -1), ('game', -1)]
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        for name, fill in self._columns():
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _related(self, value, titles):
+        '''Id of a related album or game, which may be nested or an id.'''
+        if isinstance(value, dict):
+            titles[value['id']] = value.get('title', '')
+            return value['id']
+        return -1 if value is None else value
+
+    def update(self, songs):
+        '''
+        Add or update rows from song data. Only the fields present in each
+        song are changed, so partial data (e.g. from the store) is fine.
+        '''
+        for song in songs:
+            row = self._rows.get(song['id'])
+            if row is None:
+                if self.size == len(self.ids):
+                    self._grow()
+                row = self.size
+                self.size += 1
+                self._rows[song['id']] = row
+                self.ids[row] = song['id']
+                self.titles.append('')
+
+            if 'title' in song:
+                self.titles[row] = song['title'] or ''
+            if 'num_played' in song:
+                self.num_played[row] = song['num_played'] or 0
+            if 'last_played' in song:
+                stamp = parse_timestamp(song['last_played'])
+                self.last_played[row] = (np.nan if stamp is None
+                                         else stamp.timestamp())
+            if 'length' in song:
+                try:
+                    self.length[row] = float(song['length'])
+                except (TypeError, ValueError):
+                    self.length[row] = np.nan
+            if 'album' in song:
+                self.album[row] = self._related(song['album'],
+                                                self.album_titles)
+            if 'game' in song:
+                self.game[row] = self._related(song['game'], self.game_titles)
+
+    def remove(self, ids):
+        '''Drop rows by moving the last row into their place.'''
+        for id in ids:
+            row = self._rows.pop(id, None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                for name, fill in self._columns():
+                    column = getattr(self, name)
+                    column[row] = column[last]
+                self.titles[row] = self.titles[last]
+                self._rows[int(self.ids[row])] = row
+            self.titles.pop()
+            self.size -= 1
+
+    def _top(self, values, count, largest=True):
+        '''Indexes of the ``count`` largest (or smallest) values, sorted.'''
+        count = min(count, len(values))
+        if not count:
+            return np.array([], dtype=np.int64)
+        keys = -values if largest else values
+        if count < len(values):
+            picked = np.argpartition(keys, count - 1)[:count]
+        else:
+            picked = np.arange(len(values))
+        return picked[np.argsort(keys[picked], kind='stable')]
+
+    def _per_group(self, groups, titles, count):
+        valid = groups >= 0
+        if not valid.any():
+            return []
+        plays = np.bincount(groups[valid],
+                            weights=self.num_played[:self.size][valid])
+        used = np.flatnonzero(plays)
+        top = used[self._top(plays[used], count)]
+        return [(titles.get(int(g), str(g)), int(plays[g])) for g in top]
+
+    def summary(self, count=10):
+        '''Compute every figure shown on the statistics tab.'''
+        n = self.size
+        num_played = self.num_played[:n]
+        length = self.length[:n]
+
+        played = np.flatnonzero(num_played > 0)
+        most = self._top(num_played, count)
+        least = played[self._top(num_played[played], count, largest=False)]
+        buckets = np.searchsorted(PLAY_COUNT_BINS, num_played, 'right') - 1
+        distribution = np.bincount(buckets, minlength=len(PLAY_COUNT_BINS))
+
+        def songs(rows):
+            return [(self.titles[r], int(num_played[r])) for r in rows]
+
+        return {'songs': n,
+                'total_length': float(np.nansum(length)) if n else 0.0,
+                'total_plays': int(num_played.sum()),
+                'average_plays': float(num_played.mean()) if n else 0.0,
+                'never_played': int(n - len(played)),
+                'most_played': songs(most),
+                'least_played': songs(least),
+                'distribution': list(zip(bin_labels(PLAY_COUNT_BINS),
+                                         distribution.tolist())),
+                'per_game': self._per_group(self.game[:n],
+                                            self.game_titles, count),
+                'per_album': self._per_group(self.album[:n],
+                                             self.album_titles, count)}
+
+
+def load_catalog_statistics():
+    '''
+    Page through every song on the server, streaming only the fields the
+    statistics need into a new CatalogStatistics.
+    '''
+    statistics = CatalogStatistics()
+    page, total_pages = 1, 1
+    while page <= total_pages:
+        status, stream = stream_server_data('songs', page,
+                                            CatalogStatistics.FIELDS,
+                                            priority=BULK)
+        statistics.update(stream)
+        if status != 200:
+            raise IOError('Could not load page {} of songs (status {})'
+                          .format(page, status))
+        total_pages = stream.meta.get('total_pages', 1)
+        page += 1
+    return statistics
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Keeps a local mirror of the radio catalog up to date, for scheduled jobs
+that need the catalog without asking the server each time.
+'''
+
+import hashlib
+import json
+import os
+
+from .export import EXPORT_ENDPOINTS, iter_pages
+
+
+def mirror_path(folder, endpoint):
+    return os.path.join(folder, endpoint + '.jsonl')
+
+
+def line_digest(line):
+    return hashlib.sha1(line.encode('utf-8')).digest()
+
+
+def item_digests(path):
+    '''Id to a digest of each item in a mirror file, if there is one.'''
+    digests = {}
+    try:
+        with open(path, encoding='utf-8') as mirror:
+            for line in mirror:
+                if line.strip():
+                    item = json.loads(line)
+                    digests[item['id']] = line_digest(line.rstrip('\n'))
+    except (OSError, ValueError, KeyError):
+        return {}
+    return digests
+
+
+def sync_endpoint(folder, endpoint, progress=None):
+    '''
+    Bring the mirror of one endpoint up to date: a JSON Lines file of every
+    item, in order of id. The new mirror is written next to the old one and
+    only replaces it once complete, so an interrupted sync leaves the last
+    complete mirror in place.
+
+    Pages that haven't changed since they were last downloaded are answered
+    from the response cache (with the ``network/disk_cache`` setting on,
+    across runs too). ``progress`` is called with ``(page, total_pages)``.
+    Returns the number of items, and how many were added, changed and
+    removed since the last sync.
+    '''
+    path = mirror_path(folder, endpoint)
+    old = item_digests(path)
+    added = changed = count = 0
+
+    temporary = path + '.tmp'
+    try:
+        with open(temporary, 'w', encoding='utf-8') as mirror:
+            for page, stream in iter_pages(endpoint):
+                for item in stream:
+                    line = json.dumps(item, ensure_ascii=False,
+                                      sort_keys=True)
+                    mirror.write(line + '\n')
+                    count += 1
+                    digest = old.pop(item['id'], None)
+                    if digest is None:
+                        added += 1
+                    elif digest != line_digest(line):
+                        changed += 1
+                if progress is not None:
+                    progress((page, stream.meta.get('total_pages', page)))
+    except BaseException:
+        os.remove(temporary)
+        raise
+    os.replace(temporary, path)
+    return count, added, changed, len(old)
+
+
+def sync_catalog(folder, endpoints=EXPORT_ENDPOINTS, progress=None):
+    '''
+    Sync the mirrors of several endpoints in ``folder``. ``progress`` is
+    called with ``(endpoint, page, total_pages)``. Returns a dict of
+    endpoint to what sync_endpoint() returned.
+    '''
+    os.makedirs(folder, exist_ok=True)
+    results = {}
+    for endpoint in endpoints:
+        def endpoint_progress(position):
+            if progress is not None:
+                progress((endpoint,) + position)
+        results[endpoint] = sync_endpoint(folder, endpoint, endpoint_progress)
+    return results
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Helpers for running blocking work (mostly server requests) off the GUI
+thread.
+'''
+
+from PyQt5.QtCore import (pyqtSignal, QCoreApplication, QObject, QRunnable,
+                          QThreadPool)
+
+from . import tracing
+
+
+# Tasks are kept referenced here until they report back, so their signals
+# aren't garbage collected while a result is still on its way.
+_running = set()
+_stopping = False
+_quit_connected = False
+
+
+class TaskSignals(QObject):
+    '''Signals used by a Task to report back to the GUI thread.'''
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    progress = pyqtSignal(object)
+
+
+class Task(QRunnable):
+    '''Runs a function on the global thread pool.'''
+    def __init__(self, func, *args, **kwargs):
+        super().__init__()
+
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self.name = getattr(func, '__name__', 'task')
+        self.handoff = tracing.handoff(self.name)
+
+    def run(self):
+        try:
+            with tracing.span(self.name, handoff=self.handoff):
+                result = self.func(*self.args, **self.kwargs)
+        except Exception as error:
+            self.emit('failed', error)
+        else:
+            self.emit('finished', result)
+
+    def emit(self, signal, value):
+        '''
+        Report back, unless the application is shutting down, when there's
+        no one to report to and the signals may already be deleted.
+        '''
+        if _stopping:
+            return
+        try:
+            getattr(self.signals, signal).emit(value)
+        except RuntimeError:
+            pass
+
+
+def stop_tasks(timeout=5000):
+    '''
+    Drop the tasks that haven't started yet and wait up to ``timeout`` ms
+    for the running ones, which no longer report back. Called when the
+    application is about to quit, so no worker outlives it.
+    '''
+    global _stopping
+    _stopping = True
+    pool = QThreadPool.globalInstance()
+    pool.clear()
+    pool.waitForDone(timeout)
+    _running.clear()
+
+
+def run_task(func, *args, finished=None, failed=None, progress=None,
+             **kwargs):
+    '''
+    Call ``func(*args, **kwargs)`` on a worker thread. ``finished`` receives
+    the return value and ``failed`` any exception raised, both on the thread
+    that called run_task(). If ``progress`` is given, ``func`` is also passed
+    a ``progress`` callable whose argument is handed to ``progress`` there.
+    '''
+    global _quit_connected
+    if not _quit_connected and QCoreApplication.instance() is not None:
+        QCoreApplication.instance().aboutToQuit.connect(stop_tasks)
+        _quit_connected = True
+
+    task = Task(func, *args, **kwargs)
+    _running.add(task)
+
+    if progress is not None:
+        task.kwargs['progress'] = lambda value: task.emit('progress', value)
+        task.signals.progress.connect(progress)
+
+    def done(*args):
+        _running.discard(task)
+
+    if finished is not None:
+        task.signals.finished.connect(finished)
+    if failed is not None:
+        task.signals.failed.connect(failed)
+    task.signals.finished.connect(done)
+    task.signals.failed.connect(done)
+    QThreadPool.globalInstance().start(task)
+    return task
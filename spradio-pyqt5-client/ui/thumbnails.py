@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Thumbnails of album and game covers, shown next to their titles.
+
+Covers come from a URL the server gives in an item's ``cover`` field, or
+else from the art embedded in the file of one of its songs (read with
+``mutagen``), if the file can be read from here. Files are read, images
+decoded and scaled on worker threads; the GUI thread only ever draws
+thumbnails that are ready, so scrolling never waits on an image.
+'''
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from urllib.parse import urljoin
+
+from PyQt5.QtCore import (pyqtSignal, QBuffer, QByteArray, QObject,
+                          QSettings, QStandardPaths, Qt, QTimer)
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+from .memory import deep_size, track
+from .models.store import entity_store
+from .scheduler import PREFETCH, request_scheduler
+from .tasks import run_task
+
+
+# The field of albums and games that may hold the URL of their cover.
+ART_FIELD = 'cover'
+# Kinds that have thumbnails, and the song field that refers to them.
+THUMBNAIL_KINDS = {'albums': 'album', 'games': 'game'}
+
+_loader = None
+
+
+def thumbnail_loader():
+    '''Return the application-wide thumbnail loader, creating it if needed.'''
+    global _loader
+    if _loader is None:
+        settings = QSettings()
+        folder = None
+        if settings.value('thumbnails/disk_cache', True, type=bool):
+            folder = os.path.join(QStandardPaths.writableLocation(
+                QStandardPaths.CacheLocation), 'thumbnails')
+        _loader = ThumbnailLoader(
+            settings.value('thumbnails/cache_size', 4, type=int) << 20,
+            folder,
+            settings.value('thumbnails/disk_cache_size', 32, type=int) << 20)
+    return _loader
+
+
+def embedded_art(path):
+    '''
+    The image data of the cover art embedded in an audio file, or None. The
+    front cover is preferred over other pictures.
+    '''
+    import mutagen
+    from mutagen.flac import Picture
+
+    audio = mutagen.File(path)
+    if audio is None:
+        return None
+    pictures = list(getattr(audio, 'pictures', None) or [])
+    tags = audio.tags
+    if tags is not None:
+        if hasattr(tags, 'getall'):
+            # ID3 (MP3): APIC frames.
+            pictures += tags.getall('APIC')
+        elif 'covr' in tags:
+            # MP4: plain image data, without a picture type.
+            return bytes(tags['covr'][0])
+        elif 'metadata_block_picture' in tags:
+            # Ogg: FLAC picture blocks, base64 encoded.
+            pictures += [Picture(base64.b64decode(value))
+                         for value in tags['metadata_block_picture']]
+    if not pictures:
+        return None
+    pictures.sort(key=lambda picture: picture.type != 3)
+    return pictures[0].data
+
+
+def download_art(url):
+    '''The image at a URL, relative to the API's if it isn't absolute.'''
+    url = urljoin(QSettings().value('server/api_base_url', type=str), url)
+    response = request_scheduler().request('GET', url, PREFETCH)
+    if response.status_code != 200:
+        return None
+    return response.content
+
+
+def scale_art(data, size):
+    '''
+    Decode image data into a QImage of at most ``size`` pixels square, or
+    None. Formats that can (like JPEG) are decoded at about the size needed
+    instead of at full size.
+    '''
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    reader = QImageReader(buffer)
+    original = reader.size()
+    if original.isValid() and original.width() > 2 * size:
+        reader.setScaledSize(original.scaled(2 * size, 2 * size,
+                                             Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return None
+    return image.scaled(size, size, Qt.KeepAspectRatio,
+                        Qt.SmoothTransformation)
+
+
+def file_source(path):
+    '''What a thumbnail from a file was made from: its path and mtime.'''
+    return '{}@{}'.format(path, int(os.stat(path).st_mtime))
+
+
+class ThumbnailDiskCache:
+    '''
+    Scaled thumbnails saved as PNG files in ``folder``, up to
+    ``max_size`` bytes, each with the source it was made from. Used from
+    worker threads.
+    '''
+    def __init__(self, folder, max_size=32 << 20):
+        self.folder = folder
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, kind, id, size):
+        name = '{}/{}/{}'.format(kind, id, size)
+        return os.path.join(self.folder, hashlib.sha1(
+            name.encode('utf-8')).hexdigest() + '.png')
+
+    def load(self, kind, id, size):
+        '''A saved thumbnail and its source, or (None, None).'''
+        path = self._path(kind, id, size)
+        image = QImage(path)
+        if image.isNull():
+            return None, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image, image.text('Source')
+
+    def save(self, kind, id, size, image, source):
+        path = self._path(kind, id, size)
+        temporary = path + '.tmp'
+        image = QImage(image)
+        image.setText('Source', source)
+        if not image.save(temporary, 'PNG'):
+            return
+        try:
+            os.replace(temporary, path)
+            added = os.path.getsize(path)
+        except OSError:
+            return
+        self._trim(added)
+
+    def _trim(self, added):
+        '''Delete the least recently used files over ``max_size``.'''
+        with self._lock:
+            if self._size is None:
+                self._size = sum(e.stat().st_size
+                                 for e in os.scandir(self.folder))
+            else:
+                self._size += added
+            if self._size <= self.max_size:
+                return
+            files = sorted(os.scandir(self.folder),
+                           key=lambda e: e.stat().st_mtime)
+            for entry in files:
+                if self._size <= self.max_size * 3 // 4:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+                self._size -= size
+
+
+def load_thumbnail(disk, kind, id, size, url, paths):
+    '''
+    Make the thumbnail of an item, on a worker thread: from its cover URL
+    if it has one, or else from the first of its songs' files that has art.
+    A thumbnail saved on disk is used while what it was made from hasn't
+    changed, and also when there is nothing to make a new one from yet.
+    Returns a QImage, or None if there is no art.
+    '''
+    image, saved = (None, None)
+    if disk is not None:
+        image, saved = disk.load(kind, id, size)
+
+    sources = []
+    if url:
+        sources.append((url, download_art, url))
+    for path in paths:
+        try:
+            sources.append((file_source(path), embedded_art, path))
+        except OSError:
+            continue
+    if not sources or saved in [source for (source, _, _) in sources]:
+        return image
+
+    for source, read, location in sources:
+        try:
+            data = read(location)
+        except Exception:
+            continue
+        art = scale_art(data, size) if data else None
+        if art is not None:
+            if disk is not None:
+                disk.save(kind, id, size, art, source)
+            return art
+    return None
+
+
+class PixmapCache:
+    '''
+    Least recently used cache of QPixmaps, limited to ``max_size`` bytes of
+    pixel data, like QPixmapCache but with its own limit and size. Only used
+    from the GUI thread.
+    '''
+    def __init__(self, max_size=4 << 20):
+        self.max_size = max_size
+        self.size = 0
+        self._pixmaps = OrderedDict()
+
+    @staticmethod
+    def cost(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def get(self, key):
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        self.remove(key)
+        self._pixmaps[key] = pixmap
+        self.size += self.cost(pixmap)
+        while self.size > self.max_size and len(self._pixmaps) > 1:
+            key, pixmap = self._pixmaps.popitem(last=False)
+            self.size -= self.cost(pixmap)
+
+    def remove(self, key):
+        pixmap = self._pixmaps.pop(key, None)
+        if pixmap is not None:
+            self.size -= self.cost(pixmap)
+
+    def clear(self):
+        self._pixmaps.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._pixmaps)
+
+
+class ThumbnailLoader(QObject):
+    '''
+    Hands out thumbnails of albums and games to models, ``size`` pixels
+    square, loading the ones that aren't in memory in the background.
+
+    Models only ask for the thumbnails of rows that are being painted, so
+    only those are loaded. The most recently asked for are loaded first, a
+    few at a time, and requests for rows scrolled past long ago are dropped
+    once there are over ``max_pending``. ``thumbnailsReady`` is emitted
+    with the kind and ids of thumbnails that became available (or turned
+    out to have no art), a batch at a time.
+
+    Songs seen anywhere in the client tell which files may have the art of
+    their album and game.
+    '''
+    thumbnailsReady = pyqtSignal(str, list)
+
+    def __init__(self, max_size=4 << 20, folder=None,
+                 max_disk_size=32 << 20, max_jobs=2, max_pending=64,
+                 paths_per_item=3, parent=None):
+        super().__init__(parent)
+
+        self.size = 0
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self.paths_per_item = paths_per_item
+        self.disk = ThumbnailDiskCache(folder, max_disk_size) \
+            if folder else None
+
+        self._pixmaps = PixmapCache(max_size)
+        # Items known to have no art, as far as their sources go so far.
+        self._missing = set()
+        self._pending = OrderedDict()
+        self._running = set()
+        self._generation = 0
+        # Song files that may have the art of an item, by (kind, id).
+        self._paths = defaultdict(list)
+
+        self._ready = defaultdict(set)
+        self.timerReady = QTimer(self)
+        self.timerReady.setSingleShot(True)
+        self.timerReady.setInterval(50)
+        self.timerReady.timeout.connect(self.emitReady)
+
+        self.store = entity_store()
+        self.store.entitiesAdded.connect(self.entitiesChanged)
+        self.store.entitiesChanged.connect(self.entitiesChanged)
+        track(self)
+
+    def memoryUsage(self):
+        '''Bytes of the thumbnails in memory, and of the song file index.'''
+        return [('Caches', 'Thumbnail cache',
+                 self._pixmaps.size + 200 * len(self._pixmaps)),
+                ('Indexes', 'Cover art files', deep_size(self._paths))]
+
+    def setSize(self, size):
+        '''Make thumbnails of ``size`` pixels from now on.'''
+        if size != self.size:
+            self.size = size
+            self._generation += 1
+            self._pixmaps.clear()
+            self._missing.clear()
+            self._pending.clear()
+
+    def thumbnail(self, kind, id):
+        '''
+        The thumbnail of an item as a QPixmap, or None if it has no art or
+        isn't loaded yet, in which case it will be.
+        '''
+        key = (kind, id)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None or key in self._missing or not self.size:
+            return pixmap
+        if key not in self._running:
+            self._pending[key] = True
+            self._pending.move_to_end(key)
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+            self.startJobs()
+        return None
+
+    def startJobs(self):
+        '''Start loading the most recently asked for thumbnails.'''
+        while self._pending and len(self._running) < self.max_jobs:
+            key, _ = self._pending.popitem()
+            kind, id = key
+            entity = self.store.get(kind, id)
+            url = entity.get(ART_FIELD) if entity else None
+            self._running.add(key)
+            generation = self._generation
+            run_task(load_thumbnail, self.disk, kind, id, self.size, url,
+                     list(self._paths.get(key, [])),
+                     finished=lambda image, key=key: self.loaded(
+                         generation, key, image),
+                     failed=lambda error, key=key: self.loaded(
+                         generation, key, None))
+
+    def loaded(self, generation, key, image):
+        self._running.discard(key)
+        if generation == self._generation:
+            if image is None:
+                self._missing.add(key)
+            else:
+                self._pixmaps.put(key, QPixmap.fromImage(image))
+            self._ready[key[0]].add(key[1])
+            self.timerReady.start()
+        self.startJobs()
+
+    def emitReady(self):
+        ready, self._ready = self._ready, defaultdict(set)
+        for kind, ids in ready.items():
+            self.thumbnailsReady.emit(kind, sorted(ids))
+
+    def entitiesChanged(self, kind, ids):
+        '''
+        Note the files of songs that were seen, and look for art again for
+        items that had none, or whose cover may have changed.
+        '''
+        retry = set()
+        if kind == 'songs':
+            for id in ids:
+                song = self.store.get(kind, id)
+                path = song.get('path') if song else None
+                if not path:
+                    continue
+                for related, field in THUMBNAIL_KINDS.items():
+                    key = (related, song.get(field))
+                    if key[1] is None:
+                        continue
+                    paths = self._paths[key]
+                    if path not in paths and \
+                            len(paths) < self.paths_per_item:
+                        paths.append(path)
+                        if key in self._missing:
+                            retry.add(key)
+        elif kind in THUMBNAIL_KINDS:
+            # The cover URL may be what changed. The thumbnail on disk tells
+            # whether it has to be made again.
+            retry = {(kind, id) for id in ids
+                     if (kind, id) in self._missing or
+                     self._pixmaps.get((kind, id)) is not None}
+        for key in retry:
+            self._missing.discard(key)
+            self._pixmaps.remove(key)
+            self._ready[key[0]].add(key[1])
+        if retry:
+            self.timerReady.start()
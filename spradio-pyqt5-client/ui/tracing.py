@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Traces what the client does in response to the user, for finding out why a
+particular click was slow.
+
+Tracing is off unless started with ``--trace`` or the ``diagnostics/trace``
+setting. Spans are then written to a JSON file in the Chrome trace event
+format, which can be opened in Perfetto (https://ui.perfetto.dev) or
+chrome://tracing.
+'''
+
+import atexit
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+from PyQt5.QtCore import QDateTime, QStandardPaths
+
+
+_tracer = None
+
+
+def trace_path():
+    '''Where a trace goes when no file was given.'''
+    folder = os.path.join(QStandardPaths.writableLocation(
+        QStandardPaths.AppDataLocation), 'traces')
+    name = QDateTime.currentDateTime().toString('yyyyMMdd-HHmmss')
+    return os.path.join(folder, 'trace-{}.json'.format(name))
+
+
+def start_tracing(path=None):
+    '''Start writing spans to ``path`` (or a new file from trace_path()).'''
+    global _tracer
+    stop_tracing()
+    path = path or trace_path()
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def stop_tracing():
+    '''Finish the trace file, if tracing.'''
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def tracing():
+    '''Whether spans are being recorded.'''
+    return _tracer is not None
+
+
+atexit.register(stop_tracing)
+
+
+class _NoSpan:
+    '''Stands in for every span while tracing is off.'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, handoff=None, **args):
+    '''
+    Context manager timing a step as a span called ``name``, with ``args``
+    shown alongside it. Further arguments can be added with ``set()`` on the
+    object it returns. ``handoff`` continues work started with handoff() on
+    another thread.
+    '''
+    if _tracer is None:
+        return _NO_SPAN
+    return Span(_tracer, name, args, handoff=handoff)
+
+
+def action(name, label=None, **args):
+    '''
+    Like span(), for a slot the user can trigger. The outermost action on
+    the GUI thread starts an interaction, called ``label`` (or ``name``),
+    which lasts until the next frame is painted, so the whole time from a
+    click to its result showing up is one entry in the trace.
+    '''
+    if _tracer is None:
+        return _NO_SPAN
+    return Span(_tracer, name, args, label=label or name)
+
+
+def painting(name, **args):
+    '''
+    Like span(), for painting a widget. Ends every interaction waiting for
+    its result to be painted.
+    '''
+    if _tracer is None:
+        return _NO_SPAN
+    return Span(_tracer, name, args, paints=True)
+
+
+def traced(name=None):
+    '''
+    Decorator timing every call of a function as a span, called ``name`` or
+    after the function. Not for slots: the wrapper hides the function's
+    arguments from PyQt.
+    '''
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with Span(_tracer, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def handoff(name):
+    '''
+    Mark work being handed to another thread (e.g. a task), to be passed to
+    span() there. The trace links the two with an arrow, and the work counts
+    towards the interaction it was started in.
+    '''
+    if _tracer is None:
+        return None
+    return _tracer.handoff(name)
+
+
+class Span:
+    '''A span being timed; see span().'''
+    __slots__ = ('tracer', 'name', 'args', 'label', 'paints', 'handoff',
+                 'start', 'interaction', 'previous')
+
+    def __init__(self, tracer, name, args, label=None, paints=False,
+                 handoff=None):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.label = label
+        self.paints = paints
+        self.handoff = handoff
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        tracer = self.tracer
+        local = tracer.local()
+        self.previous = local.interaction
+        self.start = tracer.now()
+        if self.handoff is not None:
+            flow, local.interaction = self.handoff
+            tracer.endFlow(self.name, flow, self.start)
+        elif self.label is not None and local.depth == 0 and local.main:
+            local.interaction = tracer.beginInteraction(self.label,
+                                                        self.start)
+        self.interaction = local.interaction
+        local.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        tracer = self.tracer
+        end = tracer.now()
+        local = tracer.local()
+        local.depth -= 1
+        if self.interaction is not None:
+            self.args['interaction'] = self.interaction
+        if exc_info[0] is not None:
+            self.args['error'] = exc_info[0].__name__
+        last = local.depth == 0 and local.main
+        if last and self.paints and tracer.waiting():
+            self.args['interactions'] = tracer.waiting()
+        tracer.write({'name': self.name, 'ph': 'X', 'ts': self.start,
+                      'dur': end - self.start, 'args': self.args})
+        if last:
+            if self.label is not None and self.interaction is not None:
+                tracer.waitForPaint(self.interaction)
+            if self.paints:
+                tracer.painted(end)
+        if self.handoff is not None or local.depth == 0:
+            local.interaction = self.previous
+        return False
+
+
+class Tracer:
+    '''
+    Writes spans to a Chrome trace JSON file as they end. Spans can be
+    timed on any thread.
+
+    The file is a JSON array that is only closed by close(), which the
+    trace viewers don't need, so a trace cut short by a crash still loads.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = time.perf_counter()
+        self._ids = itertools.count(1)
+        self._threads = set()
+        # Interactions whose actions have run, waiting for the next paint.
+        self._waiting = []
+        self._labels = {}
+
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write('[')
+        self._file.write(json.dumps({
+            'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+            'args': {'name': 'Innkeeper'}}))
+
+    def now(self):
+        '''Microseconds since tracing started.'''
+        return (time.perf_counter() - self._start) * 1e6
+
+    def local(self):
+        '''State of the spans open on the current thread.'''
+        local = self._local
+        if not hasattr(local, 'depth'):
+            local.depth = 0
+            local.interaction = None
+            local.main = threading.current_thread() is threading.main_thread()
+        return local
+
+    def write(self, event):
+        thread = threading.current_thread()
+        event['pid'] = self.pid
+        event['tid'] = thread.native_id
+        line = json.dumps(event, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            if thread.native_id not in self._threads:
+                self._threads.add(thread.native_id)
+                self._file.write(',\n' + json.dumps({
+                    'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                    'tid': thread.native_id,
+                    'args': {'name': self.threadName(thread)}}))
+            self._file.write(',\n' + line)
+
+    @staticmethod
+    def threadName(thread):
+        if thread is threading.main_thread():
+            return 'GUI'
+        if thread.name.startswith('Dummy'):
+            # Started by Qt, i.e. one of the thread pool's.
+            return 'Worker {}'.format(thread.native_id)
+        return thread.name
+
+    def beginInteraction(self, label, ts):
+        # Anything still waiting wasn't painted before the next action.
+        self.painted(ts, painted=False)
+        interaction = next(self._ids)
+        self._labels[interaction] = label
+        self.write({'name': label, 'cat': 'interaction', 'ph': 'b',
+                    'id': interaction, 'ts': ts})
+        return interaction
+
+    def waiting(self):
+        '''Interactions waiting for a paint.'''
+        return list(self._waiting)
+
+    def waitForPaint(self, interaction):
+        if interaction not in self._waiting:
+            self._waiting.append(interaction)
+
+    def painted(self, ts, painted=True):
+        '''End the interactions waiting for a paint.'''
+        if not self._waiting:
+            return
+        for interaction in self._waiting:
+            self.write({'name': self._labels.pop(interaction, ''),
+                        'cat': 'interaction', 'ph': 'e', 'id': interaction,
+                        'ts': ts, 'args': {'painted': painted}})
+        self._waiting = []
+        self.flush()
+
+    def handoff(self, name):
+        flow = next(self._ids)
+        self.write({'name': name, 'cat': 'handoff', 'ph': 's', 'id': flow,
+                    'ts': self.now()})
+        return flow, self.local().interaction
+
+    def endFlow(self, name, flow, ts):
+        self.write({'name': name, 'cat': 'handoff', 'ph': 'f', 'bp': 'e',
+                    'id': flow, 'ts': ts})
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
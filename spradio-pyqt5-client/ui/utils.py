@@ -3,16 +3,31 @@
 
 '''
 Various helpful functions for use in displaying the UI.
+
+Every request to the server goes through the request scheduler; functions
+that send one take the ``priority`` class to send it with. Pages and items
+that are fetched again are revalidated against the response cache, and
+writing to an endpoint drops what is cached for it.
 '''
 
+import codecs
 import json
+import sys
+from urllib.parse import urlencode
 
 import keyring
 
-from PyQt5.QtCore import QSettings
-from PyQt5.QtWidgets import qApp
+from PyQt5.QtCore import QCoreApplication, QSettings
+
+import urllib3
+
+from . import tracing
+from .cache import response_cache
+from .scheduler import INTERACTIVE, request_scheduler
 
-import requests
+# Ask for gzip/deflate, plus brotli when a brotli module is installed for
+# urllib3 to decode it with.
+ACCEPT_ENCODING = urllib3.util.make_headers(accept_encoding=True)
 
 
 def full_name(artist):
@@ -29,53 +44,280 @@ def full_name(artist):
     return '{} {}'.format(artist['first_name'], artist['last_name'])
 
 
-def _prepare_server_request(endpoint, page=0):
+def song_description(song):
+    '''
+    String describing a song as sent by the server, with its artists and the
+    game it is from.
+    '''
+    description = song.get('title') or ''
+    artists = ', '.join([full_name(a) for a in song.get('artists') or []])
+    if artists:
+        description += ' - ' + artists
+    if song.get('game'):
+        description += ' (' + song['game']['title'] + ')'
+    return description
+
+
+class JsonResultsStream:
+    '''
+    Incrementally decodes a paginated API response as it is downloaded.
+
+    Iterating over the stream yields each item of the ``results`` array as
+    soon as it has been received and parsed, so rows can be handed to a
+    model before the whole body has arrived. Every other top-level key
+    (``total_pages``, ``detail``, ...) is collected into ``meta``, which is
+    complete once iteration has finished.
+    '''
+    def __init__(self, response, key='results', chunk_size=65536):
+        self.response = response
+        self.key = key
+        self.meta = {}
+
+        self._chunks = response.iter_content(chunk_size)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        # Items are decoded one at a time, so the decoder can't share key
+        # strings between them the way a single json.loads() call does.
+        # Interning them keeps every row from carrying its own copies.
+        self._json = json.JSONDecoder(object_pairs_hook=self._shared_keys)
+        self._buffer = ''
+        self._pos = 0
+
+    @staticmethod
+    def _shared_keys(pairs):
+        return {sys.intern(key): value for (key, value) in pairs}
+
+    def _fill(self):
+        '''Append the next chunk to the buffer. Returns False at the end.'''
+        if self._pos > len(self._buffer) // 2:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        return False
+
+    def _peek(self):
+        '''Skip whitespace and return the next character, or '' at the end.'''
+        while True:
+            while (self._pos < len(self._buffer) and
+                   self._buffer[self._pos] in ' \t\n\r'):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _take(self, expected):
+        char = self._peek()
+        if not char or char not in expected:
+            raise ValueError('Unexpected {!r} in server response.'
+                             .format(char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        '''Decode the next complete JSON value, reading more as needed.'''
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the very end of the buffer may be cut short.
+            if end < len(self._buffer) or not self._fill():
+                self._pos = end
+                return value
+
+    def _finish(self):
+        '''
+        Read whatever follows the end of the object, so the connection can
+        be reused (and a recorded body is known to be complete).
+        '''
+        for chunk in self._chunks:
+            pass
+
+    def __iter__(self):
+        with tracing.span('JSON decode') as span:
+            count = 0
+            for item in self._items():
+                count += 1
+                yield item
+            span.set(items=count)
+
+    def _items(self):
+        try:
+            self._take('{')
+            if self._peek() == '}':
+                self._finish()
+                return
+            while True:
+                key = self._value()
+                self._take(':')
+                if key == self.key and self._peek() == '[':
+                    self._take('[')
+                    if self._peek() == ']':
+                        self._take(']')
+                    else:
+                        while True:
+                            yield self._value()
+                            if self._take(',]') == ']':
+                                break
+                else:
+                    self.meta[key] = self._value()
+                if self._take(',}') == '}':
+                    self._finish()
+                    return
+        finally:
+            self.response.close()
+
+
+def describe_error(status, data):
+    '''A short reason for a rejected save, from the server's response.'''
+    if isinstance(data, dict):
+        messages = []
+        for field, errors in data.items():
+            if isinstance(errors, list):
+                errors = ' '.join([str(e) for e in errors])
+            messages.append('{}: {}'.format(field, errors))
+        if messages:
+            return '\n'.join(messages)
+    return 'Server responded with status {}'.format(status)
+
+
+def _prepare_server_request(endpoint, page=0, fields=None, ordering=None):
     '''
     Return a tuple of information to setup a RESTful request to the server.
     '''
     settings = QSettings()
     base_url = settings.value('server/api_base_url', type=str)
     url = base_url + endpoint + '/'
+    query = {}
     if page > 0:
-        url = url + '?page=' + str(page)
-    password = 'Token ' + keyring.get_password(qApp.applicationName(),
-                                               'Token')
+        query['page'] = page
+    if fields:
+        query['fields'] = ','.join(fields)
+    if ordering:
+        query['ordering'] = ordering
+    if query:
+        url = url + '?' + urlencode(query, safe=',')
+    password = 'Token ' + keyring.get_password(
+        QCoreApplication.applicationName(), 'Token')
     headers = {'content-type': 'application/json', 'authorization': password}
+    headers.update(ACCEPT_ENCODING)
     return url, headers
 
 
-def delete_server_data(endpoint):
+def delete_server_data(endpoint, priority=INTERACTIVE):
     '''
     Given the name of the endpoint, delete an item on the server.
     '''
     url, headers = _prepare_server_request(endpoint)
-    req = requests.delete(url, headers=headers)
+    req = request_scheduler().request('DELETE', url, priority,
+                                      headers=headers)
+    response_cache().invalidate(url)
     return req.status_code, ''
 
 
-def get_server_data(endpoint, page):
+def get_server_data(endpoint, page, fields=None, ordering=None,
+                    priority=INTERACTIVE):
     '''
     Given the name of the endpoint, and an optional page number, retrieve the
-    data from the server RESTful API and return as a dict.
+    data from the server RESTful API and return as a dict. If given a list of
+    fields, only those are requested from the server, and ordering (a field
+    name, prefixed by '-' for descending) sorts the results on the server.
     '''
-    url, headers = _prepare_server_request(endpoint, page)
-    req = requests.get(url, headers=headers)
-    return req.status_code, req.json()
+    with tracing.span('get_server_data', endpoint=endpoint, page=page):
+        url, headers = _prepare_server_request(endpoint, page, fields,
+                                               ordering)
+        req = response_cache().fetch(request_scheduler(), url, priority,
+                                     headers)
+        with tracing.span('JSON decode'):
+            return req.status_code, req.json()
+
+
+def stream_server_data(endpoint, page, fields=None, ordering=None,
+                       priority=INTERACTIVE):
+    '''
+    Like get_server_data, but return a JsonResultsStream that decodes the
+    page's results while they are still being downloaded.
+    '''
+    with tracing.span('stream_server_data', endpoint=endpoint, page=page):
+        url, headers = _prepare_server_request(endpoint, page, fields,
+                                               ordering)
+        req = response_cache().fetch(request_scheduler(), url, priority,
+                                     headers, stream=True)
+    return req.status_code, JsonResultsStream(req)
+
+
+def poll_server_data(endpoint, etag=None, priority=INTERACTIVE, page=0,
+                     fields=None, ordering=None):
+    '''
+    Given the name of the endpoint and the ETag of the last response, retrieve
+    the data only if it has changed. Returns the status, the new ETag and the
+    data as a dict, or None when the server answered 304 Not Modified. A page
+    of a list can be polled, for only some fields, like in get_server_data.
+    '''
+    url, headers = _prepare_server_request(endpoint, page, fields, ordering)
+    if etag:
+        headers['if-none-match'] = etag
+    req = request_scheduler().request('GET', url, priority, headers=headers)
+    if req.status_code == 304:
+        return req.status_code, etag, None
+    return req.status_code, req.headers.get('etag'), req.json()
+
+
+def server_request(endpoint):
+    '''
+    Return the URL and headers for a request to the given endpoint, for
+    callers that talk to the server without ``requests`` (e.g. QtNetwork).
+    '''
+    return _prepare_server_request(endpoint)
 
 
-def post_server_data(endpoint, data):
+def post_server_data(endpoint, data, priority=INTERACTIVE):
     '''
     Given the name of the endpoint, create a new item on the server.
     '''
     url, headers = _prepare_server_request(endpoint)
-    req = requests.post(url, headers=headers, data=json.dumps(data))
+    req = request_scheduler().request('POST', url, priority,
+                                      headers=headers,
+                                      data=json.dumps(data))
+    response_cache().invalidate(url)
     return req.status_code, req.json()
 
 
-def put_server_data(endpoint, data):
+def put_server_data(endpoint, data, priority=INTERACTIVE):
     '''
     Given the name of the endpoint, update an existing item on the server.
     '''
     url, headers = _prepare_server_request(endpoint)
-    req = requests.put(url, headers=headers, data=json.dumps(data))
+    req = request_scheduler().request('PUT', url, priority,
+                                      headers=headers,
+                                      data=json.dumps(data))
+    response_cache().invalidate(url)
     return req.status_code, req.json()
+
+
+def patch_server_data(endpoint, data, etag=None, priority=INTERACTIVE):
+    '''
+    Given the name of the endpoint, update only the given fields of an
+    existing item on the server. If given the ETag the item had when it was
+    loaded, the server refuses the update (with 412 Precondition Failed) if
+    the item has changed since. Returns the status, the item's new ETag and
+    the response data.
+    '''
+    url, headers = _prepare_server_request(endpoint)
+    if etag:
+        headers['if-match'] = etag
+    req = request_scheduler().request('PATCH', url, priority,
+                                      headers=headers,
+                                      data=json.dumps(data))
+    response_cache().invalidate(url)
+    try:
+        return req.status_code, req.headers.get('etag'), req.json()
+    except ValueError:
+        return req.status_code, req.headers.get('etag'), req.text
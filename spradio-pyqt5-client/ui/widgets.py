@@ -5,17 +5,36 @@
 Custom widgets for Innkeeper's main window.
 '''
 
-from PyQt5.QtCore import pyqtSlot, QCoreApplication, QItemSelection, QSize, Qt
-from PyQt5.QtGui import QIcon, QPixmap
-from PyQt5.QtWidgets import (QAbstractItemView, QAbstractSpinBox, QGroupBox,
-                             QHBoxLayout, QHeaderView, QLabel, QMessageBox,
-                             QPushButton, QSizePolicy, QSpacerItem, QSpinBox,
-                             QSplitter, QTableView, QVBoxLayout, QWidget)
-
+import os
+
+from PyQt5.QtCore import (pyqtSlot, QCoreApplication, QItemSelection,
+                          QSettings, QSize, QStandardPaths, Qt, QTimer)
+from PyQt5.QtGui import QFont, QIcon, QPixmap
+from PyQt5.QtWidgets import (QAbstractItemView, QAbstractSpinBox, QCheckBox,
+                             QFormLayout, QGridLayout, QGroupBox, QHBoxLayout,
+                             QHeaderView, QLabel, QLineEdit, QListWidget,
+                             QMessageBox, QPushButton, QSizePolicy,
+                             QSpacerItem, QSpinBox, QSplitter, QTableView,
+                             QTableWidget, QTableWidgetItem, QVBoxLayout,
+                             QWidget)
+
+from . import tracing
+from .delegates import CachedTextDelegate
 from .dialogs.radio import BaseItemDialog
+from .dialogs.rotation import RotationDialog
+from .locate import find_item, find_title
+from .models.history import history_entry, PlayHistoryModel
+from .models.index import entity_index
 from .models.radio import (AlbumTableModel, ArtistTableModel, GameTableModel,
                            SongTableModel)
-from .utils import delete_server_data
+from .models.store import entity_store
+from .nowplaying import NowPlayingPoller
+from .refresh import AutoRefresher
+from .scheduler import VISIBLE
+from .stats import format_duration, load_catalog_statistics
+from .tasks import run_task
+from .utils import (delete_server_data, describe_error, full_name,
+                    get_server_data, poll_server_data, song_description)
 
 
 class DeselectableTableView(QTableView):
@@ -29,12 +48,21 @@ class DeselectableTableView(QTableView):
         self.clearSelection()
         QTableView.mousePressEvent(self, event)
 
+    def updateGeometries(self):
+        with tracing.span('updateGeometries', view=self.objectName()):
+            QTableView.updateGeometries(self)
+
+    def paintEvent(self, event):
+        with tracing.painting('paint', view=self.objectName()):
+            QTableView.paintEvent(self, event)
+
 
 class BaseItemGroupBox(QGroupBox):
     '''A GroupBox for administrating an item.'''
     def __init__(self,
                  parent=None,
                  paginate=False,
+                 windowed=False,
                  name='',
                  plural='',
                  hstretch=0,
@@ -42,12 +70,22 @@ class BaseItemGroupBox(QGroupBox):
         super().__init__(parent)
 
         self.paginate = paginate
+        self.windowed = windowed
 
         self.name = name
         self.plural = plural
         self.columns = {}
 
         self.current_selection = None
+        self.refresher = None
+
+        # Column widths worked out from sampled rows, and the ones the user
+        # set by hand (loaded from settings on first use), by column name.
+        self.column_widths = {}
+        self.user_column_widths = None
+        self.column_sample_size = 50
+        self.column_max_width = 300
+        self._sizing_columns = False
 
         self.setObjectName('groupBox' + self.plural.capitalize())
 
@@ -67,6 +105,21 @@ class BaseItemGroupBox(QGroupBox):
         self.tableView.setObjectName('tableView' + self.plural.capitalize())
         self.tableView.setSelectionMode(QAbstractItemView.SingleSelection)
         self.tableView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        header = self.tableView.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setStretchLastSection(True)
+        header.sectionResized.connect(self.saveColumnWidth)
+        header.setSectionsClickable(True)
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(-1, Qt.AscendingOrder)
+        header.sortIndicatorChanged.connect(self.sortTable)
+        # Cells are drawn from cached text, in rows of a single fixed height.
+        self.delegate = CachedTextDelegate(self.tableView)
+        self.tableView.setItemDelegate(self.delegate)
+        rows = self.tableView.verticalHeader()
+        rows.setSectionResizeMode(QHeaderView.Fixed)
+        rows.setDefaultSectionSize(
+            self.delegate.rowHeight(self.tableView.fontMetrics()))
         self.verticalLayout.addWidget(self.tableView)
 
         self.horizontalLayout = QHBoxLayout()
@@ -80,10 +133,16 @@ class BaseItemGroupBox(QGroupBox):
         icon.addPixmap(QPixmap(':/icons/refresh.svg'), QIcon.Normal, QIcon.On)
         self.buttonRefresh.setIcon(icon)
         self.buttonRefresh.setFlat(True)
+        self.checkBoxAutoRefresh = QCheckBox(self)
+        self.checkBoxAutoRefresh.setObjectName('checkBoxAutoRefresh' +
+                                               self.plural.capitalize())
+        self.checkBoxAutoRefresh.setChecked(QSettings().value(
+            'refresh/' + self.plural, False, type=bool))
         spacerLeft = QSpacerItem(40, 20,
                                  QSizePolicy.Expanding, QSizePolicy.Minimum)
 
         self.horizontalLayout.addWidget(self.buttonRefresh)
+        self.horizontalLayout.addWidget(self.checkBoxAutoRefresh)
         self.horizontalLayout.addItem(spacerLeft)
 
         if self.paginate:
@@ -123,6 +182,7 @@ class BaseItemGroupBox(QGroupBox):
         self.verticalLayout.addLayout(self.horizontalLayout)
 
         self.buttonRefresh.clicked.connect(self.updateTable)
+        self.checkBoxAutoRefresh.toggled.connect(self.setAutoRefresh)
         self.buttonAdd.clicked.connect(self.showDialog)
         self.buttonEdit.clicked.connect(self.showDialog)
         self.buttonDelete.clicked.connect(self.deleteItem)
@@ -183,6 +243,11 @@ class BaseItemGroupBox(QGroupBox):
                        QIcon.On)
         self.buttonLastPage.setIcon(icon)
         self.buttonLastPage.setFlat(True)
+        self.lineEditGoTo = QLineEdit(self)
+        self.lineEditGoTo.setObjectName('lineEditGoTo' +
+                                        self.plural.capitalize())
+        self.lineEditGoTo.setMaximumSize(QSize(160, 16777215))
+        self.lineEditGoTo.setClearButtonEnabled(True)
         spacerRight = QSpacerItem(40, 20,
                                   QSizePolicy.Expanding, QSizePolicy.Minimum)
 
@@ -192,6 +257,7 @@ class BaseItemGroupBox(QGroupBox):
         self.horizontalLayout.addWidget(self.labelTotalPages)
         self.horizontalLayout.addWidget(self.buttonNextPage)
         self.horizontalLayout.addWidget(self.buttonLastPage)
+        self.horizontalLayout.addWidget(self.lineEditGoTo)
         self.horizontalLayout.addItem(spacerRight)
 
         self.buttonFirstPage.clicked.connect(self.updatePages)
@@ -199,17 +265,26 @@ class BaseItemGroupBox(QGroupBox):
         self.spinBoxCurrentPage.valueChanged.connect(self.updatePages)
         self.buttonNextPage.clicked.connect(self.updatePages)
         self.buttonLastPage.clicked.connect(self.updatePages)
+        self.lineEditGoTo.returnPressed.connect(self.goToItem)
 
     @pyqtSlot(QItemSelection)
     def selectRadioItems(self, item=QItemSelection()):
-        if not item.indexes():
-            self.buttonEdit.setEnabled(False)
-            self.buttonDelete.setEnabled(False)
-            self.current_selection = None
-        else:
-            self.buttonEdit.setEnabled(True)
-            self.buttonDelete.setEnabled(True)
-            self.current_selection = self.model.rowData(item.indexes()[0])
+        indexes = item.indexes()
+        # In a windowed table the row's page may not be loaded yet; it is
+        # requested, and the buttons are enabled once it is (rowsLoaded).
+        self.current_selection = (self.model.rowData(indexes[0])
+                                  if indexes else None)
+        self.buttonEdit.setEnabled(self.current_selection is not None)
+        self.buttonDelete.setEnabled(self.current_selection is not None)
+
+    def rowsLoaded(self, top_left, bottom_right):
+        '''Catch up with a selected row whose page has just loaded.'''
+        if self.current_selection is not None:
+            return
+        selection = self.tableView.selectionModel().selection()
+        rows = [index.row() for index in selection.indexes()]
+        if rows and top_left.row() <= rows[0] <= bottom_right.row():
+            self.selectRadioItems(selection)
 
     @pyqtSlot()
     def updatePages(self, *args, **kwargs):
@@ -219,18 +294,19 @@ class BaseItemGroupBox(QGroupBox):
         current = self.spinBoxCurrentPage.value()
         maximum = self.spinBoxCurrentPage.maximum()
 
-        if sender.startswith('buttonFirstPage'):
-            self.spinBoxCurrentPage.setValue(minimum)
-        elif sender.startswith('buttonPreviousPage'):
-            if current > minimum:
-                self.spinBoxCurrentPage.setValue(current - 1)
-        elif sender.startswith('spinBoxCurrentPage'):
-            self.updateTable()
-        elif sender.startswith('buttonNextPage'):
-            if current < maximum:
-                self.spinBoxCurrentPage.setValue(current + 1)
-        elif sender.startswith('buttonLastPage'):
-            self.spinBoxCurrentPage.setValue(maximum)
+        with tracing.action('updatePages', label=sender, table=self.plural):
+            if sender.startswith('buttonFirstPage'):
+                self.spinBoxCurrentPage.setValue(minimum)
+            elif sender.startswith('buttonPreviousPage'):
+                if current > minimum:
+                    self.spinBoxCurrentPage.setValue(current - 1)
+            elif sender.startswith('spinBoxCurrentPage'):
+                self.updateTable()
+            elif sender.startswith('buttonNextPage'):
+                if current < maximum:
+                    self.spinBoxCurrentPage.setValue(current + 1)
+            elif sender.startswith('buttonLastPage'):
+                self.spinBoxCurrentPage.setValue(maximum)
 
     @pyqtSlot()
     def updateTable(self):
@@ -238,41 +314,267 @@ class BaseItemGroupBox(QGroupBox):
         Updates the data within the table view from the server. Also refreshes
         the page controls to reflect the current position.
         '''
-        if self.paginate:
-            self.model.current_page = self.spinBoxCurrentPage.value()
+        with tracing.action('updateTable', table=self.plural):
+            if self.paginate:
+                self.model.current_page = self.spinBoxCurrentPage.value()
 
-        self.model.updateData()
-        self.resizeColumns()
+            self.model.updateData()
+            self.resizeColumns()
+            self.showSortIndicator()
 
-        self.tableView.clearSelection()
-        self.current_selection = None
+            self.tableView.clearSelection()
+            self.current_selection = None
 
-        if self.paginate:
-            current = self.model.current_page
-            total = self.model.total_pages
-            begin = bool(current != 1)
-            end = bool(current != total)
-
-            self.buttonFirstPage.setEnabled(begin)
-            self.buttonPreviousPage.setEnabled(begin)
-            self.spinBoxCurrentPage.setMaximum(total)
-            self.labelTotalPages.setText('/ ' + str(total))
-            self.buttonNextPage.setEnabled(end)
-            self.buttonLastPage.setEnabled(end)
+            self.updatePageControls()
+
+    def updatePageControls(self):
+        '''Enables the page controls that lead somewhere from this page.'''
+        if not self.paginate:
+            return
+        current = self.model.current_page
+        total = self.model.total_pages
+        begin = bool(current != 1)
+        end = bool(current != total)
+
+        self.buttonFirstPage.setEnabled(begin)
+        self.buttonPreviousPage.setEnabled(begin)
+        self.spinBoxCurrentPage.setMaximum(total)
+        self.labelTotalPages.setText('/ ' + str(total))
+        self.buttonNextPage.setEnabled(end)
+        self.buttonLastPage.setEnabled(end)
+
+    @pyqtSlot()
+    def goToItem(self):
+        '''
+        Goes to the item whose id or title is in the go to box: to its page,
+        with its row selected. Items on pages seen before are gone to with a
+        single request, and others are looked for by binary search over the
+        pages, in the background.
+        '''
+        text = self.lineEditGoTo.text().strip()
+        if not text or not self.lineEditGoTo.isEnabled():
+            return
+        model = self.model
+        ordering = model.ordering()
+        with tracing.action('goToItem', table=self.plural):
+            if text.isdigit():
+                ids = [int(text)]
+            else:
+                ids = entity_index(self.plural).exact(text)
+            # Items already known to be on a page first.
+            ids.sort(key=lambda id: model.pageOf(id) is None)
+            if ids and model.pageOf(ids[0]) == model.current_page and \
+                    model.rowOf(ids[0]) is not None:
+                self.selectItem(ids[0])
+                return
+
+            if ids:
+                task = (find_item, self.plural, ids[0], ordering,
+                        model.total_pages, model.pageOf(ids[0]))
+            else:
+                task = (find_title, self.plural, text, ordering,
+                        model.total_pages)
+            self.lineEditGoTo.setEnabled(False)
+            run_task(*task,
+                     finished=lambda result: self.itemFound(text, ordering,
+                                                            result),
+                     failed=self.itemNotFound)
+
+    def itemFound(self, text, ordering, result):
+        self.lineEditGoTo.setEnabled(True)
+        page, id, seen = result
+        if ordering != self.model.ordering():
+            # Sorted differently while looking: the pages don't apply.
+            return
+        self.model.indexPages(seen)
+        if page is None:
+            _ = QCoreApplication.translate
+            QMessageBox.information(self, _('Client', 'Go to'),
+                                    _('Client', 'There is no {} "{}".')
+                                    .format(self.name, text))
+            return
+
+        with tracing.action('goToItem', label='page', table=self.plural,
+                            page=page):
+            if page != self.model.current_page:
+                self.spinBoxCurrentPage.setMaximum(
+                    max(page, self.model.total_pages))
+                self.spinBoxCurrentPage.setValue(page)
+            elif self.model.rowOf(id) is None:
+                # The page changed since it was loaded.
+                self.updateTable()
+            self.selectItem(id)
+
+    def itemNotFound(self, error):
+        self.lineEditGoTo.setEnabled(True)
+        _ = QCoreApplication.translate
+        QMessageBox.warning(self, _('Client', 'Go to'), str(error))
+
+    def selectItem(self, id):
+        '''Selects the row of an item on the current page, if it is there.'''
+        row = self.model.rowOf(id)
+        if row is None:
+            return
+        self.tableView.selectRow(row)
+        self.tableView.scrollTo(self.model.index(row, 0))
+        self.tableView.setFocus()
+
+    def autoRefresher(self):
+        if self.refresher is None:
+            self.refresher = AutoRefresher(self.model, self)
+            self.model.refreshed.connect(self.tableRefreshed)
+        return self.refresher
+
+    def tableRefreshed(self):
+        '''
+        Catches up with a refresh in the background: the number of pages may
+        have changed, and the selected item may be gone.
+        '''
+        self.updatePageControls()
+        self.selectRadioItems(self.tableView.selectionModel().selection())
 
+    @pyqtSlot(bool)
+    def setAutoRefresh(self, enabled):
+        '''
+        Turns refreshing the table in the background on or off. It only
+        happens while the table is shown.
+        '''
+        QSettings().setValue('refresh/' + self.plural, enabled)
+        if enabled and self.isVisible():
+            self.autoRefresher().start()
+        elif self.refresher is not None:
+            self.refresher.stop()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.checkBoxAutoRefresh.isChecked():
+            self.autoRefresher().start()
+
+    def hideEvent(self, event):
+        if self.refresher is not None:
+            self.refresher.stop()
+        super().hideEvent(event)
+
+    @pyqtSlot(int, Qt.SortOrder)
+    def sortTable(self, column, order):
+        '''
+        Sorts the table by a column whose header was clicked. Paginated and
+        windowed tables are sorted by the server, from the first page.
+        '''
+        with tracing.action('sortTable', label='sort ' + self.plural,
+                            column=column):
+            if not self.model.setSortColumn(column, order):
+                self.showSortIndicator()
+                return
+            if not self.model.sortsOnServer():
+                self.model.sortRows()
+                return
+            if self.paginate:
+                self.spinBoxCurrentPage.blockSignals(True)
+                self.spinBoxCurrentPage.setValue(1)
+                self.spinBoxCurrentPage.blockSignals(False)
+            self.updateTable()
+
+    def showSortIndicator(self):
+        '''Shows the model's sort column and order in the header.'''
+        header = self.tableView.horizontalHeader()
+        header.blockSignals(True)
+        header.setSortIndicator(self.model.sortColumn(),
+                                Qt.SortOrder(self.model.sort_order))
+        header.blockSignals(False)
+
+    @tracing.traced()
     def resizeColumns(self):
-        '''Automatically resizes table columns to fit new data.'''
+        '''
+        Sizes table columns to fit new data. Widths come from a sample of the
+        rows and are kept across refreshes, and widths set by the user win,
+        so the cost doesn't grow with the number of rows. The last column
+        stretches to fill the table.
+        '''
+        if self.user_column_widths is None:
+            self.loadColumnWidths()
+
+        header = self.tableView.horizontalHeader()
+        names = list(self.model.columns.keys())
+        self._sizing_columns = True
+        for column, name in enumerate(names[:-1]):
+            width = self.user_column_widths.get(name)
+            if width is None:
+                width = max(self.column_widths.get(name, 0),
+                            self.sampleColumnWidth(column))
+                self.column_widths[name] = width
+            if header.sectionSize(column) != width:
+                header.resizeSection(column, width)
+        self._sizing_columns = False
+
+    def sampleColumnWidth(self, column):
+        '''Width needed by the header and an evenly spaced sample of rows.'''
         header = self.tableView.horizontalHeader()
-        for column in range(self.model.columnCount()):
-            header.setSectionResizeMode(column, QHeaderView.Stretch)
+        title = self.model.headerData(column, Qt.Horizontal, Qt.DisplayRole)
+        width = header.fontMetrics().width(title or '')
+
+        rows = self.model.rowCount()
+        metrics = self.tableView.fontMetrics()
+        step = max(1, rows // self.column_sample_size)
+        for row in range(0, rows, step):
+            if not self.model.isRowLoaded(row):
+                continue
+            text = self.model.data(self.model.index(row, column),
+                                   Qt.DisplayRole)
+            if text is not None:
+                width = max(width, metrics.width(str(text)))
+
+        if column == 0 and self.model.thumbnails is not None:
+            width += self.delegate.thumbnailSize(metrics) + 4
+        # Room for the cell margins.
+        return min(width + 24, self.column_max_width)
+
+    def loadColumnWidths(self):
+        settings = QSettings()
+        settings.beginGroup('columns/' + self.plural)
+        self.user_column_widths = {name: settings.value(name, type=int)
+                                   for name in settings.childKeys()}
+        settings.endGroup()
+
+    @pyqtSlot(int, int, int)
+    def saveColumnWidth(self, column, old_width, new_width):
+        '''Remember a column width the user set by dragging the header.'''
+        last = self.tableView.horizontalHeader().count() - 1
+        if self._sizing_columns or column == last:
+            return
+        if self.user_column_widths is None:
+            self.loadColumnWidths()
+        name = list(self.model.columns.keys())[column]
+        self.user_column_widths[name] = new_width
+        QSettings().setValue('columns/' + self.plural + '/' + name, new_width)
 
     def showDialog(self):
         if self.sender().objectName().startswith('buttonEdit'):
-            dialog = BaseItemDialog(self, **self.current_selection)
+            # The table only holds the visible fields, so get the whole item
+            # (and its ETag, to save against) first.
+            self.buttonEdit.setEnabled(False)
+            run_task(poll_server_data,
+                     self.plural + '/' + str(self.current_selection['id']),
+                     finished=self.itemLoaded, failed=self.itemLoadFailed)
         else:
             dialog = BaseItemDialog(self)
+            dialog.exec_()
+            self.updateTable()
+
+    def itemLoaded(self, result):
+        self.buttonEdit.setEnabled(self.current_selection is not None)
+        status, etag, item = result
+        if status != 200:
+            self.itemLoadFailed(describe_error(status, item))
+            return
+        dialog = BaseItemDialog(self, etag=etag, **item)
         dialog.exec_()
-        self.updateTable()
+
+    def itemLoadFailed(self, error):
+        self.buttonEdit.setEnabled(self.current_selection is not None)
+        QMessageBox.warning(self, 'Edit ' + self.name,
+                            ('Could not load this ' + self.name + ':\n' +
+                             str(error)))
 
     def deleteItem(self):
         should_delete = QMessageBox.question(self,
@@ -283,8 +585,12 @@ class BaseItemGroupBox(QGroupBox):
                                              QMessageBox.No,
                                              QMessageBox.No)
         if should_delete == QMessageBox.Yes:
-            endpoint = self.plural + '/' + str(self.current_selection['id'])
-            status, results = delete_server_data(endpoint)
+            id = self.current_selection['id']
+            status, results = delete_server_data(self.plural + '/' + str(id))
+            # Forget it first, or the table would show it again from the
+            # store.
+            if status == 204:
+                entity_store().remove(self.plural, [id])
             self.updateTable()
 
     def retranslateUi(self):
@@ -293,12 +599,24 @@ class BaseItemGroupBox(QGroupBox):
 
         # Group Box header
         self.setTitle(_('Client', self.plural.capitalize()))
+        self.checkBoxAutoRefresh.setText(_('Client', 'Auto'))
+        self.checkBoxAutoRefresh.setToolTip(
+            _('Client', 'Refresh the table when it changes on the server'))
+        if self.paginate:
+            self.lineEditGoTo.setPlaceholderText(_('Client', 'Go to'))
+            self.lineEditGoTo.setToolTip(
+                _('Client', 'Go to a {} by its id or title').format(
+                    self.name))
 
 
 class AlbumGroupBox(BaseItemGroupBox):
     '''A GroupBox for administrating albums.'''
     def __init__(self, parent=None):
-        super().__init__(parent, name='album', plural='albums', vstretch=1)
+        super().__init__(parent,
+                         windowed=True,
+                         name='album',
+                         plural='albums',
+                         vstretch=1)
 
         self.columns = {'id': {'header': 'ID',
                                'visible': False,
@@ -311,13 +629,18 @@ class AlbumGroupBox(BaseItemGroupBox):
         self.tableView.setModel(self.model)
         selection_model = self.tableView.selectionModel()
         selection_model.selectionChanged.connect(self.selectRadioItems)
+        self.model.dataChanged.connect(self.rowsLoaded)
         self.updateTable()
 
 
 class ArtistGroupBox(BaseItemGroupBox):
     '''A GroupBox for administrating artists.'''
     def __init__(self, parent=None):
-        super().__init__(parent, name='artist', plural='artists', vstretch=2)
+        super().__init__(parent,
+                         windowed=True,
+                         name='artist',
+                         plural='artists',
+                         vstretch=2)
 
         self.columns = {'id': {'header': 'ID',
                                'visible': False,
@@ -336,13 +659,18 @@ class ArtistGroupBox(BaseItemGroupBox):
         self.tableView.setModel(self.model)
         selection_model = self.tableView.selectionModel()
         selection_model.selectionChanged.connect(self.selectRadioItems)
+        self.model.dataChanged.connect(self.rowsLoaded)
         self.updateTable()
 
 
 class GameGroupBox(BaseItemGroupBox):
     '''A GroupBox for administrating games.'''
     def __init__(self, parent=None):
-        super().__init__(parent, name='game', plural='games', vstretch=1)
+        super().__init__(parent,
+                         windowed=True,
+                         name='game',
+                         plural='games',
+                         vstretch=1)
 
         self.columns = {'id': {'header': 'ID',
                                'visible': False,
@@ -355,6 +683,7 @@ class GameGroupBox(BaseItemGroupBox):
         self.tableView.setModel(self.model)
         selection_model = self.tableView.selectionModel()
         selection_model.selectionChanged.connect(self.selectRadioItems)
+        self.model.dataChanged.connect(self.rowsLoaded)
         self.updateTable()
 
 
@@ -402,18 +731,9 @@ class SongGroupBox(BaseItemGroupBox):
         self.tableView.setModel(self.model)
         selection_model = self.tableView.selectionModel()
         selection_model.selectionChanged.connect(self.selectRadioItems)
+        self.model.dataChanged.connect(self.rowsLoaded)
         self.updateTable()
 
-    def resizeColumns(self):
-        header = self.tableView.horizontalHeader()
-        column_names = list(self.model.columns.keys())
-        for column in range(self.model.columnCount()):
-            if column_names[column] == 'song_type':
-                header.setSectionResizeMode(column,
-                                            QHeaderView.ResizeToContents)
-            else:
-                header.setSectionResizeMode(column, QHeaderView.Stretch)
-
 
 class PlaylistTab(QWidget):
     '''A widget for administrating the all models of the playlist data.'''
@@ -463,3 +783,361 @@ class ControlsTab(QWidget):
         super().__init__(parent)
 
         self.setObjectName('tabControls')
+        self.verticalLayout = QVBoxLayout(self)
+        self.verticalLayout.setObjectName('verticalLayoutControls')
+        self.verticalLayout.setContentsMargins(6, 6, 6, 6)
+        self.verticalLayout.setSpacing(6)
+
+        # Now playing
+        self.groupBoxNowPlaying = QGroupBox(self)
+        self.groupBoxNowPlaying.setObjectName('groupBoxNowPlaying')
+        self.formLayout = QFormLayout(self.groupBoxNowPlaying)
+        self.formLayout.setObjectName('formLayoutNowPlaying')
+        self.labelTitle = QLabel(self.groupBoxNowPlaying)
+        self.labelTitle.setObjectName('labelTitle')
+        self.labelTitleValue = QLabel(self.groupBoxNowPlaying)
+        self.labelTitleValue.setObjectName('labelTitleValue')
+        font = QFont()
+        font.setBold(True)
+        font.setWeight(75)
+        self.labelTitleValue.setFont(font)
+        self.labelArtists = QLabel(self.groupBoxNowPlaying)
+        self.labelArtists.setObjectName('labelArtists')
+        self.labelArtistsValue = QLabel(self.groupBoxNowPlaying)
+        self.labelArtistsValue.setObjectName('labelArtistsValue')
+        self.labelGame = QLabel(self.groupBoxNowPlaying)
+        self.labelGame.setObjectName('labelGame')
+        self.labelGameValue = QLabel(self.groupBoxNowPlaying)
+        self.labelGameValue.setObjectName('labelGameValue')
+        self.formLayout.addRow(self.labelTitle, self.labelTitleValue)
+        self.formLayout.addRow(self.labelArtists, self.labelArtistsValue)
+        self.formLayout.addRow(self.labelGame, self.labelGameValue)
+        self.verticalLayout.addWidget(self.groupBoxNowPlaying)
+
+        # Upcoming queue and recent history
+        self.horizontalSplitter = QSplitter(self)
+        self.horizontalSplitter.setObjectName('horizontalSplitterControls')
+        self.horizontalSplitter.setChildrenCollapsible(False)
+        self.groupBoxQueue = QGroupBox(self.horizontalSplitter)
+        self.groupBoxQueue.setObjectName('groupBoxQueue')
+        self.verticalLayoutQueue = QVBoxLayout(self.groupBoxQueue)
+        self.verticalLayoutQueue.setObjectName('verticalLayoutQueue')
+        self.verticalLayoutQueue.setContentsMargins(3, 3, 3, 3)
+        self.listWidgetQueue = QListWidget(self.groupBoxQueue)
+        self.listWidgetQueue.setObjectName('listWidgetQueue')
+        self.verticalLayoutQueue.addWidget(self.listWidgetQueue)
+        self.buttonRotation = QPushButton(self.groupBoxQueue)
+        self.buttonRotation.setObjectName('buttonRotation')
+        self.buttonRotation.clicked.connect(self.showRotation)
+        self.verticalLayoutQueue.addWidget(self.buttonRotation)
+        self.groupBoxHistory = QGroupBox(self.horizontalSplitter)
+        self.groupBoxHistory.setObjectName('groupBoxHistory')
+        self.verticalLayoutHistory = QVBoxLayout(self.groupBoxHistory)
+        self.verticalLayoutHistory.setObjectName('verticalLayoutHistory')
+        self.verticalLayoutHistory.setContentsMargins(3, 3, 3, 3)
+        self.tableViewHistory = QTableView(self.groupBoxHistory)
+        self.tableViewHistory.setObjectName('tableViewHistory')
+        self.tableViewHistory.setSelectionBehavior(
+            QAbstractItemView.SelectRows)
+        self.tableViewHistory.verticalHeader().hide()
+        self.tableViewHistory.horizontalHeader().setStretchLastSection(True)
+        self.verticalLayoutHistory.addWidget(self.tableViewHistory)
+        self.verticalLayout.addWidget(self.horizontalSplitter)
+
+        # Play history is kept between sessions. It is saved a little while
+        # after it changes, and when the application quits.
+        settings = QSettings()
+        capacity = settings.value('history/capacity', 500, type=int)
+        self.historyModel = PlayHistoryModel(capacity, self)
+        self.historyModel.load(self.historyPath())
+        self.tableViewHistory.setModel(self.historyModel)
+        self.history_seeded = False
+        self.timerSaveHistory = QTimer(self)
+        self.timerSaveHistory.setSingleShot(True)
+        self.timerSaveHistory.setInterval(30000)
+        self.timerSaveHistory.timeout.connect(self.saveHistory)
+        QCoreApplication.instance().aboutToQuit.connect(self.saveHistory)
+
+        # Loaded the first time a rotation is generated, then kept current
+        # with the songs that play.
+        self.rotation_generator = None
+        self.queue_ids = []
+        entity_store().entitiesChanged.connect(self.entitiesChanged)
+        entity_store().entitiesRemoved.connect(self.entitiesRemoved)
+
+        # Only poll the server while the tab can actually be seen.
+        self.poller = NowPlayingPoller(self)
+        self.poller.statusChanged.connect(self.updateStatus)
+
+        self.retranslateUi()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.history_seeded:
+            self.seedHistory()
+        self.poller.start()
+
+    def hideEvent(self, event):
+        self.poller.stop()
+        super().hideEvent(event)
+
+    def updateStatus(self, status):
+        '''Show the station status received from the server.'''
+        current = status.get('current') or {}
+        game = current.get('game') or {}
+        self.labelTitleValue.setText(current.get('title', ''))
+        self.labelArtistsValue.setText(', '.join(
+            [full_name(a) for a in current.get('artists') or []]))
+        self.labelGameValue.setText(game.get('title', ''))
+
+        self.listWidgetQueue.clear()
+        self.listWidgetQueue.addItems(
+            [song_description(s) for s in status.get('queue') or []])
+        # The song playing and those queued aren't picked for a rotation.
+        queue = status.get('queue') or []
+        self.queue_ids = [s['id'] for s in [current] + queue if s.get('id')]
+        if self.rotation_generator is not None and current.get('id'):
+            played = {'id': current['id'],
+                      'last_played': current.get('started_at')}
+            if current.get('num_played') is not None:
+                played['num_played'] = current['num_played']
+            self.rotation_generator.update([played])
+        entries = [history_entry(current, 'started_at')]
+        entries += [history_entry(s, 'played_at')
+                    for s in status.get('history') or []]
+        self.historyModel.record(entries)
+        self.timerSaveHistory.start()
+
+    def showRotation(self):
+        '''Open the dialog for generating a rotation.'''
+        dialog = RotationDialog(self, self.queue_ids)
+        dialog.exec_()
+
+    def entitiesChanged(self, kind, ids):
+        '''Keep the rotation's statistics in step with edited songs.'''
+        generator = self.rotation_generator
+        if kind != 'songs' or generator is None:
+            return
+        store = entity_store()
+        songs = [store.get(kind, id) for id in ids]
+        generator.update([s for s in songs if s is not None and
+                          generator.catalog.row(s['id']) is not None])
+
+    def entitiesRemoved(self, kind, ids):
+        '''Stop picking songs deleted elsewhere in the client.'''
+        if kind == 'songs' and self.rotation_generator is not None:
+            self.rotation_generator.remove(ids)
+
+    def seedHistory(self):
+        '''Fill the history from the songs the server last played.'''
+        self.history_seeded = True
+        fields = ['id', 'title', 'artists', 'game', 'last_played',
+                  'num_played']
+        run_task(get_server_data, 'songs', 1, fields, '-last_played',
+                 priority=VISIBLE, finished=self.historySeeded)
+
+    def historySeeded(self, result):
+        status, results = result
+        if status == 200:
+            self.historyModel.record([history_entry(s, 'last_played')
+                                      for s in results['results']])
+
+    def historyPath(self):
+        location = QStandardPaths.writableLocation(
+            QStandardPaths.AppDataLocation)
+        return os.path.join(location, 'history.json')
+
+    def saveHistory(self):
+        self.timerSaveHistory.stop()
+        try:
+            self.historyModel.save(self.historyPath())
+        except OSError:
+            pass
+
+    def retranslateUi(self):
+        '''Translate labels into the native OS language.'''
+        _ = QCoreApplication.translate
+
+        self.groupBoxNowPlaying.setTitle(_('Client', 'Now Playing'))
+        self.labelTitle.setText(_('Client', 'Title:'))
+        self.labelArtists.setText(_('Client', 'Artists:'))
+        self.labelGame.setText(_('Client', 'Game:'))
+        self.groupBoxQueue.setTitle(_('Client', 'Up Next'))
+        self.buttonRotation.setText(_('Client', 'Generate Rotation...'))
+        self.groupBoxHistory.setTitle(_('Client', 'Recently Played'))
+
+
+class StatisticsTab(QWidget):
+    '''A widget summarizing play statistics over the whole song catalog.'''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.statistics = None
+        self.loading = False
+
+        self.setObjectName('tabStatistics')
+        self.verticalLayout = QVBoxLayout(self)
+        self.verticalLayout.setObjectName('verticalLayoutStatistics')
+        self.verticalLayout.setContentsMargins(6, 6, 6, 6)
+        self.verticalLayout.setSpacing(6)
+
+        self.horizontalLayout = QHBoxLayout()
+        self.horizontalLayout.setObjectName('horizontalLayoutStatistics')
+        self.buttonRefresh = QPushButton(self)
+        self.buttonRefresh.setObjectName('buttonRefreshStatistics')
+        icon = QIcon()
+        icon.addPixmap(QPixmap(':/icons/refresh.svg'), QIcon.Normal, QIcon.On)
+        self.buttonRefresh.setIcon(icon)
+        self.buttonRefresh.setFlat(True)
+        self.labelStatus = QLabel(self)
+        self.labelStatus.setObjectName('labelStatusStatistics')
+        self.horizontalLayout.addWidget(self.buttonRefresh)
+        self.horizontalLayout.addWidget(self.labelStatus)
+        self.horizontalLayout.addItem(QSpacerItem(40, 20,
+                                                  QSizePolicy.Expanding,
+                                                  QSizePolicy.Minimum))
+        self.verticalLayout.addLayout(self.horizontalLayout)
+
+        # Catalog-wide figures
+        self.formLayout = QFormLayout()
+        self.formLayout.setObjectName('formLayoutStatistics')
+        self.summaryLabels = {}
+        for key in ('songs', 'total_length', 'total_plays', 'average_plays',
+                    'never_played'):
+            label = QLabel(self)
+            value = QLabel(self)
+            value.setObjectName('labelStatistics' + key.title()
+                                .replace('_', ''))
+            self.formLayout.addRow(label, value)
+            self.summaryLabels[key] = (label, value)
+        self.verticalLayout.addLayout(self.formLayout)
+
+        # Top lists
+        self.gridLayout = QGridLayout()
+        self.gridLayout.setObjectName('gridLayoutStatistics')
+        self.summaryTables = {}
+        for position, key in enumerate(('most_played', 'least_played',
+                                        'distribution', 'per_game',
+                                        'per_album')):
+            groupBox = QGroupBox(self)
+            groupBox.setObjectName('groupBoxStatistics' + key.title()
+                                   .replace('_', ''))
+            layout = QVBoxLayout(groupBox)
+            layout.setContentsMargins(3, 3, 3, 3)
+            table = QTableWidget(0, 2, groupBox)
+            table.verticalHeader().hide()
+            table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            table.horizontalHeader().setSectionResizeMode(
+                0, QHeaderView.Stretch)
+            layout.addWidget(table)
+            self.gridLayout.addWidget(groupBox, position // 3, position % 3)
+            self.summaryTables[key] = (groupBox, table)
+        self.verticalLayout.addLayout(self.gridLayout)
+
+        # Recomputing is cheap, but coalesce bursts of changes anyway.
+        self.timerSummary = QTimer(self)
+        self.timerSummary.setSingleShot(True)
+        self.timerSummary.setInterval(200)
+        self.timerSummary.timeout.connect(self.updateSummary)
+
+        self.store = entity_store()
+        self.store.entitiesChanged.connect(self.entitiesChanged)
+        self.store.entitiesRemoved.connect(self.entitiesRemoved)
+        self.buttonRefresh.clicked.connect(self.loadStatistics)
+
+        self.retranslateUi()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.statistics is None:
+            self.loadStatistics()
+
+    def loadStatistics(self):
+        '''Load the catalog's statistics from the server in the background.'''
+        if self.loading:
+            return
+        self.loading = True
+        self.buttonRefresh.setEnabled(False)
+        self.labelStatus.setText(QCoreApplication.translate(
+            'Client', 'Loading the song catalog...'))
+        run_task(load_catalog_statistics,
+                 finished=self.statisticsLoaded, failed=self.loadFailed)
+
+    def statisticsLoaded(self, statistics):
+        self.loading = False
+        self.buttonRefresh.setEnabled(True)
+        self.labelStatus.setText('')
+        self.statistics = statistics
+        self.updateSummary()
+
+    def loadFailed(self, error):
+        self.loading = False
+        self.buttonRefresh.setEnabled(True)
+        self.labelStatus.setText(str(error))
+
+    def entitiesChanged(self, kind, ids):
+        '''Fold edits made elsewhere in the client into the statistics.'''
+        if self.statistics is None:
+            return
+        if kind == 'songs':
+            songs = [self.store.get(kind, id) for id in ids]
+            self.statistics.update([s for s in songs if s is not None])
+        elif kind in ('albums', 'games'):
+            titles = getattr(self.statistics, kind[:-1] + '_titles')
+            for id in ids:
+                item = self.store.get(kind, id)
+                if item is not None and 'title' in item:
+                    titles[id] = item['title']
+        else:
+            return
+        self.timerSummary.start()
+
+    def entitiesRemoved(self, kind, ids):
+        '''Drop songs deleted elsewhere in the client from the statistics.'''
+        if self.statistics is None or kind != 'songs':
+            return
+        self.statistics.remove(ids)
+        self.timerSummary.start()
+
+    def updateSummary(self):
+        summary = self.statistics.summary()
+        values = {'songs': str(summary['songs']),
+                  'total_length': format_duration(summary['total_length']),
+                  'total_plays': str(summary['total_plays']),
+                  'average_plays': '{:.1f}'.format(summary['average_plays']),
+                  'never_played': str(summary['never_played'])}
+        for key, text in values.items():
+            self.summaryLabels[key][1].setText(text)
+
+        for key, (groupBox, table) in self.summaryTables.items():
+            rows = summary[key]
+            table.setRowCount(len(rows))
+            for row, (name, count) in enumerate(rows):
+                table.setItem(row, 0, QTableWidgetItem(name))
+                item = QTableWidgetItem(str(count))
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                table.setItem(row, 1, item)
+
+    def retranslateUi(self):
+        '''Translate labels into the native OS language.'''
+        _ = QCoreApplication.translate
+
+        labels = {'songs': 'Songs:',
+                  'total_length': 'Total duration:',
+                  'total_plays': 'Total plays:',
+                  'average_plays': 'Average plays per song:',
+                  'never_played': 'Never played:'}
+        for key, text in labels.items():
+            self.summaryLabels[key][0].setText(_('Client', text))
+
+        titles = {'most_played': ('Most Played', 'Song'),
+                  'least_played': ('Least Played', 'Song'),
+                  'distribution': ('Play Count Distribution', 'Times played'),
+                  'per_game': ('Plays per Game', 'Game'),
+                  'per_album': ('Plays per Album', 'Album')}
+        for key, (title, header) in titles.items():
+            groupBox, table = self.summaryTables[key]
+            groupBox.setTitle(_('Client', title))
+            table.setHorizontalHeaderLabels(
+                [_('Client', header),
+                 _('Client', 'Songs' if key == 'distribution' else 'Plays')])